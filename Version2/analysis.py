@@ -0,0 +1,159 @@
+import numpy as np
+from data_save import load_measurement
+from sweep_data import reading_axis
+
+# Analysis of saved sweeps, done with whole array operations on the typed columns.
+# C-V:  oxide capacitance, flat-band voltage (peak of d2(1/C^2)/dV2), threshold voltage
+#       (depletion tangent of 1/C^2 extrapolated to the inversion capacitance) and, for
+#       double sweeps (IB3), the hysteresis between the two branches.
+# C-t:  exponential decay C(t) = C_inf + A exp(-t / tau), fitted in log space for a grid of
+#       C_inf candidates at once.
+
+MIN_POINTS = 5  # Fewer readings than this are not analysed
+SMOOTH_POINTS = 5  # Moving average over 1/C^2 before differentiating (used from 3 * SMOOTH_POINTS readings)
+DECAY_CANDIDATES = 200  # C_inf values tried by the C-t fit
+
+def number(value):
+    return None if value is None or not np.isfinite(value) else float(value)
+
+# Swept value and capacitance of a measurement, without unusable readings
+def measurement_curve(prefixes, values):
+    axis, column = reading_axis(prefixes)
+    values = np.asarray(values, dtype=float)
+    if axis is None or values.ndim != 2 or values.shape[0] == 0:
+        return None, np.empty(0), np.empty(0)
+    x, c = values[:, column], values[:, 0]
+    keep = np.isfinite(x) & np.isfinite(c) & (c != 0)
+    return axis, x[keep], c[keep]
+
+def smooth(values):
+    if len(values) < 3 * SMOOTH_POINTS:
+        return values
+    padded = np.pad(values, SMOOTH_POINTS // 2, mode="edge")
+    return np.convolve(padded, np.ones(SMOOTH_POINTS) / SMOOTH_POINTS, mode="valid")
+
+# Splits a sweep where the voltage turns around; a single sweep is one branch
+def sweep_branches(v):
+    direction = np.sign(np.diff(v))
+    moving = np.nonzero(direction)[0]
+    if len(moving) == 0:
+        return [slice(0, len(v))]
+    turns = moving[direction[moving] != direction[moving[0]]]
+    if len(turns) == 0:
+        return [slice(0, len(v))]
+    return [slice(0, turns[0] + 1), slice(turns[0], len(v))]
+
+# First voltage where the capacitance crosses level, linearly interpolated
+def crossing(v, c, level):
+    sides = np.sign(c - level)
+    changes = np.nonzero(sides[:-1] * sides[1:] <= 0)[0]
+    if len(changes) == 0:
+        return None
+    i = changes[0]
+    if c[i + 1] == c[i]:
+        return float(v[i])
+    return float(v[i] + (level - c[i]) * (v[i + 1] - v[i]) / (c[i + 1] - c[i]))
+
+def cv_parameters(v, c):
+    v, first = np.unique(v, return_index=True)  # Sorted by voltage, one reading per voltage
+    c = c[first]
+    if len(v) < MIN_POINTS:
+        return None
+
+    cox, cmin = c.max(), c.min()
+    inverse = smooth(1 / c ** 2)
+    slope = np.gradient(inverse, v)
+    curvature = np.gradient(slope, v)
+
+    # 1/C^2 bends up where accumulation ends, whichever way the substrate is doped
+    flat_band = int(np.argmax(curvature))
+    steepest = int(np.argmax(np.abs(slope)))
+    threshold = None
+    if slope[steepest] != 0:
+        threshold = v[steepest] + (1 / cmin ** 2 - inverse[steepest]) / slope[steepest]
+
+    return {
+        "points": int(len(v)),
+        "substrate": "p" if slope[steepest] > 0 else "n",
+        "cox": number(cox),
+        "cmin": number(cmin),
+        "vfb": number(v[flat_band]),
+        "cfb": number(c[flat_band]),
+        "vth": number(threshold),
+        "vmid": crossing(v, c, (cox + cmin) / 2),
+    }
+
+def analyze_cv(v, c):
+    branches = [cv_parameters(v[part], c[part]) for part in sweep_branches(v)]
+    branches = [branch for branch in branches if branch is not None]
+    if not branches:
+        return None
+    result = dict(branches[0], sweep="double" if len(branches) > 1 else "single", branches=branches)
+    if len(branches) > 1:
+        forward, reverse = branches
+        result["hysteresis"] = {
+            "vfb_shift": number(reverse["vfb"] - forward["vfb"]),
+            "vmid_shift": None if None in (forward["vmid"], reverse["vmid"]) else number(reverse["vmid"] - forward["vmid"]),
+        }
+    return result
+
+def analyze_ct(t, c):
+    order = np.argsort(t, kind="stable")
+    t, c = t[order], c[order]
+    if len(t) < MIN_POINTS or t[-1] == t[0]:
+        return None
+    span = c[0] - c[-1]
+    if span == 0:
+        return None
+    sign = np.sign(span)  # +1 for a decaying transient, -1 for a recovering one
+
+    # Every candidate lies beyond the last readings, so C - C_inf keeps one sign
+    edge = c.min() if sign > 0 else c.max()
+    c_inf = edge - sign * abs(span) * np.geomspace(1e-4, 10, DECAY_CANDIDATES)[:, None]
+    logs = np.log(sign * (c[None, :] - c_inf))
+
+    centred = t - t.mean()
+    slopes = (logs - logs.mean(axis=1, keepdims=True)) @ centred / (centred @ centred)
+    intercepts = logs.mean(axis=1) - slopes * t.mean()
+    fitted = c_inf + sign * np.exp(intercepts[:, None] + slopes[:, None] * t[None, :])
+    errors = ((c[None, :] - fitted) ** 2).sum(axis=1)
+    errors[slopes >= 0] = np.inf
+    best = int(np.argmin(errors))
+    if not np.isfinite(errors[best]):
+        return None
+
+    total = ((c - c.mean()) ** 2).sum()
+    return {
+        "points": int(len(t)),
+        "c0": number(fitted[best, 0]),
+        "c_inf": number(c_inf[best, 0]),
+        "amplitude": number(sign * np.exp(intercepts[best])),
+        "tau": number(-1 / slopes[best]),
+        "r_squared": number(1 - errors[best] / total) if total > 0 else None,
+    }
+
+# Analysis of one measurement's typed columns
+def analyze(prefixes, values):
+    axis, x, c = measurement_curve(prefixes, values)
+    match axis:
+        case "V":
+            return {"type": "C-V", "result": analyze_cv(x, c)}
+        case "T":
+            return {"type": "C-t", "result": analyze_ct(x, c)}
+        case _:
+            return {"type": None, "result": None}
+
+def analyze_file(path):
+    prefixes, values, _ = load_measurement(path)
+    return analyze(prefixes, values)
+
+# Analyses many saved measurements; a file that cannot be read gets an error entry
+def analyze_files(paths):
+    results = {}
+    for path in paths:
+        try:
+            results[path] = analyze_file(path)
+        except Exception as e:
+            print(f"Could not analyse {path}: {e}")
+            results[path] = {"type": None, "result": None, "error": str(e)}
+    return results
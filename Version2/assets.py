@@ -0,0 +1,111 @@
+import gzip
+import hashlib
+import os
+import threading
+
+# Bundled front-end files (static/), served by the app so graphs load without internet.
+# The precompressed .gz and .br copies next to each file are not kept in git. They are made by
+#   python assets.py
+# before a build, and any that are missing or older than their file are made when the app starts.
+# URLs carry a hash of the file, so browsers may cache them for a year and still pick up a new
+# version straight away.
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))  # Preferred first
+CACHE_SECONDS = 365 * 24 * 3600
+
+# The graphs only draw scatter traces, so the scatter-only "basic" Plotly bundle is used when it
+# is in static/vendor (see publish.md); the full bundle is the fallback
+PLOTLY_BUNDLES = ("vendor/plotly-basic-3.0.1.min.js", "vendor/plotly-3.0.1.min.js")
+
+_etags = {}  # name -> hash of the uncompressed file
+_etag_lock = threading.Lock()
+
+def asset_path(name):
+    path = os.path.normpath(os.path.join(STATIC_FOLDER, name))
+    if not path.startswith(STATIC_FOLDER + os.sep) or path.endswith(tuple(ext for _, ext in ENCODINGS)):
+        return None
+    return path if os.path.isfile(path) else None
+
+# Content hash of an asset, read once per run (the files do not change while the app runs)
+def asset_etag(name):
+    with _etag_lock:
+        etag = _etags.get(name)
+    if etag is None:
+        path = asset_path(name)
+        if path is None:
+            return None
+        with open(path, 'rb') as file:
+            etag = hashlib.sha256(file.read()).hexdigest()[:16]
+        with _etag_lock:
+            _etags[name] = etag
+    return etag
+
+# Name of the Plotly bundle the graph pages load
+def plotly_bundle():
+    for name in PLOTLY_BUNDLES:
+        if asset_path(name) is not None:
+            return name
+    return PLOTLY_BUNDLES[-1]
+
+# Returns (path, content encoding or None, etag) of the best copy the client accepts
+def find_asset(name, accept_encoding=""):
+    path = asset_path(name)
+    if path is None:
+        return None
+    etag = asset_etag(name)
+    accepted = {part.split(';')[0].strip() for part in accept_encoding.split(',')}
+    for encoding, extension in ENCODINGS:
+        if encoding in accepted and os.path.isfile(path + extension):
+            return path + extension, encoding, f"{etag}-{encoding}"
+    return path, None, etag
+
+# Writes the .gz and .br copies of every file in static/. Copies newer than their file are kept,
+# unless force is set. Brotli needs the brotli package; without it only gzip copies are made.
+def precompress(folder=STATIC_FOLDER, force=False, verbose=True):
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+        if verbose:
+            print("brotli is not installed, skipping .br files")
+
+    compressors = [(".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        compressors.append((".br", lambda data: brotli.compress(data, quality=11)))
+
+    for root, _, files in os.walk(folder):
+        for filename in files:
+            if filename.endswith(tuple(ext for _, ext in ENCODINGS) + (".part",)):
+                continue
+            path = os.path.join(root, filename)
+            stale = [(extension, compress) for extension, compress in compressors
+                     if force or not os.path.isfile(path + extension)
+                     or os.path.getmtime(path + extension) < os.path.getmtime(path)]
+            if not stale:
+                continue
+            with open(path, 'rb') as file:
+                data = file.read()
+            for extension, compress in stale:
+                # Written under another name first, so a request never gets a half-written copy
+                partial = path + extension + ".part"
+                with open(partial, 'wb') as file:
+                    file.write(compress(data))
+                os.replace(partial, path + extension)
+            if verbose:
+                print(f"Compressed {os.path.relpath(path, folder)}")
+
+# Makes missing copies in the background when the app starts; files are sent uncompressed until then.
+# Does nothing if static/ is read-only (e.g. an installed build without the copies).
+def precompress_in_background(folder=STATIC_FOLDER):
+    def run():
+        try:
+            precompress(folder, verbose=False)
+        except OSError as e:
+            print(f"Could not compress the front-end files: {e}")
+    thread = threading.Thread(target=run, name="precompress", daemon=True)
+    thread.start()
+    return thread
+
+if __name__ == "__main__":
+    precompress(force=True)
@@ -0,0 +1,214 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Asyncio front end for the blocking VISA layer.
+# Each instrument gets one executor thread, so its calls stay in order while a single
+# event loop can wait on many instruments (and their status checks) at the same time.
+# A call that times out or is cancelled while it is talking to the instrument sends a
+# device clear, which makes the instrument abandon the operation and frees the executor
+# thread. A call still waiting for the executor or the bus is just dropped: clearing then
+# would abort whatever another caller is doing. Nothing here blocks the event loop: the
+# clear itself runs on a worker thread too.
+
+DEFAULT_TIMEOUT = 10.0  # Seconds, same as the VISA timeout VisaCon uses
+PROBE_TIMEOUT = 2.0
+NO_TIMEOUT = float("inf")
+LOCK_POLL = 0.1  # Seconds between checks for cancellation while waiting for the bus
+
+class PendingCall:
+    def __init__(self, func, args, lock=None):
+        self.func = func
+        self.args = args
+        self.lock = lock  # Bus lock taken for the call, None to run it without
+        self.guard = threading.Lock()
+        self.started = False  # Set once the call holds the bus and may be talking to the instrument
+        self.cancelled = False
+
+    # Runs on the executor thread; a call cancelled before it got the bus never runs
+    def __call__(self):
+        if self.lock is None:
+            return self.start()
+        while not self.lock.acquire(timeout=LOCK_POLL):
+            if self.cancelled:
+                return None
+        try:
+            return self.start()
+        finally:
+            self.lock.release()
+
+    def start(self):
+        with self.guard:
+            if self.cancelled:
+                return None
+            self.started = True
+        return self.func(*self.args)
+
+    # Drops the call; returns True if it had already started
+    def cancel(self):
+        with self.guard:
+            self.cancelled = True
+            return self.started
+
+# Stands in for a job when a sweep is run without one, so cancelling the task still stops it
+class CancelToken:
+    def __init__(self):
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def set_progress(self, fraction, message=None):
+        pass
+
+    def publish(self, point):
+        pass
+
+class AsyncVisaCon:
+    def __init__(self, conn, executor=None, timeout=DEFAULT_TIMEOUT):
+        self.conn = conn  # VisaCon or SimulatedVisaCon
+        self.timeout = timeout
+        self.own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"visa-{conn.get_MAC()}")
+
+    # Runs func(*args) on the instrument's thread, holding lock if one is given. timeout=None
+    # uses the default and NO_TIMEOUT waits as long as it takes. On timeout or cancellation
+    # the call is dropped, the instrument is cleared if the call had started, and the
+    # exception is passed on.
+    async def run(self, func, *args, timeout=None, lock=None):
+        if timeout is None:
+            timeout = self.timeout
+        call = PendingCall(func, args, lock)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, call)
+        try:
+            return await asyncio.wait_for(future, None if timeout == NO_TIMEOUT else timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if call.cancel():
+                # Not on the instrument's thread, which is still busy with the call. A call
+                # holding the bus is cleared at once; a sweep only holds it for each exchange
+                loop.run_in_executor(None, self.abort if lock is not None else self.abort_exchange)
+            raise
+
+    # Runs func while holding the connection's I/O lock, like the controller's bus methods
+    async def locked(self, func, *args, timeout=None):
+        return await self.run(func, *args, timeout=timeout, lock=getattr(self.conn, "io_lock", None))
+
+    # Device clear once the exchange in progress (if any) is over
+    def abort_exchange(self):
+        lock = getattr(self.conn, "io_lock", None)
+        if lock is None:
+            return self.abort()
+        with lock:
+            self.abort()
+
+    # Device clear. Deliberately skips the I/O lock: the call being aborted is holding it.
+    def abort(self):
+        inst = self.conn.inst
+        if inst is None:
+            return
+        try:
+            inst.clear()
+            print(f"Cleared {self.conn.get_MAC()} after a timed out or cancelled call")
+        except Exception as e:
+            print(f"Could not clear {self.conn.get_MAC()}: {e}")
+
+    async def connect(self, timeout=None):
+        await self.run(self.conn.connect, timeout=timeout)
+        return self.conn.check_connection()
+
+    async def disconnect(self, timeout=None):
+        await self.run(self.conn.disconnect, timeout=timeout)
+
+    async def write(self, cmd, timeout=None):
+        return await self.locked(self.require_inst().write, cmd, timeout=timeout)
+
+    async def query(self, cmd, timeout=None):
+        return await self.locked(self.require_inst().query, cmd, timeout=timeout)
+
+    async def read(self, timeout=None):
+        return await self.locked(self.require_inst().read, timeout=timeout)
+
+    # Reads a whole response block, joining the chunks the instrument sends
+    async def read_block(self, timeout=None):
+        if not hasattr(self.conn, "read_stream"):
+            return await self.read(timeout=timeout)
+
+        def read_all():
+            return b"".join(self.conn.read_stream()).decode("ascii", errors="replace")
+        return await self.locked(read_all, timeout=timeout)
+
+    # Cheap liveness check, e.g. for a status page polling many instruments
+    async def probe(self, command="ID?", timeout=PROBE_TIMEOUT):
+        try:
+            await self.query(command, timeout=timeout)
+            self.conn.connected = True
+        except Exception:
+            self.conn.connected = False
+        return self.conn.connected
+
+    def require_inst(self):
+        if self.conn.inst is None:
+            raise ConnectionError(f"No connection to instrument at {self.conn.get_MAC()}.")
+        return self.conn.inst
+
+    def close(self):
+        if self.own_executor:
+            self.executor.shutdown(wait=False)
+
+
+class AsyncController:
+    def __init__(self, ctrl, executor=None, timeout=DEFAULT_TIMEOUT):
+        self.ctrl = ctrl  # The shared synchronous controller, so the state cache stays in one place
+        self.io = AsyncVisaCon(ctrl.conn, executor=executor, timeout=timeout)
+
+    async def command(self, cmd, timeout=None):
+        return await self.io.locked(self.ctrl.command, cmd, timeout=timeout)
+
+    async def write(self, cmd, timeout=None):
+        return await self.io.locked(self.ctrl.write, cmd, timeout=timeout)
+
+    async def read(self, timeout=None):
+        return await self.io.locked(self.ctrl.read, timeout=timeout)
+
+    async def query(self, cmd, timeout=None):
+        return await self.io.locked(self.ctrl.rq, cmd, timeout=timeout)
+
+    async def read_block(self, on_point=None, timeout=None):
+        return await self.io.locked(self.ctrl.ReadBlockResponseAscii, on_point, timeout=timeout)
+
+    # Runs a standard sweep and returns the saved file name. timeout=None waits as long
+    # as the sweep takes; cancelling the task clears the instrument and stops waiting.
+    # Without a job the sweep gets a CancelToken, so it always has something to check.
+    async def sweep(self, job=None, transfer="ascii", storage="csv", timeout=None):
+        job = job if job is not None else CancelToken()
+        try:
+            return await self.io.run(self.ctrl.sweep_measure, job, transfer, storage, timeout=timeout or NO_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            self.stopped(job)
+            raise
+
+    async def pulse_sweep(self, job=None, storage="csv", timeout=None):
+        job = job if job is not None else CancelToken()
+        try:
+            return await self.io.run(self.ctrl.pulse_sweep, job, storage, timeout=timeout or NO_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            self.stopped(job)
+            raise
+
+    # The device clear reset whatever the instrument was set to. Cancelling the job ends the
+    # sweep's wait on the instrument's thread, and a pulse sweep stops before the next pulse
+    def stopped(self, job):
+        self.ctrl.invalidate_state()
+        job.cancel()
+
+    def close(self):
+        self.io.close()
+
+# Probes every instrument at once and returns {address: connected}
+async def probe_all(connections, timeout=PROBE_TIMEOUT):
+    results = await asyncio.gather(*(conn.probe(timeout=timeout) for conn in connections))
+    return {conn.conn.get_MAC(): result for conn, result in zip(connections, results)}
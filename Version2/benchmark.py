@@ -0,0 +1,307 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+import numpy as np
+
+# Benchmarks of the measurement pipeline, run against the simulated instrument.
+#   python benchmark.py                          full run, JSON results on stdout
+#   python benchmark.py --quick -o results.json  smaller sizes, results saved to a file
+#   python benchmark.py --compare baseline.json  exits with 1 when a median got slower than allowed
+# The database and HPData folder are created in a temporary folder, so real users and
+# measurements are never touched. With --time-scale 0 (the default) the simulator answers at
+# once and the results show the time spent in this program; a larger scale adds the modelled
+# instrument and bus time on top.
+
+RESULTS_VERSION = 1  # Changes when the layout of the results does
+DEFAULT_REPEAT = 5
+DEFAULT_TOLERANCE = 0.25  # --compare allows medians up to 25% slower than the baseline
+
+CONFIG_METHODS = ("single_config", "default_single", "default_CT")
+READOUT_POINTS = (10, 100, 680)  # Up to MAX_READINGS, the most one block can hold
+MKCSV_POINTS = (100, 1000, 10000, 100000)
+HISTORY_ROWS = (100, 1000, 10000, 100000)
+PLOT_POINTS = (1000, 100000, 1000000)
+QUICK_SIZES = {
+    "readout": (10, 100),
+    "mkcsv": (100, 1000),
+    "history": (100, 1000),
+    "plot_data": (1000, 10000),
+}
+
+ADMIN_EMAIL = "admin@hp4280a.com"
+DEMO_EMAIL = "demo@hp4280a.com"
+TEST_TYPES = ("C-V Measurement", "C-T Measurement", "Pulse Measurement")
+STATIONS = ("GPIB0::17::INSTR", "GPIB0::18::INSTR")
+
+# Median, fastest and slowest of a list of durations in seconds, in milliseconds
+def summary(times):
+    return {
+        "median_ms": round(statistics.median(times) * 1000, 3),
+        "min_ms": round(min(times) * 1000, 3),
+        "max_ms": round(max(times) * 1000, 3),
+        "runs": len(times),
+    }
+
+# Times function() `repeat` times; setup() runs before each call and is not timed
+def measure(function, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return summary(times)
+
+def throughput(result, points):
+    result["points_per_s"] = round(points / (result["median_ms"] / 1000)) if result["median_ms"] > 0 else None
+    return result
+
+# Everything the pipeline prints while it is being timed goes nowhere
+def quiet():
+    return contextlib.redirect_stdout(open(os.devnull, "w"))
+
+# Synthetic C-V readings (C, G, V) with `points` bias steps
+def cv_readings(points):
+    v = np.linspace(-5, 5, points)
+    c = 1e-11 + 6e-11 / (1 + np.exp(4 * v))
+    return np.column_stack([c, c * 1e4, v])
+
+def new_controller(time_scale):
+    from controller import controller
+    from simulated_visacon import SimulatedVisaCon
+    conn = SimulatedVisaCon(time_scale=time_scale, seed=0, verbose=False)
+    conn.connect()
+    return conn, controller(conn, 5.0, 0.0, 5.0, 0.01, 0.01, 0.03, 0.0, 0.0, 10, 1.0, 1.0)
+
+# Configuration latency; "cold" starts from an empty state cache, "warm" repeats an unchanged setup
+def bench_config(time_scale, repeat):
+    conn, ctrl = new_controller(time_scale)
+    results = {}
+    for name in CONFIG_METHODS:
+        method = getattr(ctrl, name)
+        ctrl.invalidate_state()
+        before = conn.commands
+        method()
+        commands = conn.commands - before
+        results[name] = {
+            "cold": measure(method, repeat, setup=ctrl.invalidate_state),
+            "warm": measure(method, repeat),
+            "commands": commands,
+        }
+    return results
+
+# Reading a finished sweep block back: ASCII, ASCII streamed line by line, and binary
+def bench_readout(time_scale, repeat, sizes):
+    conn, ctrl = new_controller(time_scale)
+    ctrl.default_single()
+    results = {}
+    for points in sizes:
+        ctrl.set_StartV(0.0)
+        ctrl.set_StepV(0.01)
+        ctrl.set_StopV(round((points - 1) * 0.01, 2))
+
+        def start(block_format="AS"):
+            ctrl.command(block_format)
+            conn.write("SW1")
+
+        received = []
+        results[str(points)] = {
+            "ascii": throughput(measure(ctrl.ReadBlockResponseAscii, repeat, setup=start), points),
+            "stream": throughput(measure(lambda: ctrl.ReadBlockResponseAscii(received.append), repeat, setup=start), points),
+            "binary": throughput(measure(ctrl.ReadBlockResponseBinary, repeat, setup=lambda: start("BN")), points),
+        }
+        ctrl.command("AS")
+    return results
+
+# Saving a block with mkcsv, as ASCII text and as binary readings
+def bench_mkcsv(folder, repeat, sizes):
+    conn, ctrl = new_controller(0)
+    path = os.path.join(folder, "mkcsv.csv")
+
+    def remove():
+        if os.path.exists(path):
+            os.remove(path)
+
+    results = {}
+    for points in sizes:
+        readings = cv_readings(points)
+        text = conn.format_block(readings, "V")
+        results[str(points)] = {
+            "ascii": throughput(measure(lambda: ctrl.mkcsv(text, "mkcsv.csv", folder), repeat, setup=remove), points),
+            "binary": throughput(measure(lambda: ctrl.mkcsv(readings, "mkcsv.csv", folder), repeat, setup=remove), points),
+        }
+    remove()
+    return results
+
+# Logged in test client of the app; main is imported only now so it uses the temporary folder
+def app_client(email):
+    import main
+    client = main.app.test_client()
+    with client.session_transaction() as session:
+        session["email"] = email
+    return client
+
+def timed_get(client, url, repeat, setup=None):
+    def get():
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {response.status_code}")
+    return measure(get, repeat, setup)
+
+# Adds measurement rows until the table holds `rows`, spread over users, types and days
+def fill_measurements(rows):
+    from database import get_db
+    conn = get_db()
+    users = [row[0] for row in conn.execute("SELECT id FROM users ORDER BY id")]
+    present = conn.execute("SELECT COUNT(*) FROM measurements").fetchone()[0]
+    start = datetime(2024, 1, 1).timestamp()
+    conn.executemany(
+        "INSERT INTO measurements (user_id, test_type, csv_file_path, date_recorded, time_recorded, instrument) VALUES (?, ?, ?, ?, ?, ?)",
+        ((users[i % len(users)], TEST_TYPES[i % len(TEST_TYPES)], f"data_{i}.csv",
+          time.strftime("%Y-%m-%d", time.gmtime(start + i * 600)), time.strftime("%H:%M:%S", time.gmtime(start + i * 600)),
+          STATIONS[i % len(STATIONS)])
+         for i in range(present, rows)))
+    conn.commit()
+
+# History and admin page latency as the measurements table grows
+def bench_history(repeat, sizes):
+    demo, admin = app_client(DEMO_EMAIL), app_client(ADMIN_EMAIL)
+    results = {}
+    for rows in sizes:
+        fill_measurements(rows)
+        results[str(rows)] = {
+            "history": timed_get(demo, "/history", repeat),
+            "history_filtered": timed_get(demo, f"/history?test_type={TEST_TYPES[1]}", repeat),
+            "admin_measure": timed_get(admin, "/admin_measure", repeat),
+            "admin_measure_filtered": timed_get(admin, f"/admin_measure?instrument={STATIONS[1]}", repeat),
+        }
+    return results
+
+# Serving plot data of a saved measurement: first request (pyramid built), repeated and zoomed
+def bench_plot_data(repeat, sizes):
+    from data_save import data_folder, get_store
+    from database import add_measurement, get_user_by_email
+    client = app_client(DEMO_EMAIL)
+    user_id = get_user_by_email(DEMO_EMAIL)[0]
+    results = {}
+    for points in sizes:
+        filename = f"plot_{points}.npz"
+        path = os.path.join(data_folder(), filename)
+        get_store("npz").save(path, ["NCM", "NGM", "V"], cv_readings(points), {})
+        add_measurement(user_id, TEST_TYPES[0], path)  # Only the owner's measurements are served
+        touch = lambda: os.utime(path, ns=(time.time_ns(), time.time_ns()))  # A changed file has its pyramid rebuilt
+        results[str(points)] = {
+            "first": timed_get(client, f"/plot_data/{filename}", repeat, touch),
+            "repeat": timed_get(client, f"/plot_data/{filename}", repeat),
+            "zoom": timed_get(client, f"/plot_data/{filename}?x0=-0.5&x1=0.5", repeat),
+        }
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def run(repeat=DEFAULT_REPEAT, time_scale=0.0, quick=False, only=None):
+    sizes = lambda name, default: QUICK_SIZES[name] if quick else default
+    with tempfile.TemporaryDirectory(prefix="hp4280a-benchmark-") as folder:
+        # Both have to be in place before the database and the app are first used
+        os.environ["USERPROFILE"] = folder
+        import database
+        database.DB_path = os.path.join(folder, "benchmark.db")
+
+        benchmarks = {
+            "config": lambda: bench_config(time_scale, repeat),
+            "readout": lambda: bench_readout(time_scale, repeat, sizes("readout", READOUT_POINTS)),
+            "mkcsv": lambda: bench_mkcsv(folder, repeat, sizes("mkcsv", MKCSV_POINTS)),
+            "history": lambda: bench_history(repeat, sizes("history", HISTORY_ROWS)),
+            "plot_data": lambda: bench_plot_data(repeat, sizes("plot_data", PLOT_POINTS)),
+        }
+        results = {}
+        for name, benchmark in benchmarks.items():
+            if only and name not in only:
+                continue
+            print(f"Running {name}...", file=sys.stderr)
+            with quiet():
+                results[name] = benchmark()
+        database.close_db()
+
+    return {
+        "version": RESULTS_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "repeat": repeat,
+        "time_scale": time_scale,
+        "quick": quick,
+        "results": results,
+    }
+
+# Median times of a results tree, keyed by their path (e.g. "readout.680.ascii")
+def medians(tree, path=""):
+    found = {}
+    for key, value in tree.items():
+        if isinstance(value, dict):
+            if "median_ms" in value:
+                found[path + key] = value["median_ms"]
+            else:
+                found.update(medians(value, f"{path}{key}."))
+    return found
+
+# Results whose median is more than `tolerance` slower than in the baseline
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    new, old = medians(current["results"]), medians(baseline["results"])
+    regressions = []
+    for key in sorted(new.keys() & old.keys()):
+        if old[key] > 0 and new[key] > old[key] * (1 + tolerance):
+            regressions.append({"benchmark": key, "baseline_ms": old[key], "current_ms": new[key],
+                                "ratio": round(new[key] / old[key], 2)})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the HP4280A measurement pipeline against the simulator.")
+    parser.add_argument("-o", "--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("-n", "--repeat", type=int, default=DEFAULT_REPEAT, help="timed runs of every case")
+    parser.add_argument("--time-scale", type=float, default=0.0, help="simulated instrument time scale (0 = instant)")
+    parser.add_argument("--quick", action="store_true", help="only the small sizes")
+    parser.add_argument("--only", nargs="+", choices=["config", "readout", "mkcsv", "history", "plot_data"],
+                        help="run only these benchmarks")
+    parser.add_argument("--compare", metavar="BASELINE", help="results file of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    report = run(max(args.repeat, 1), args.time_scale, args.quick, args.only)
+    regressions = None
+    if args.compare:
+        with open(args.compare) as file:
+            report["regressions"] = regressions = compare(report, json.load(file), args.tolerance)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+        print(f"Results saved to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    if regressions:
+        for regression in regressions:
+            print(f"Slower: {regression['benchmark']} {regression['baseline_ms']} ms -> {regression['current_ms']} ms "
+                  f"(x{regression['ratio']})", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
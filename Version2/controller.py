@@ -1,9 +1,25 @@
-from visacon import VisaCon
-import pyvisa
+from visacon import visa_error
+from sweep_data import parse_row, decode_binary_block, format_rows, normalize_block, points_from_values, to_columns, binary_prefixes, block_lines
+from data_save import data_folder, get_store
+from tracing import tracer
+from sweep_planner import cv_sweep
+import numpy as np
 import csv
 import time
 import os
 import datetime
+import functools
+import re
+from contextlib import contextmanager, nullcontext
+
+# Runs the method while holding the connection's I/O lock, so a multi command exchange
+# (e.g. READ? followed by the block read) is never interleaved with other bus traffic
+def holds_bus(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.exchange():
+            return method(self, *args, **kwargs)
+    return wrapper
 
 class controller:
     DC_V = 0.0
@@ -18,6 +34,27 @@ class controller:
     Pulse_Width=1.0
     Meas_Interval=1.0
 
+    # Separator used to join queued commands into one GPIB program string
+    BATCH_SEPARATOR = ";"
+
+    # Program codes whose last sent value is remembered so repeats can be skipped
+    MODE_CODES = ("FN", "IB", "RA", "RM", "MS")
+    NUMERIC_CODES = ("PV", "PS", "PP", "PE", "PL", "PD", "PN", "PU", "PM", "PH", "PT")
+
+    # Data output format program codes used by sweep_measure(transfer=...)
+    ASCII_FORMAT = "AS"
+    BINARY_FORMAT = "BN"
+    TRANSFER_MODES = ("ascii", "binary")
+
+    # Completion polling for sweeps started with BD (see wait_for_sweep)
+    SWEEP_DONE_MASK = 0x01  # Status byte bit set once the data block is ready to be read
+    POLL_START = 0.05  # Seconds between status polls when the sweep should be nearly done
+    POLL_MAX = 1.0  # Polls back off up to this interval
+    POLL_FROM = 0.8  # Fraction of the estimated sweep time after which polling starts
+    SWEEP_TIMEOUT_FACTOR = 3.0  # A sweep is abandoned after this many times its estimated time...
+    SWEEP_TIMEOUT_MARGIN = 30.0  # ...plus this many seconds
+    READ_TIMEOUT = 10000  # VISA timeout (ms) for reading a block that is already complete
+
     def __init__(self, conn, DC_V, Start_V, Stop_V, Step_V, Hold_T, Step_T, Pulse, Meas, Nofread, Pulse_Width, Meas_Interval):
         self.DC_V = DC_V
         self.Start_V = Start_V
@@ -32,6 +69,9 @@ class controller:
         self.Meas_Interval = Meas_Interval
         
         self.conn = conn
+        self.batch = None  # Commands queued between begin_batch() and send_batch()
+        self.batch_delay = 0.0
+        self.state = {}  # Last known instrument settings, keyed by program code
     # initialize the instrument measurement
 
     def measure_start(self):
@@ -160,53 +200,161 @@ class controller:
     
     def default_single(self):
         if self.conn.inst is not None:
-            self.command("IB2") #set biasing
-            self.command("MS2") #measurement speed set to medium
-            self.command("FL")  #float mode
-            self.command("FN1") #C-G function
-            self.command("CEI") #enable correction
-            self.command("TR1") #changes to hold/manual sweep
-            self.command("LE1") #set cable length
-            self.command("SL2") #signal level to sl2
-            self.command("RA1") #C-G range to auto
-            #default settings for CV
-            self.set_DCV(5.0) 
-            self.set_StartV(0.0)
-            self.set_StopV(5.0)
-            self.set_Hold_Time(0.01)
-            self.set_StepV(0.01)
-            self.set_StepT(0.03)
+            with self.batched():
+                self.command("IB2") #set biasing
+                self.command("MS2") #measurement speed set to medium
+                self.command("FL")  #float mode
+                self.command("FN1") #C-G function
+                self.command("CEI") #enable correction
+                self.command("TR1") #changes to hold/manual sweep
+                self.command("LE1") #set cable length
+                self.command("SL2") #signal level to sl2
+                self.command("RA1") #C-G range to auto
+                #default settings for CV
+                self.set_DCV(5.0) 
+                self.set_StartV(0.0)
+                self.set_StopV(5.0)
+                self.set_Hold_Time(0.01)
+                self.set_StepV(0.01)
+                self.set_StepT(0.03)
         else:
             print("No connection to instrument.")
 
     def default_CT(self):
         if self.conn.inst is not None:
-            self.command("FN5") #C-t function
-            self.command("IB5") #set biasing
-            self.command("FL") #float mode
-            self.command("LE1") #set cable length
-            self.command("MS1") #measurement speed set to medium
-            self.command("RA1") #C-G range to auto
-            self.command("TR1") #changes to hold/manual sweep
-            
-            #default settings for CT
-            self.set_Pulse(0.0)
-            self.set_Measure_pulse(0.0)
-            self.set_NOFREAD(10)
-            self.set_th(1.0)
-            self.set_td(0.01)
-            self.command("SL2") #signal level to 30
+            with self.batched():
+                self.command("FN5") #C-t function
+                self.command("IB5") #set biasing
+                self.command("FL") #float mode
+                self.command("LE1") #set cable length
+                self.command("MS1") #measurement speed set to medium
+                self.command("RA1") #C-G range to auto
+                self.command("TR1") #changes to hold/manual sweep
+                
+                #default settings for CT
+                self.set_Pulse(0.0)
+                self.set_Measure_pulse(0.0)
+                self.set_NOFREAD(10)
+                self.set_th(1.0)
+                self.set_td(0.01)
+                self.command("SL2") #signal level to 30
         else:
             print("No connection to instrument.")
 
     def single_config(self):
-        self.set_DCV(self.DC_V)
-        self.set_StartV(self.Start_V)    
-        self.set_StopV(self.Stop_V)
-        self.set_StepV(self.Step_V)
-        self.set_Hold_Time(self.Hold_T)
-        self.set_StepT(self.Step_T)
-        self.command("IB2") #set biasing to Single Sweep
+        with self.batched():
+            self.set_DCV(self.DC_V)
+            self.set_StartV(self.Start_V)    
+            self.set_StopV(self.Stop_V)
+            self.set_StepV(self.Step_V)
+            self.set_Hold_Time(self.Hold_T)
+            self.set_StepT(self.Step_T)
+            self.command("IB2") #set biasing to Single Sweep
+
+    """
+    Batched commands
+    Each setter normally costs its own GPIB write plus the 0.5s write delay.
+    Between begin_batch() and send_batch() commands are queued instead and then
+    sent as one program string, so the whole configuration settles only once.
+    """
+    def begin_batch(self):
+        if self.batch is None:
+            self.batch = []
+            if self.conn.inst is not None:
+                self.batch_delay = getattr(self.conn.inst, "write_delay", 0.0)
+
+    def send_batch(self, settle=0.5):
+        cmds = self.batch
+        self.batch = None
+        if not cmds:
+            return
+        if self.conn.inst is not None:
+            with self.exchange():
+                self.conn.inst.write_delay = settle
+                if not self.write(self.BATCH_SEPARATOR.join(cmds)):
+                    self.invalidate_state()
+                self.conn.inst.write_delay = self.batch_delay
+        else:
+            self.invalidate_state()
+            print("No connection to instrument.")
+
+    def discard_batch(self):
+        # Queued commands were already recorded in the state cache
+        if self.batch:
+            self.invalidate_state()
+        self.batch = None
+
+    """
+    Instrument state cache
+    The controller keeps the last value sent for each mode (FN, IB, RA, RM, MS)
+    and numeric (PV, PS, PP, ...) program code. command() skips a setting the
+    instrument already has, so re-submitting a form only sends what changed.
+    The cache must be dropped whenever the instrument may have been reset.
+    """
+    def state_entry(self, cmd):
+        code = cmd[:2]
+        value = cmd[2:].strip()
+        if code in self.NUMERIC_CODES and value:
+            try:
+                return code, float(value)
+            except ValueError:
+                return None, None
+        if code in self.MODE_CODES and value.isdigit():
+            return code, value
+        return None, None
+
+    def remember(self, code, value):
+        if code is None:
+            return
+        self.state[code] = value
+        # Auto range and a manual range replace each other on the instrument
+        if code == "RA":
+            self.state.pop("RM", None)
+        elif code == "RM":
+            self.state.pop("RA", None)
+
+    def invalidate_state(self):
+        self.state = {}
+
+    def reconnect(self):
+        self.conn.disconnect()
+        self.conn.connect()
+        self.invalidate_state()
+
+    @contextmanager
+    def batched(self, settle=0.5):
+        # Nested batches are folded into the outermost one
+        if self.batch is not None:
+            yield self
+            return
+        self.begin_batch()
+        try:
+            yield self
+        except Exception:
+            self.discard_batch()
+            raise
+        self.send_batch(settle)
+
+    #Setter of each setting a sweep plan holds (see sweep_planner.py)
+    SETTERS = {
+        "DC_V": "set_DCV",
+        "Start_V": "set_StartV",
+        "Stop_V": "set_StopV",
+        "Step_V": "set_StepV",
+        "Hold_T": "set_Hold_Time",
+        "Step_T": "set_StepT",
+        "Pulse": "set_Pulse",
+        "Meas": "set_Measure_pulse",
+        "Nofread": "set_NOFREAD",
+        "Pulse_Width": "set_th",
+        "Meas_Interval": "set_td",
+    }
+
+    #Sends a plan's settings as one program string; values the instrument already has are skipped
+    def apply_settings(self, settings):
+        with self.batched():
+            for name, value in settings.items():
+                getattr(self, self.SETTERS[name])(value)
 
     """def set_cvfunc(self):
         if self.conn.inst is not None:
@@ -417,27 +565,61 @@ class controller:
         else:
             print("No connection to instrument.")
 
-    def sweep_measure(self):
+    #Holds the connection's I/O lock for one exchange that spans several calls. Sweeps only
+    #hold it while they talk to the instrument, not while it measures; keeping other users
+    #out for the whole sweep is the job of the instrument's lease (see instruments.py)
+    def exchange(self):
+        lock = getattr(self.conn, "io_lock", None)
+        return lock if lock is not None else nullcontext()
+
+    #transfer selects how the block is read back: "ascii" or "binary"
+    #storage selects the file format the result is saved in: "csv", "npz" or "parquet"
+    #show_progress=False leaves the job's progress to the caller (e.g. a recipe run)
+    def sweep_measure(self, job=None, transfer="ascii", storage="csv", show_progress=True):
         if self.conn.inst is not None:
-            self.conn.inst.timeout = 1000000
-            self.command("V01")
-            self.command("SW1")
-            self.command("BL1")
-            self.command("BD")
-            print("Running Sweep. Please stand by...")
-            self.command("READ?")
-            response = self.ReadBlockResponseAscii()
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            filename = f"data_{timestamp}.csv"
-            if response is not None:
-                print("Data Received: ", response)
-                self.mkcsv(response, filename)
-                self.command("SW0")
-                self.conn.inst.timeout = 10000
-                print("Sweep Stopped")
-                return filename
-            else:
-                print("No data received")
+            with tracer.sweep(self.conn.get_MAC(), self.sweep_type()) as timing:
+                with timing.phase("setup"), self.exchange():
+                    self.command("V01")
+                    self.command("SW1")
+                    self.command("BL1")
+                    if transfer == "binary":
+                        self.command(self.BINARY_FORMAT)
+                    self.command("BD")
+                print("Running Sweep. Please stand by...")
+                if job is not None and show_progress:
+                    job.set_progress(0.0, "Running sweep")
+                with timing.phase("acquisition"):
+                    read_timeout = self.wait_for_sweep(job, show_progress=show_progress)
+                if read_timeout is None:
+                    timing.outcome = self.stopped_outcome(job)
+                    return None
+                with timing.phase("transfer"), self.exchange():
+                    self.conn.inst.timeout = read_timeout
+                    self.command("READ?")
+                    if transfer == "binary":
+                        response = self.ReadBlockResponseBinary()
+                        self.command(self.ASCII_FORMAT)  # Leave the instrument in the default format
+                    else:
+                        response = self.ReadBlockResponseAscii(job.publish if job is not None else None)
+                if transfer == "binary" and response is not None and job is not None:
+                    for point in points_from_values(response, self.reading_axis()):
+                        job.publish(point)
+                filename = self.result_filename("data", storage)
+                if response is not None:
+                    timing.readings = self.reading_count(response)
+                    print("Data Received: ", response)
+                    with timing.phase("save"):
+                        filename = self.save_result(response, filename, storage, transfer=transfer)
+                    with self.exchange():
+                        self.command("SW0")
+                        self.conn.inst.timeout = 10000
+                    print("Sweep Stopped")
+                    return filename
+                else:
+                    timing.outcome = "failed"
+                    with self.exchange():
+                        self.conn.inst.timeout = 10000
+                    print("No data received")
         else:
             print("No connection to instrument.")
     ###
@@ -472,7 +654,7 @@ class controller:
                 self.set_StopV(temp1)
                 self.set_Step(temp2)
                 self.set_StartV(temp3)                 
-            except pyvisa.errors.VisaIOError as e:
+            except visa_error() as e:
                 error_code = e.error_code
                 print(f"GPIB Communication Error [{error_code}]: {e.description}")
         else:
@@ -507,130 +689,360 @@ class controller:
                     print("Pulse complete\n")
                     current_end += self.Step_V
 
-            except pyvisa.errors.VisaIOError as e:
+            except visa_error() as e:
                 error_code = e.error_code
                 print(f"GPIB Communication Error [{error_code}]: {e.description}")
         else:
             print("No connection to instrument.")"""
     
-    def pulse_sweep(self):
-        if self.conn.inst is not None:
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            filename = f"pulse_data_{timestamp}.csv"
+    #Bias steps of a pulse sweep as (stop, step) pairs: every pulse sweeps from 0 V to the
+    #next multiple of Step_V in one step, up to Stop_V
+    def pulse_schedule(self):
+        schedule = []
+        if self.Step_V <= 0:
+            return schedule
+        number = 1
+        while self.Step_V * number <= self.Stop_V + 1e-9:
+            stop = round(self.Step_V * number, 6)
+            schedule.append((stop, stop))
+            number += 1
+        return schedule
+
+    #Runs the whole pulse schedule. Each pulse is one program string that stops the previous
+    #sweep, sends only the parameters that changed and starts the next sweep; the readings
+    #are kept in memory and written to the file once at the end
+    def pulse_sweep(self, job=None, storage="csv"):
+        filename = self.result_filename("pulse_data", storage)
+        responses = []
+        if self.conn.inst is None:
+            print("No connection to instrument.")
+            return filename
+
+        schedule = self.pulse_schedule()
+        with tracer.sweep(self.conn.get_MAC(), "pulse") as timing:
             try:
-                #self.set_double()
-                current_end = self.Step_V
-                actual_end = self.Stop_V
-                init_step = self.Step_V
-                pulse_step = self.Step_V
-                while current_end <= actual_end:#+self.Step_V:
-                    self.set_StartV(0)
-                    self.set_StopV(current_end)
-                    self.set_StepV(pulse_step)
-                    self.conn.inst.timeout = 1000000
-                    self.command("SW1")
-                    self.command("BL1")
-                    self.command("BD")
-                    self.command("READ?")                        
-                    response = self.ReadBlockResponseAscii()
+                for number, (stop, step) in enumerate(schedule):
+                    if job is not None:
+                        if job.cancelled():
+                            timing.outcome = "cancelled"
+                            print("Pulse sweep cancelled")
+                            break
+                        job.set_progress(number / len(schedule), f"Pulse to {stop} V")
+                    with timing.phase("setup"), self.batched():
+                        if number > 0:
+                            self.command("SW0")
+                        self.set_StartV(0)  # Unchanged after the first pulse, so only sent once
+                        self.set_StopV(stop)
+                        self.set_StepV(step)
+                        self.command("SW1")
+                        self.command("BL1")
+                        self.command("BD")
+                    with timing.phase("acquisition"):
+                        read_timeout = self.wait_for_sweep(job, show_progress=False)
+                    if read_timeout is None:
+                        timing.outcome = self.stopped_outcome(job)
+                        break
+                    with timing.phase("transfer"), self.exchange():
+                        self.conn.inst.timeout = read_timeout
+                        self.command("READ?")
+                        response = self.ReadBlockResponseAscii(job.publish if job is not None else None)
                     if response is not None:
+                        timing.readings += self.reading_count(response)
                         print("Pulse Complete")
                         print("Data Received: ", response)
-                        self.mkcsv(response, filename)
+                        responses.append(response)
                     else:
                         print("No data received")
-                    self.command("SW0")
-                    self.conn.inst.timeout = 10000
-                    print("Pulse complete\n")
-                    current_end += init_step
-                    pulse_step = current_end
-            
-            
-            except pyvisa.errors.VisaIOError as e:
+                self.command("SW0")
+            except visa_error() as e:
+                timing.outcome = "failed"
                 error_code = e.error_code
                 print(f"GPIB Communication Error [{error_code}]: {e.description}")
-        else:
-            print("No connection to instrument.")
+            finally:
+                with self.exchange():
+                    self.conn.inst.timeout = 10000
+                # Whatever was read is saved, even if the run stopped early
+                if responses:
+                    with timing.phase("save"):
+                        filename = self.save_result('\n'.join(responses), filename, storage, sweep="pulse")
         return filename
 
-    #Function to calculate the number of steps taken in the sweep
+    #Number of readings in the C-V sweep, up or down and back again for a double sweep
     def step_calc(self):
-        num_Steps = 0.0
-        if self.Step_V == 0:
-            num_Steps = ((self.Stop_V - self.Start_V) / 1)
-            return num_Steps
-        else:
-            num_Steps = (((self.Stop_V - self.Start_V) / self.Step_V) + 1)
-            return num_Steps
+        return cv_sweep(self.Start_V, self.Stop_V, self.Step_V, self.Hold_T, self.Step_T, self.double_sweep())[1]
 
-    #Function to calculate the sweep time    
+    #Function to calculate the sweep time (same estimate as the sweep planner)
     def sweep_time_calc(self):
-        num_Steps = self.step_calc()
-        calc = ((num_Steps * (self.Step_T + self.Hold_T) * 1000) + 1000)
-        print(calc/1000)
-        return (calc/1000)
+        return cv_sweep(self.Start_V, self.Stop_V, self.Step_V, self.Hold_T, self.Step_T, self.double_sweep())[2]
+
+    #True if the bias was last set to a double sweep (IB3)
+    def double_sweep(self):
+        return self.state.get("IB") == "3"
+
+    #Estimated duration (s) of the sweep the instrument is set up for
+    def sweep_estimate(self):
+        if self.reading_axis() == "T":
+            # C-t: one reading every measurement interval after the bias pulse
+            readings = self.state.get("PN", self.Nofread)
+            return readings * self.state.get("PT", self.Meas_Interval) + self.state.get("PH", self.Pulse_Width) + 1.0
+        return self.sweep_time_calc()
+
+    #How fast the connection's clock runs compared to a real instrument: a simulated or
+    #replayed connection sets conn.time_scale (0 answers at once, 0.1 is ten times faster)
+    def time_scale(self):
+        return getattr(self.conn, "time_scale", 1.0)
+
+    #Waits for a sweep started with BD to finish, polling the status byte instead of
+    #blocking in READ? with a huge timeout. Returns the VISA timeout (ms) to read the
+    #block with, or None if the sweep was cancelled or never finished (it is then aborted).
+    #The estimate and the waits are scaled by time_scale(); the safety margin is not
+    def wait_for_sweep(self, job=None, estimate=None, show_progress=True):
+        if estimate is None:
+            estimate = self.sweep_estimate()
+        scale = self.time_scale()
+        estimate = max(estimate, 0.0) * scale
+        start = time.monotonic()
+        deadline = start + estimate * self.SWEEP_TIMEOUT_FACTOR + self.SWEEP_TIMEOUT_MARGIN
+        poll_from = start + estimate * self.POLL_FROM
+        interval = self.POLL_START
+        polling = True
+        while True:
+            now = time.monotonic()
+            if job is not None and show_progress and estimate > 0:
+                job.set_progress(min((now - start) / estimate, 0.99), "Running sweep")
+            if now >= deadline:
+                print(f"Sweep did not finish within {deadline - start:.0f} s")
+                self.abort_sweep()
+                return None
+
+            if now >= poll_from:
+                if polling:
+                    ready = self.sweep_ready()
+                    if ready:
+                        return self.READ_TIMEOUT
+                    if ready is None:
+                        polling = False
+                if not polling and now >= start + estimate:
+                    # No status byte: READ? waits for the rest of the allowed time
+                    return int((deadline - now) * 1000) + self.READ_TIMEOUT
+                pause = interval * scale
+                interval = min(interval * 1.5, self.POLL_MAX)
+            else:
+                pause = min(poll_from - now, self.POLL_MAX)
+
+            if self.pause(job, pause):
+                print("Sweep cancelled")
+                self.abort_sweep()
+                return None
+
+    #True once the sweep's data is ready, None if the status byte cannot be read
+    def sweep_ready(self):
+        with self.exchange(), self.traced("status", "STB") as call:
+            try:
+                return bool(self.conn.inst.read_stb() & self.SWEEP_DONE_MASK)
+            except (AttributeError, NotImplementedError, visa_error()) as e:
+                call.fail(e)
+                print(f"Status byte not available, waiting for the estimated sweep time instead: {e}")
+                return None
+
+    #Sleeps for the given time; returns True early if the job is cancelled
+    def pause(self, job, seconds):
+        if job is None:
+            time.sleep(seconds)
+            return False
+        return job.cancel_event.wait(seconds)
+
+    #Stops a running sweep and clears the instrument so it does not keep a stale block
+    def abort_sweep(self):
+        with self.exchange():
+            self.command("SW0")
+            self.clear()
+            self.conn.inst.timeout = 10000
+
+    #Measurement speed last sent ("fast", "medium" or "slow"), None if not known
+    def measurement_speed(self):
+        return {"1": "fast", "2": "medium", "3": "slow"}.get(self.state.get("MS"))
+
+    #Sweep type shown in the metrics (see tracing.py)
+    def sweep_type(self):
+        return "C-t" if self.reading_axis() == "T" else "C-V"
+
+    #Outcome of a sweep that wait_for_sweep gave up on
+    def stopped_outcome(self, job):
+        return "cancelled" if job is not None and job.cancelled() else "aborted"
+
+    #Readings in an ASCII block or a binary array
+    def reading_count(self, response):
+        return len(response) if isinstance(response, np.ndarray) else len(block_lines(response))
+
+    #Times one exchange with the instrument for the metrics page (see tracing.py)
+    def traced(self, kind, command):
+        return tracer.call(kind, command, self.conn.get_MAC())
 
     #Function to send and recieve data from the instrument
     def command(self, cmd):
+        code, value = self.state_entry(cmd)
+        if code is not None and self.state.get(code) == value:
+            print("Unchanged:", cmd)
+            return
+        if self.batch is not None:
+            self.batch.append(cmd)
+            self.remember(code, value)
+            print("Queued:", cmd)
+            return
+        if self.write(cmd):
+            self.remember(code, value)
+        elif code is not None:
+            self.state.pop(code, None)
+
+    @holds_bus
+    def write(self, cmd):
+        sent = False
         if self.conn.inst is not None:
-            try:
-                #self.conn.inst.write_raw(cmd + "\n")
-                self.conn.inst.write(cmd)
-                #time.sleep(0.0)
-            except pyvisa.errors.VisaIOError as e:
-                error_code = e.error_code
-                print(f"GPIB Communication Error [{error_code}]: {e.description}")
+            with self.traced("write", cmd) as call:
+                try:
+                    #self.conn.inst.write_raw(cmd + "\n")
+                    self.conn.inst.write(cmd)
+                    call.bytes = len(cmd)
+                    sent = True
+                    #time.sleep(0.0)
+                except visa_error() as e:
+                    call.fail(e)
+                    error_code = e.error_code
+                    print(f"GPIB Communication Error [{error_code}]: {e.description}")
         print("Command:", cmd)
+        return sent
     
+    @holds_bus
     def read(self):
         if self.conn.inst is not None:
-            try:
-                return self.conn.inst.read()
-            except pyvisa.errors.VisaIOError as e:
-                error_code = e.error_code
-                print(f"GPIB Communication Error [{error_code}]: {e.description}")
+            with self.traced("read", "read") as call:
+                try:
+                    response = self.conn.inst.read()
+                    call.bytes = len(response)
+                    return response
+                except visa_error() as e:
+                    call.fail(e)
+                    error_code = e.error_code
+                    print(f"GPIB Communication Error [{error_code}]: {e.description}")
         else:
             print("No connection to instrument.")
     
+    @holds_bus
     def rq(self, cmd):
         if self.conn.inst is not None:
-            try:
-                return self.conn.inst.query(cmd + "\n")
-            except pyvisa.errors.VisaIOError as e:
-                error_code = e.error_code
-                print(f"GPIB Communication Error [{error_code}]: {e.description}")
+            with self.traced("query", cmd) as call:
+                try:
+                    response = self.conn.inst.query(cmd + "\n")
+                    call.bytes = len(cmd) + 1 + len(response)
+                    return response
+                except visa_error() as e:
+                    call.fail(e)
+                    error_code = e.error_code
+                    print(f"GPIB Communication Error [{error_code}]: {e.description}")
         else:
             print("No connection to instrument.")
     
     #clears values of the instrument
+    @holds_bus
     def clear(self):
+        self.invalidate_state()
         if self.conn.inst is not None:
-            self.conn.inst.clear()
+            with self.traced("write", "clear"):
+                self.conn.inst.clear()
             print("Clearing the instrument")
         else:
             print("No connection to instrument.")
     
     #data processing functions
-    def ReadBlockResponseAscii(self):
+    #on_point is called with every reading as soon as its line has been received
+    @holds_bus
+    def ReadBlockResponseAscii(self, on_point=None):
         if self.conn.inst is not None:
-            try:
-                response_string = self.conn.inst.read()#self.conn.inst.read()
-                return response_string
-            except pyvisa.errors.VisaIOError as e:
-                error_code = e.error_code
-                print(f"GPIB Communication Error [{error_code}]: {e.description}")
+            with self.traced("read", "block (ASCII)") as call:
+                try:
+                    if on_point is not None and hasattr(self.conn, "read_stream"):
+                        response_string = self.ReadBlockStream(on_point)
+                    else:
+                        response_string = self.conn.inst.read()#self.conn.inst.read()
+                        if on_point is not None and response_string is not None:
+                            for row in response_string.split('\n'):
+                                self.emit_point(row, on_point)
+                    call.bytes = len(response_string or "")
+                    return response_string
+                except visa_error() as e:
+                    call.fail(e)
+                    error_code = e.error_code
+                    print(f"GPIB Communication Error [{error_code}]: {e.description}")
+        else:
+            print("No connection to instrument.")
+
+    #reads the block in chunks and hands out each complete line while the rest is still arriving
+    def ReadBlockStream(self, on_point):
+        encoding = getattr(self.conn.inst, "encoding", "ascii")
+        rows = []
+        pending = ""
+        for chunk in self.conn.read_stream():
+            if isinstance(chunk, bytes):
+                chunk = chunk.decode(encoding, errors="replace")
+            pending += chunk
+            *complete, pending = pending.split('\n')
+            for row in complete:
+                rows.append(row.rstrip('\r'))
+                self.emit_point(rows[-1], on_point)
+        pending = pending.rstrip('\r\n')
+        if pending:
+            rows.append(pending)
+            self.emit_point(pending, on_point)
+        return '\n'.join(rows)
+
+    def emit_point(self, row, on_point):
+        point = parse_row(row)
+        if point is not None:
+            on_point(point)
+
+    #number of values in each binary reading and the name of the swept quantity
+    def reading_columns(self):
+        return 2 if self.state.get("FN") in ("5", "6") else 3
+
+    def reading_axis(self):
+        return "T" if self.state.get("FN") in ("4", "5", "6") else "V"
+
+    #reads a binary block (big endian 32 bit floats) straight into an array with one row per reading
+    @holds_bus
+    def ReadBlockResponseBinary(self):
+        if self.conn.inst is not None:
+            with self.traced("read", "block (binary)") as call:
+                try:
+                    if hasattr(self.conn.inst, "read_binary_values"):
+                        values = self.conn.inst.read_binary_values(datatype='f', is_big_endian=True, container=np.array,
+                                                                   header_fmt='empty', expect_termination=True)
+                    else:
+                        values = decode_binary_block(self.conn.inst.read_raw())
+                    call.bytes = 4 * len(values)
+                    columns = self.reading_columns()
+                    usable = len(values) - len(values) % columns
+                    return np.asarray(values[:usable], dtype=float).reshape(-1, columns)
+                except visa_error() as e:
+                    call.fail(e)
+                    error_code = e.error_code
+                    print(f"GPIB Communication Error [{error_code}]: {e.description}")
         else:
             print("No connection to instrument.")
 
     #reads binary response
+    @holds_bus
     def ReadBlockResponse(self):
         if self.conn.inst is not None:
-            try:
-                response = self.conn.inst.read_raw()
-                return response
-            except pyvisa.errors.VisaIOError as e:
-                error_code = e.error_code
-                print(f"GPIB Communication Error [{error_code}]: {e.description}")
+            with self.traced("read", "block (raw)") as call:
+                try:
+                    response = self.conn.inst.read_raw()
+                    call.bytes = len(response)
+                    return response
+                except visa_error() as e:
+                    call.fail(e)
+                    error_code = e.error_code
+                    print(f"GPIB Communication Error [{error_code}]: {e.description}")
         else:
             print("No connection to instrument.")
 
@@ -642,13 +1054,15 @@ class controller:
             print("No data received")
 
     def ProcessBinary(self, response):
-        if response is not None & len(response) > 0:
-            bin_response = self.conn.inst.read_raw()
-            print("Data Received: ", bin_response)
-            self.csv(bin_response)
+        if response is not None and len(response) > 0:
+            if isinstance(response, bytes):
+                response = decode_binary_block(response).reshape(-1, self.reading_columns())
+            print("Data Received: ", len(response), "readings")
+            self.mkcsv(response)
         else:
             print("No data received")
 
+    @holds_bus
     def data_standard_transfer_mode(self):
         if self.conn.inst is not None:
             try:
@@ -658,12 +1072,13 @@ class controller:
                 if response is not None:
                     print("Data Received: ", response)
                     self.mkcsv(response)
-            except pyvisa.errors.VisaIOError as e:
+            except visa_error() as e:
                 error_code = e.error_code
                 print(f"GPIB Communication Error [{error_code}]: {e.description}")
         else:
             print("No connection to instrument.")
     
+    @holds_bus
     def read_data(self):
         if self.conn.inst is not None:
             try:
@@ -671,27 +1086,73 @@ class controller:
                 self.command("MEASURE")
                 response = self.read()
                 return response
-            except pyvisa.errors.VisaIOError as e:
+            except visa_error() as e:
                 error_code = e.error_code
                 print(f"GPIB Communication Error [{error_code}]: {e.description}")
             return None
         else:
             print("No connection to instrument.")
 
+    #saves a sweep result with the chosen storage backend; CSV keeps using mkcsv
+    #Returns the name of the file written: if the chosen format fails (e.g. pandas is
+    #missing) the readings are saved as CSV instead, so a finished sweep is never lost
+    def save_result(self, data, filename, storage="csv", **details):
+        if storage == "csv":
+            self.mkcsv(data, filename)
+            return filename
+        path = os.path.join(data_folder(), filename)
+        try:
+            if isinstance(data, np.ndarray):
+                prefixes, values = binary_prefixes(data.shape[1], self.reading_axis()), data
+            else:
+                prefixes, values = to_columns(data)
+            get_store(storage).save(path, prefixes, values, self.result_metadata(**details))
+            return filename
+        except Exception as e:
+            print(f"Could not save {filename} as {storage} ({e}), saving as CSV instead")
+            if os.path.exists(path):
+                os.remove(path)
+            filename = os.path.splitext(filename)[0] + get_store("csv").extension
+            self.mkcsv(data, filename)
+            return filename
+
+    #instrument settings saved alongside typed measurement files
+    def result_metadata(self, **details):
+        metadata = {
+            "saved": datetime.datetime.now().isoformat(timespec="seconds"),
+            "instrument": self.conn.get_MAC(),
+            "settings": {
+                "DC_V": self.DC_V,
+                "Start_V": self.Start_V,
+                "Stop_V": self.Stop_V,
+                "Step_V": self.Step_V,
+                "Hold_T": self.Hold_T,
+                "Step_T": self.Step_T,
+            },
+            "state": dict(self.state),
+        }
+        metadata.update(details)
+        return metadata
+
+    # Result file name, tagged with the instrument so parallel sweeps never share a file
+    def result_filename(self, prefix, storage="csv"):
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        station = re.sub(r'[^A-Za-z0-9]+', '-', self.conn.get_MAC().replace("::INSTR", "")).strip('-')
+        return f"{prefix}_{timestamp}_{station}{get_store(storage).extension}"
+
     def mkcsv(self, data, filename='data.csv', file_path=None):
         if file_path is None:
             file_path = os.path.join(os.environ['USERPROFILE'], 'Documents', 'HPData')
             os.makedirs(file_path, exist_ok=True)
         path = os.path.join(file_path, filename)
 
-        formatted_data = []
-        rows = data.split('\n')  # Split the data by newline to get each row
-        for row in rows:
-            if row:  # Check if the row is not empty
-                formatted_data.append(row.split(','))  # Split each row by comma
         with open(path, mode='a', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerows(formatted_data)  # Write properly formatted rows
+            if isinstance(data, np.ndarray):
+                # Binary readings are written in the same field format as ASCII blocks
+                csv.writer(file).writerows(format_rows(data, self.reading_axis()))
+            else:
+                # The block is comma separated already; only line endings and blank lines change
+                file.write(normalize_block(data))
         print("Data saved to CSV")
         
 
@@ -1,14 +1,31 @@
 import csv
 import datetime
+import importlib.util
+import io
+import json
 import os
-import pandas as pd
+import numpy as np
+from sweep_data import to_columns, format_fields
 
+# Storage backends for sweep results.
+# CSV keeps the text the instrument sent. NPZ and Parquet keep the readings as 64 bit
+# floats plus the instrument settings, which makes the files smaller and quick to reload
+# without losing any digit the instrument sent.
+
+# Folder all measurement files are saved in
+def data_folder():
+    file_path = os.path.join(os.environ['USERPROFILE'], 'Documents', 'HPData')
+    os.makedirs(file_path, exist_ok=True)
+    return file_path
+
+# Writes raw instrument text to a timestamped CSV file in its own folder
 class DataSave:
     def __init__(self, file_path=None):
-       if file_path is None:
+        if file_path is None:
             file_path = os.path.join(os.environ['USERPROFILE'], 'Documents', 'data_save')
-            os.makedirs(file_path, exist_ok=True)
-            
+        os.makedirs(file_path, exist_ok=True)
+        self.output_dir = file_path
+
     def save_csv(self, raw_data, headers=None, prefix="sweep"):
         # Clean and format the raw data
         formatted_data = self.format_data(raw_data)
@@ -26,4 +43,97 @@ class DataSave:
 
         print(f"[CSV] Data saved to: {filename}")
         return filename
-    
\ No newline at end of file
+
+    # Rows of the block with the quotes and blank lines the instrument sends removed
+    def format_data(self, raw_data):
+        return format_fields(*to_columns(raw_data))
+
+class CsvStore:
+    extension = ".csv"
+    requires = ()
+
+    def save(self, path, prefixes, values, metadata):
+        with open(path, mode='w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerows(format_fields(prefixes, values))
+        print(f"[CSV] Data saved to: {path}")
+
+    def load(self, path):
+        with open(path, newline='') as file:
+            prefixes, values = to_columns(file.read())
+        return prefixes, values, {}
+
+class NpzStore:
+    extension = ".npz"
+    requires = ()
+
+    def save(self, path, prefixes, values, metadata):
+        np.savez_compressed(path, values=np.asarray(values, dtype=np.float64), prefixes=np.array(prefixes, dtype=str),
+                            metadata=np.array(json.dumps(metadata)))
+        print(f"[NPZ] Data saved to: {path}")
+
+    def load(self, path):
+        with np.load(path, allow_pickle=False) as data:
+            return [str(p) for p in data["prefixes"]], data["values"].astype(float), json.loads(str(data["metadata"]))
+
+class ParquetStore:
+    extension = ".parquet"
+    requires = ("pandas", "pyarrow")
+
+    # Parquet needs pandas (and pyarrow), which are only imported when this format is used
+    def save(self, path, prefixes, values, metadata):
+        import pandas as pd
+        frame = pd.DataFrame(np.asarray(values, dtype=np.float64), columns=self.column_names(prefixes))
+        frame.attrs["metadata"] = json.dumps(dict(metadata, prefixes=list(prefixes)))
+        frame.to_parquet(path, index=False)
+        print(f"[Parquet] Data saved to: {path}")
+
+    def load(self, path):
+        import pandas as pd
+        frame = pd.read_parquet(path)
+        metadata = json.loads(frame.attrs.get("metadata", "{}"))
+        prefixes = metadata.pop("prefixes", list(frame.columns))
+        return prefixes, frame.to_numpy(dtype=float), metadata
+
+    # Column names are the field prefixes, numbered when a prefix repeats
+    def column_names(self, prefixes):
+        names = []
+        for i, prefix in enumerate(prefixes):
+            name = prefix or f"col{i}"
+            names.append(f"{name}_{i}" if name in names else name)
+        return names
+
+STORES = {
+    "csv": CsvStore(),
+    "npz": NpzStore(),
+    "parquet": ParquetStore(),
+}
+
+def get_store(name):
+    return STORES.get(name, STORES["csv"])
+
+# Names of the formats whose optional packages are installed
+def available_stores():
+    return [name for name, store in STORES.items()
+            if all(importlib.util.find_spec(package) is not None for package in store.requires)]
+
+def store_for_path(path):
+    extension = os.path.splitext(path)[1].lower()
+    for store in STORES.values():
+        if store.extension == extension:
+            return store
+    return STORES["csv"]
+
+# Returns (prefixes, values, metadata) for a saved measurement in any format
+def load_measurement(path):
+    return store_for_path(path).load(path)
+
+# Converts a saved measurement to CSV text in the instrument's field format
+def export_csv(path):
+    if store_for_path(path) is STORES["csv"]:
+        with open(path, newline='') as file:
+            return file.read()
+    prefixes, values, _ = load_measurement(path)
+    output = io.StringIO()
+    csv.writer(output).writerows(format_fields(prefixes, values))
+    return output.getvalue()
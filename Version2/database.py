@@ -1,17 +1,100 @@
 import sqlite3
 import csv
+import json
 import os
+import threading
+import time
 from datetime import datetime
-import bcrypt
-import pytz
-from pytz import timezone
 
 # Define the path to the database file
 DB_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "database.db")
 
+# One connection per thread, reused for every query that thread makes
+_local = threading.local()
+
+def get_db():
+    """Return this thread's database connection, opening and tuning it on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        # sqlite3 keeps compiled statements per connection, so reusing the connection
+        # (and identical SQL text) also reuses the prepared statements
+        conn = sqlite3.connect(DB_path, timeout=30, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")  # Readers no longer block the writer
+        conn.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL and much faster than FULL
+        conn.execute("PRAGMA busy_timeout=30000")  # Wait for a lock instead of failing with "database is locked"
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-8000")  # 8 MB page cache
+        _local.conn = conn
+    return conn
+
+def release_db():
+    """Roll back anything a failed request left uncommitted so the connection can be reused."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+def close_db():
+    """Close this thread's database connection."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+# Schema changes applied on top of the base tables, in order.
+# PRAGMA user_version stores how many of them the database file already has.
+MIGRATIONS = [
+    # 1: indexes for the history pages (per user and across all users, newest first)
+    [
+        "CREATE INDEX IF NOT EXISTS idx_measurements_user_date ON measurements (user_id, date_recorded, time_recorded)",
+        "CREATE INDEX IF NOT EXISTS idx_measurements_date ON measurements (date_recorded, time_recorded)",
+    ],
+    # 2: VISA address of the instrument each measurement was taken on
+    [
+        "ALTER TABLE measurements ADD COLUMN instrument TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_measurements_instrument ON measurements (instrument, date_recorded, time_recorded)",
+    ],
+    # 3: recipes, lists of sweeps run back to back
+    [
+        '''CREATE TABLE IF NOT EXISTS recipes (
+            recipe_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS recipe_steps (
+            step_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipe_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            function TEXT NOT NULL,
+            bias TEXT NOT NULL,
+            meas_range TEXT NOT NULL,
+            settings TEXT NOT NULL,
+            repeat_count INTEGER NOT NULL DEFAULT 1,
+            delay REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY (recipe_id) REFERENCES recipes (recipe_id)
+        )''',
+        "CREATE INDEX IF NOT EXISTS idx_recipes_user ON recipes (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_recipe_steps_recipe ON recipe_steps (recipe_id, position)",
+    ],
+]
+
+def migrate_db(conn):
+    """Apply any migrations the database does not have yet."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        for statement in statements:
+            conn.execute(statement)
+        conn.execute(f"PRAGMA user_version = {number}")
+        print(f"Database migrated to version {number}.")
+    conn.commit()
+
 def init_db():
     """Initialize the database and create necessary tables."""
-    conn = sqlite3.connect(DB_path)
+    conn = get_db()
+    # A database with every migration already has its tables and first users, so startup
+    # only needs this one read
+    if conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS):
+        return
     cursor = conn.cursor()
 
     # Create the users table if it doesn't exist
@@ -44,6 +127,7 @@ def init_db():
     user_count = cursor.fetchone()[0]
 
     if user_count == 0:
+        import bcrypt
         # Add the first user as an admin
         hashed_password = bcrypt.hashpw("Welcome1".encode('utf-8'), bcrypt.gensalt())
         cursor.execute('''
@@ -60,11 +144,11 @@ def init_db():
         #print("Demo user created with email: demo@hp4280a.com and password: demo")
 
     conn.commit()
-    conn.close()
+    migrate_db(conn)
 
 def add_user(first_name, last_name, email, password, is_admin=None):
     """Add a new user to the database."""
-    conn = sqlite3.connect(DB_path)
+    conn = get_db()
     cursor = conn.cursor()
 
     # Check if there are any existing admin users
@@ -83,46 +167,72 @@ def add_user(first_name, last_name, email, password, is_admin=None):
         VALUES (?, ?, ?, ?, ?)
     ''', (first_name, last_name, email, password, is_admin))
     conn.commit()
-    conn.close()
 
 def get_user_by_id(user_id):
     """Retrieve a user from the database by ID."""
-    conn = sqlite3.connect(DB_path)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
         SELECT * FROM users WHERE id = ?
     ''', (user_id,))
     user = cursor.fetchone()
-    conn.close()
     return user
 
 def get_user_by_email(email):
     """Retrieve a user from the database by email."""
-    conn = sqlite3.connect(DB_path)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
         SELECT * FROM users WHERE email = ?
     ''', (email,))
     user = cursor.fetchone()
-    conn.close()
     return user
 
+# Short lived cache of user rows by email, shared by all threads.
+# Anything that changes a user must call invalidate_user_cache().
+USER_CACHE_TTL = 30.0
+_user_cache = {}
+_user_cache_lock = threading.Lock()
+
+def get_cached_user(email):
+    """Retrieve a user by email, reusing a lookup made in the last USER_CACHE_TTL seconds."""
+    now = time.monotonic()
+    with _user_cache_lock:
+        entry = _user_cache.get(email)
+    if entry is not None and now - entry[0] < USER_CACHE_TTL:
+        return entry[1]
+
+    user = get_user_by_email(email)
+    if user is not None:
+        with _user_cache_lock:
+            _user_cache[email] = (now, user)
+    return user
+
+def invalidate_user_cache(email=None):
+    """Forget the cached row of one user, or of every user when no email is given."""
+    with _user_cache_lock:
+        if email is None:
+            _user_cache.clear()
+        else:
+            _user_cache.pop(email, None)
+
 def delete_user_by_id(user_id):
     """Delete a user from the database by ID."""
-    conn = sqlite3.connect(DB_path)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
         DELETE FROM users WHERE id = ?
     ''', (user_id,))
     conn.commit()
-    conn.close()
+    invalidate_user_cache()
 
 
-def add_measurement(user_id, test_type, csv_file_path):
+def add_measurement(user_id, test_type, csv_file_path, instrument=None):
     """
     Add a new measurement to the database and return the measurement ID.
     """
-    conn = sqlite3.connect(DB_path)  # Create a database connection
+    from pytz import timezone
+    conn = get_db()  # Reuse this thread's database connection
     cursor = conn.cursor()  # Create a cursor object
 
     # Get the current time in UTC and convert it to EST
@@ -135,18 +245,17 @@ def add_measurement(user_id, test_type, csv_file_path):
 
     # Insert the measurement into the database
     cursor.execute('''
-        INSERT INTO measurements (user_id, test_type, csv_file_path, date_recorded, time_recorded)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (user_id, test_type, csv_file_path, date_recorded, time_recorded))
+        INSERT INTO measurements (user_id, test_type, csv_file_path, date_recorded, time_recorded, instrument)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (user_id, test_type, csv_file_path, date_recorded, time_recorded, instrument))
     conn.commit()
     measurement_id = cursor.lastrowid  # Get the ID of the newly inserted measurement
-    conn.close()  # Close the database connection
     return measurement_id
 
 
 def get_measurements(user_id=None):
     """Retrieve measurements from the database, optionally filtered by user_id."""
-    conn = sqlite3.connect(DB_path)
+    conn = get_db()
     cursor = conn.cursor()
     if user_id:
         cursor.execute('''
@@ -155,12 +264,159 @@ def get_measurements(user_id=None):
     else:
         cursor.execute('SELECT * FROM measurements')
     measurements = cursor.fetchall()
-    conn.close()
     return measurements
 
+def get_measurements_page(user_id=None, test_type=None, instrument=None, date_from=None, date_to=None, before=None, limit=50):
+    """
+    Retrieve one page of measurements, newest first, with the user's full name.
+    `before` is the cursor returned for the previous page. Returns (rows, next_cursor),
+    where next_cursor is None on the last page.
+    """
+    conditions = []
+    params = []
+    if user_id:
+        conditions.append("m.user_id = ?")
+        params.append(user_id)
+    if test_type:
+        conditions.append("m.test_type = ?")
+        params.append(test_type)
+    if instrument:
+        conditions.append("m.instrument = ?")
+        params.append(instrument)
+    if date_from:
+        conditions.append("m.date_recorded >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("m.date_recorded <= ?")
+        params.append(date_to)
+    if before:
+        # Keyset pagination: continue right after the last row of the previous page
+        conditions.append("(m.date_recorded, m.time_recorded, m.measurement_id) < (?, ?, ?)")
+        params.extend(before)
+
+    query = '''
+        SELECT m.measurement_id, m.date_recorded, m.time_recorded, u.first_name || ' ' || u.last_name AS full_name, m.test_type,
+               m.instrument
+        FROM measurements m
+        JOIN users u ON m.user_id = u.id
+    '''
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY m.date_recorded DESC, m.time_recorded DESC, m.measurement_id DESC LIMIT ?"
+    params.append(limit + 1)
+
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = f"{last[1]}|{last[2]}|{last[0]}"
+    return rows, next_cursor
+
+def parse_page_cursor(cursor_text):
+    """Turn a cursor from get_measurements_page back into its (date, time, id) values."""
+    try:
+        date_recorded, time_recorded, measurement_id = cursor_text.split("|")
+        return (date_recorded, time_recorded, int(measurement_id))
+    except (AttributeError, ValueError):
+        return None
+
+def get_test_types(user_id=None):
+    """Retrieve the distinct test types, optionally only those of one user."""
+    conn = get_db()
+    cursor = conn.cursor()
+    if user_id:
+        cursor.execute("SELECT DISTINCT test_type FROM measurements WHERE user_id = ? ORDER BY test_type", (user_id,))
+    else:
+        cursor.execute("SELECT DISTINCT test_type FROM measurements ORDER BY test_type")
+    return [row[0] for row in cursor.fetchall()]
+
+def get_instruments(user_id=None):
+    """Retrieve the distinct instruments measurements were taken on, optionally only those of one user."""
+    conn = get_db()
+    cursor = conn.cursor()
+    if user_id:
+        cursor.execute("SELECT DISTINCT instrument FROM measurements WHERE user_id = ? AND instrument IS NOT NULL ORDER BY instrument", (user_id,))
+    else:
+        cursor.execute("SELECT DISTINCT instrument FROM measurements WHERE instrument IS NOT NULL ORDER BY instrument")
+    return [row[0] for row in cursor.fetchall()]
+
+def add_recipe(user_id, name):
+    """Add an empty recipe and return its ID."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO recipes (user_id, name) VALUES (?, ?)", (user_id, name))
+    conn.commit()
+    return cursor.lastrowid
+
+def get_recipes(user_id):
+    """Retrieve a user's recipes as (recipe_id, name) rows."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT recipe_id, name FROM recipes WHERE user_id = ? ORDER BY name", (user_id,))
+    return cursor.fetchall()
+
+def get_recipe(recipe_id):
+    """Retrieve a recipe (recipe_id, user_id, name) by ID."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT recipe_id, user_id, name FROM recipes WHERE recipe_id = ?", (recipe_id,))
+    return cursor.fetchone()
+
+def delete_recipe(recipe_id):
+    """Delete a recipe and its steps."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM recipe_steps WHERE recipe_id = ?", (recipe_id,))
+    cursor.execute("DELETE FROM recipes WHERE recipe_id = ?", (recipe_id,))
+    conn.commit()
+
+def add_recipe_step(recipe_id, function, bias, meas_range, settings, repeat_count=1, delay=0.0):
+    """Append a step to a recipe. settings is a dict of sweep settings, stored as JSON."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(position), 0) + 1 FROM recipe_steps WHERE recipe_id = ?", (recipe_id,))
+    position = cursor.fetchone()[0]
+    cursor.execute('''
+        INSERT INTO recipe_steps (recipe_id, position, function, bias, meas_range, settings, repeat_count, delay)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (recipe_id, position, function, bias, meas_range, json.dumps(settings), repeat_count, delay))
+    conn.commit()
+    return cursor.lastrowid
+
+def get_recipe_steps(recipe_id):
+    """Retrieve the steps of a recipe in order, as dicts."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT step_id, position, function, bias, meas_range, settings, repeat_count, delay
+        FROM recipe_steps WHERE recipe_id = ? ORDER BY position
+    ''', (recipe_id,))
+    return [{
+        "step_id": row[0],
+        "position": row[1],
+        "function": row[2],
+        "bias": row[3],
+        "meas_range": row[4],
+        "settings": json.loads(row[5]),
+        "repeat_count": row[6],
+        "delay": row[7],
+    } for row in cursor.fetchall()]
+
+def delete_recipe_step(step_id):
+    """Delete one step of a recipe."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM recipe_steps WHERE step_id = ?", (step_id,))
+    conn.commit()
+
 def export_measurements_to_csv(filename="measurements.csv"):
     """Export all measurements to a CSV file."""
-    conn = sqlite3.connect(DB_path)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
         SELECT m.measurement_id, m.date_recorded, m.time_recorded,
@@ -169,14 +425,14 @@ def export_measurements_to_csv(filename="measurements.csv"):
         JOIN users u ON m.user_id = u.id
     ''')
     measurements = cursor.fetchall()
-    conn.close()
     with open(filename, 'w', newline='') as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(['Measurement ID', 'Date', 'Time', 'Full Name', 'Test Type'])
         writer.writerows(measurements)
 
 def migrate_passwords():
-    conn = sqlite3.connect(DB_path)
+    import bcrypt
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("SELECT id, password FROM users")
     users = cursor.fetchall()
@@ -191,5 +447,4 @@ def migrate_passwords():
             cursor.execute("UPDATE users SET password = ? WHERE id = ?", (hashed_password, user_id))
 
     conn.commit()
-    conn.close()
     print("Password migration completed.")
\ No newline at end of file
@@ -0,0 +1,121 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from analysis import measurement_curve
+from data_save import load_measurement
+
+# Downsampling of saved measurements for plotting.
+# Every file gets a pyramid of min/max decimated levels, each about LEVEL_FACTOR times
+# smaller than the one below it. A request picks the coarsest level that still has enough
+# readings in the visible x range and reduces only those to the requested number of points,
+# so zooming into a file with millions of readings costs about as much as drawing a small one.
+
+DEFAULT_POINTS = 2000
+MIN_POINTS = 10
+MAX_POINTS = 20000
+LEVEL_FACTOR = 4
+MIN_LEVEL_POINTS = 1000  # Pyramids stop at the first level with fewer readings than this
+OVERSAMPLE = 4  # A level is used when it has this many times the requested points in range
+MAX_CACHED_FILES = 16
+METHODS = ("lttb", "minmax")
+
+# Indices of the lowest and highest reading in each of about `buckets` equal runs of readings
+def minmax(y, buckets):
+    n = len(y)
+    if buckets < 1 or 2 * buckets >= n:
+        return np.arange(n)
+    size = -(-n // buckets)
+    full = n // size * size
+    blocks = y[:full].reshape(-1, size)
+    starts = np.arange(0, full, size)
+    picked = [starts + blocks.argmin(axis=1), starts + blocks.argmax(axis=1), [0, n - 1]]
+    if full < n:
+        picked.append([full + np.argmin(y[full:]), full + np.argmax(y[full:])])
+    return np.unique(np.concatenate(picked))
+
+# Indices of `points` readings chosen by Largest Triangle Three Buckets, which keeps the
+# visual shape of a line plot
+def lttb(x, y, points):
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, points - 1).astype(int)
+    selected = np.empty(points, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x, next_y = x[end:edges[i + 2]].mean(), y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[n - 1], y[n - 1]
+        areas = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+def downsample(x, y, points, method):
+    if method == "minmax":
+        return minmax(y, max(1, (points - 2) // 2))
+    return lttb(x, y, points)
+
+class Pyramid:
+    def __init__(self, axis, x, c):
+        self.axis = axis
+        self.x = x
+        self.c = c
+        self.levels = [np.arange(len(x))]  # Reading indices kept at each level, finest first
+        while len(self.levels[-1]) >= MIN_LEVEL_POINTS:
+            level = self.levels[-1]
+            kept = level[minmax(c[level], len(level) // (2 * LEVEL_FACTOR))]
+            if len(kept) >= len(level):
+                break
+            self.levels.append(kept)
+
+    def query(self, points=DEFAULT_POINTS, x0=None, x1=None, method="lttb"):
+        for level_number in range(len(self.levels) - 1, -1, -1):
+            level = self.levels[level_number]
+            inside = level if x0 is None or x1 is None else level[(self.x[level] >= x0) & (self.x[level] <= x1)]
+            if len(inside) >= points * OVERSAMPLE:
+                break
+        shown = inside[downsample(self.x[inside], self.c[inside], points, method)] if len(inside) else inside
+        return {
+            "axis": self.axis,
+            "x": self.x[shown].tolist(),
+            "c": self.c[shown].tolist(),
+            "total": int(len(self.x)),
+            "shown": int(len(shown)),
+            "level": level_number,
+            "method": method,
+            "x_range": [float(self.x.min()), float(self.x.max())] if len(self.x) else None,
+        }
+
+_pyramids = OrderedDict()  # path -> ((mtime, size), Pyramid), least recently used first
+_pyramid_lock = threading.Lock()
+
+# Pyramid of a saved measurement, rebuilt when the file changes
+def file_pyramid(path):
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _pyramid_lock:
+        entry = _pyramids.get(path)
+        if entry is not None and entry[0] == version:
+            _pyramids.move_to_end(path)
+            return entry[1]
+
+    prefixes, values, _ = load_measurement(path)
+    pyramid = Pyramid(*measurement_curve(prefixes, values))
+    with _pyramid_lock:
+        _pyramids[path] = (version, pyramid)
+        _pyramids.move_to_end(path)
+        while len(_pyramids) > MAX_CACHED_FILES:
+            _pyramids.popitem(last=False)
+    return pyramid
+
+# Plot series of a saved measurement with at most `points` readings between x0 and x1
+def plot_data(path, points=DEFAULT_POINTS, x0=None, x1=None, method="lttb"):
+    points = min(max(points, MIN_POINTS), MAX_POINTS)
+    if method not in METHODS:
+        method = METHODS[0]
+    return file_pyramid(path).query(points, x0, x1, method)
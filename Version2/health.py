@@ -0,0 +1,85 @@
+import threading
+import time
+
+# Background connection health monitor.
+# One thread per instrument sends a cheap ID? query every few seconds and keeps
+# the result, so page renders read a cached status instead of touching the bus.
+
+DEFAULT_INTERVAL = 5.0  # Seconds between probes
+PROBE_TIMEOUT = 2000  # VISA timeout (ms) for a probe, much shorter than a sweep read
+
+class HealthMonitor(threading.Thread):
+    def __init__(self, conn, interval=DEFAULT_INTERVAL, probe="ID?", in_use=None):
+        super().__init__(name=f"health-{conn.get_MAC()}", daemon=True)
+        self.conn = conn
+        self.in_use = in_use  # Returns True while a job has the instrument, e.g. between its exchanges
+        self.interval = interval
+        self.probe_command = probe
+        self.connected = getattr(conn, "connected", False)  # Result of connect() until the first probe
+        self.busy = False  # True while other traffic held the bus at the last probe
+        self.last_seen = None  # Time of the last successful probe
+        self.last_checked = None
+        self.latency = None  # Seconds the last successful probe took
+        self.error = None
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.probe()
+            self.stop_event.wait(self.interval)
+
+    def stop(self):
+        self.stop_event.set()
+
+    # Starts watching a new connection object for the same instrument
+    def watch(self, conn):
+        self.conn = conn
+
+    def probe(self):
+        conn = self.conn
+        lock = getattr(conn, "io_lock", None)
+        # Never wait for the bus, and never query in the middle of a sweep: a sweep in
+        # progress is proof enough that the instrument answers
+        if self.in_use is not None and self.in_use():
+            self.busy = True
+            return
+        if lock is not None and not lock.acquire(blocking=False):
+            self.busy = True
+            return
+        try:
+            self.busy = False
+            self.last_checked = time.time()
+            if conn.inst is None:
+                self.connected = False
+                self.error = "No connection to instrument."
+                return
+            previous_timeout = conn.inst.timeout
+            conn.inst.timeout = PROBE_TIMEOUT
+            start = time.perf_counter()
+            try:
+                conn.inst.query(self.probe_command)
+            finally:
+                conn.inst.timeout = previous_timeout
+            self.latency = time.perf_counter() - start
+            self.last_seen = time.time()
+            self.connected = True
+            self.error = None
+        except Exception as e:
+            self.connected = False
+            self.error = str(e)
+        finally:
+            conn.connected = self.connected
+            if lock is not None:
+                lock.release()
+
+    def snapshot(self):
+        return {
+            "instrument": self.conn.get_MAC(),
+            "connected": self.connected,
+            "busy": self.busy,
+            "last_seen": self.last_seen,
+            "last_checked": self.last_checked,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "error": self.error,
+            "interval": self.interval,
+        }
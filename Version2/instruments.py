@@ -0,0 +1,205 @@
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+from transport import RecordingVisaCon, session_path
+
+# Shared instrument registry.
+# Every VISA address gets exactly one connection, one controller and two locks, no matter
+# how many users are logged in:
+#   lease  held by a user's request or a background job for a sequence of commands; users
+#          queue for it in the order they asked, pages give up at once while a job holds it
+#   bus    held only for a single exchange (e.g. READ? and the block read), so status polls
+#          and reconnects never wait for a whole sweep
+
+REQUEST_WAIT = 2.0  # Seconds a page waits for another user's request before reporting busy
+
+class InstrumentBusy(Exception):
+    pass
+
+class FairLock:
+    """Reentrant lock that is handed out first come, first served."""
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.owner = None  # Thread ident of the current holder
+        self.depth = 0
+        self.waiting = deque()
+        self.holder = None  # Label (user email) of the current holder, for status pages
+
+    def acquire(self, blocking=True, timeout=-1, label=None):
+        me = threading.get_ident()
+        with self.condition:
+            if self.owner == me:
+                self.depth += 1
+                return True
+            if self.owner is None and not self.waiting:
+                self.take(me, label)
+                return True
+            if not blocking:
+                return False
+
+            ticket = object()
+            self.waiting.append(ticket)
+            acquired = self.condition.wait_for(
+                lambda: self.owner is None and self.waiting[0] is ticket,
+                None if timeout < 0 else timeout)
+            self.waiting.remove(ticket)
+            if acquired:
+                self.take(me, label)
+            else:
+                self.condition.notify_all()  # Let the next ticket move up
+            return acquired
+
+    def take(self, me, label):
+        self.owner = me
+        self.depth = 1
+        self.holder = label
+
+    def release(self):
+        with self.condition:
+            if self.owner != threading.get_ident():
+                raise RuntimeError("Cannot release a lock held by another thread.")
+            self.depth -= 1
+            if self.depth == 0:
+                self.owner = None
+                self.holder = None
+                self.condition.notify_all()
+
+    def queue_length(self):
+        return len(self.waiting)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Instrument:
+    def __init__(self, key, addr, simulated):
+        self.key = key
+        self.addr = addr
+        self.simulated = simulated
+        self.conn = None
+        self.controller = None
+        self.lock = FairLock()  # The lease
+        self.bus = threading.RLock()
+        self.job = None  # Background job holding the lease
+        self.users = set()  # Emails of the users working with this instrument
+
+    # Holds the instrument for a sequence of commands from one user or job. With a timeout
+    # (pages) it raises InstrumentBusy instead of waiting for a job, which may take minutes
+    @contextmanager
+    def lease(self, owner=None, timeout=None, job=None):
+        mine = self.lock.owner == threading.get_ident()
+        if timeout is not None and self.job is not None and not mine:
+            raise self.busy()
+        if not self.lock.acquire(timeout=-1 if timeout is None else timeout, label=owner):
+            raise self.busy()
+        previous = self.job
+        if job is not None:
+            self.job = job
+        try:
+            yield self
+        finally:
+            self.job = previous
+            self.lock.release()
+
+    def busy(self):
+        return InstrumentBusy(f"The instrument at {self.addr} is busy with {self.lock.holder or 'another user'}. "
+                              "Try again when it has finished.")
+
+    def status(self):
+        return {
+            "key": self.key,
+            "address": self.addr,
+            "simulated": self.simulated,
+            "connected": self.conn is not None and self.conn.check_connection(),
+            "holder": self.lock.holder,
+            "waiting": self.lock.queue_length(),
+            "users": sorted(self.users),
+        }
+
+
+class InstrumentRegistry:
+    def __init__(self, visa_class, simulated_class, record_folder=None):
+        self.visa_class = visa_class
+        self.simulated_class = simulated_class
+        self.record_folder = record_folder  # Sessions are recorded here when set (see transport.py)
+        self.rm = None  # One pyvisa ResourceManager shared by all instruments
+        self.instruments = {}
+        self.lock = threading.Lock()
+
+    def resource_manager(self):
+        if self.rm is None:
+            import pyvisa
+            self.rm = pyvisa.ResourceManager()
+        return self.rm
+
+    # Lists the GPIB instruments the ResourceManager can see
+    def discover(self, query="GPIB?*::INSTR"):
+        try:
+            return sorted(self.resource_manager().list_resources(query))
+        except Exception as e:
+            print(f"Instrument discovery failed: {e}")
+            return []
+
+    # Returns the instrument at addr, opening its session only if it is not open yet
+    def get(self, addr, simulated=False):
+        key = f"SIM::{addr}" if simulated else addr
+        with self.lock:
+            instrument = self.instruments.get(key)
+            if instrument is None:
+                instrument = Instrument(key, addr, simulated)
+                self.instruments[key] = instrument
+
+        with instrument.bus:
+            if instrument.conn is None:
+                instrument.conn = self.open(instrument)
+            elif instrument.conn.inst is None or not instrument.conn.check_connection():
+                instrument.conn.connect()
+                if instrument.controller is not None:
+                    instrument.controller.invalidate_state()
+        return instrument
+
+    def open(self, instrument):
+        if instrument.simulated:
+            conn = self.simulated_class(instrument.addr)
+        else:
+            conn = self.visa_class(instrument.addr, rm=self.resource_manager(), connect=False)
+        if self.record_folder:
+            os.makedirs(self.record_folder, exist_ok=True)
+            conn = RecordingVisaCon(conn, session_path(self.record_folder, instrument.addr))
+        # The instrument's bus lock outlives the connection, so nothing slips in during a reconnect
+        conn.io_lock = instrument.bus
+        conn.connect()
+        return conn
+
+    # Closes and reopens the session of an instrument, e.g. after the bus was reset
+    def reconnect(self, key):
+        instrument = self.instruments.get(key)
+        if instrument is None:
+            return None
+        with instrument.bus:
+            if instrument.controller is not None:
+                instrument.controller.reconnect()
+            elif instrument.conn is not None:
+                instrument.conn.disconnect()
+                instrument.conn.connect()
+        return instrument
+
+    def find(self, addr, simulated=False):
+        return self.instruments.get(f"SIM::{addr}" if simulated else addr)
+
+    def for_controller(self, ctrl):
+        for instrument in self.instruments.values():
+            if instrument.controller is ctrl:
+                return instrument
+        return None
+
+    # Forgets a user; the session stays open so the next login does not pay for a reconnect
+    def release(self, key, owner):
+        instrument = self.instruments.get(key)
+        if instrument is not None:
+            instrument.users.discard(owner)
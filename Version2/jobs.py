@@ -0,0 +1,160 @@
+import itertools
+import queue
+import threading
+import time
+import traceback
+
+# Background jobs for long instrument operations (sweeps).
+# Every instrument gets its own worker thread that runs jobs in the order they
+# were submitted, so a sweep never ties up the HTTP request that started it.
+
+class Job:
+    def __init__(self, job_id, key, owner, description, func):
+        self.id = job_id
+        self.key = key  # Instrument the job runs on
+        self.owner = owner  # Email of the user that submitted the job
+        self.description = description
+        self.func = func
+        self.status = "queued"  # queued, running, done, failed, cancelled
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.points = []  # Data points published while the job runs
+        self.updated = threading.Condition()
+
+    # A job still in the queue is finished at once; a running one stops at its next check
+    def cancel(self):
+        self.cancel_event.set()
+        with self.updated:
+            if self.status == "queued":
+                self.status = "cancelled"
+                self.finished = time.time()
+                self.updated.notify_all()
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def finished_running(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def set_progress(self, fraction, message=None):
+        self.progress = max(0.0, min(1.0, fraction))
+        if message is not None:
+            self.message = message
+
+    # Adds a live data point and wakes up any stream waiting for it
+    def publish(self, point):
+        with self.updated:
+            self.points.append(point)
+            self.updated.notify_all()
+
+    def notify(self):
+        with self.updated:
+            self.updated.notify_all()
+
+    # Returns the points after `index`, waiting up to `timeout` seconds for new ones
+    def wait_for_points(self, index, timeout=1.0):
+        with self.updated:
+            if len(self.points) <= index and not self.finished_running():
+                self.updated.wait(timeout)
+            return self.points[index:]
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "instrument": self.key,
+            "description": self.description,
+            "status": self.status,
+            "progress": round(self.progress, 3),
+            "message": self.message,
+            "error": self.error,
+            "result": self.result,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class JobWorker(threading.Thread):
+    def __init__(self, key):
+        super().__init__(name=f"jobs-{key}", daemon=True)
+        self.key = key
+        self.queue = queue.Queue()
+        self.current = None
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            with job.updated:  # Under the job's lock, so Job.cancel sees it either queued or running
+                if job.cancelled():
+                    continue
+                job.status = "running"
+                job.started = time.time()
+
+            self.current = job
+            try:
+                job.result = job.func(job)
+                if job.cancelled():
+                    job.status = "cancelled"
+                else:
+                    job.status = "done"
+                    job.progress = 1.0
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                print(f"Job {job.id} failed: {e}")
+                traceback.print_exc()
+            job.finished = time.time()
+            job.notify()
+            self.current = None
+
+
+class JobManager:
+    def __init__(self, keep=200):
+        self.keep = keep  # Number of finished jobs kept for status lookups
+        self.jobs = {}
+        self.workers = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    # Queues func(job) on the worker for the given instrument key
+    def submit(self, key, owner, description, func):
+        with self.lock:
+            job = Job(next(self.ids), key, owner, description, func)
+            self.jobs[job.id] = job
+            worker = self.workers.get(key)
+            if worker is None:
+                worker = JobWorker(key)
+                self.workers[key] = worker
+                worker.start()
+            self.prune()
+        worker.queue.put(job)
+        print(f"Job {job.id} queued on {key}: {description}")
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is not None and not job.finished_running():
+            job.cancel()
+        return job
+
+    def jobs_for(self, owner):
+        return [job for job in self.jobs.values() if job.owner == owner]
+
+    def busy(self, key):
+        worker = self.workers.get(key)
+        return worker is not None and (worker.current is not None or not worker.queue.empty())
+
+    # Drops the oldest finished jobs once more than `keep` are stored
+    def prune(self):
+        finished = [job for job in self.jobs.values() if job.finished_running()]
+        for job in sorted(finished, key=lambda j: j.id)[:max(0, len(finished) - self.keep)]:
+            del self.jobs[job.id]
@@ -1,27 +1,40 @@
 # Import Statements and Flask App Initialization ###################################################################################################################################################
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, session, send_from_directory, send_file, jsonify, Response, g
 from controller import controller
-from database import init_db, add_user, get_user_by_id, get_user_by_email, add_measurement, get_measurements
-from simulated_visacon import SimulatedVisaCon
+from database import init_db, add_user, get_user_by_id, get_user_by_email, add_measurement, get_measurements, get_db, release_db
+from database import get_measurements_page, parse_page_cursor, get_test_types, get_instruments, get_cached_user, invalidate_user_cache
+from database import add_recipe, get_recipes, get_recipe, delete_recipe, add_recipe_step, get_recipe_steps, delete_recipe_step
+from simulated_visacon import SimulatedVisaCon, DEFAULT_ADDRESS as SIMULATED_ADDRESS
+from jobs import JobManager
+from instruments import InstrumentRegistry, InstrumentBusy, REQUEST_WAIT
+from health import HealthMonitor, DEFAULT_INTERVAL
+from data_save import available_stores, data_folder, export_csv
+from sweep_planner import plan_sweep
+from analysis import analyze_file
+from decimate import plot_data, DEFAULT_POINTS
+from assets import find_asset, asset_etag, plotly_bundle, precompress_in_background, CACHE_SECONDS
+from tracing import tracer
+import recipes
+from werkzeug.utils import safe_join
 from datetime import datetime
-import pytz
-from pytz import timezone
-import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 import csv
+import importlib.util
+import json
+import mimetypes
 import time
-import webview
-import bcrypt
-
-# Define the path to the database file
-DB_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "database.db")
 
 app = Flask(__name__)
 app.secret_key = "your_secret_key"  # Required for flashing messages and session management
+app.config["HEALTH_CHECK_INTERVAL"] = DEFAULT_INTERVAL  # Seconds between background instrument probes
 
 @app.template_filter('datetimeformat')
 def datetimeformat(value, format='%Y-%m-%d'):
     """Custom filter to format datetime values, converting from UTC to Eastern Time."""
+    import pytz
+    from pytz import timezone
     try:
         # Define UTC timezone
         utc = pytz.utc
@@ -47,21 +60,55 @@ def datetimeformat(value, format='%Y-%m-%d'):
                 # If all parsing fails, return original value
                 return value
     return dt.strftime(format)
+@app.template_filter('clock')
+def clock(timestamp):
+    """Format a Unix time as the local time of day."""
+    return datetime.fromtimestamp(timestamp).strftime('%H:%M:%S')
+
+@app.template_global()
+def asset_url(name):
+    """URL of a bundled front-end file; the hash changes whenever the file does."""
+    return url_for('asset', filename=name, v=asset_etag(name))
+
+@app.template_global()
+def plotly_url():
+    """URL of the bundled Plotly library."""
+    return asset_url(plotly_bundle())
+
 # Initialize the database
 init_db()
 
-# Import the real VisaCon class if it exists
-try:
-    from visacon import VisaCon
-except ImportError:
+@app.teardown_request
+def teardown_db(exception):
+    """Leave the thread's database connection clean for the next request."""
+    release_db()
+
+# Use the real VisaCon class if pyvisa is installed (it is only imported once an instrument is opened)
+if importlib.util.find_spec("pyvisa") is not None:
+    from visacon import VisaCon, DEFAULT_ADDRESS
+else:
     # Use the simulated version as a fallback
     VisaCon = SimulatedVisaCon
+    DEFAULT_ADDRESS = SIMULATED_ADDRESS
+
+DEMO_EMAIL = "demo@hp4280a.com"
+
+# Simulated stations offered to the demo user (and to everyone when pyvisa is missing)
+SIMULATED_STATIONS = [SIMULATED_ADDRESS, "GPIB0::18::INSTR"]
+
+def current_user():
+    """Return the logged in user's row, looked up at most once per request."""
+    if 'email' not in session:
+        return None
+    if 'user' not in g:
+        g.user = get_cached_user(session['email'])
+    return g.user
 
 @app.context_processor
 def inject_user_info():
     """Inject user information into all templates"""
     if 'email' in session:
-        user = get_user_by_email(session['email'])
+        user = current_user()
         if user:
             return {
                 'username': f"{user[1]} {user[2]}",  # First name and last name
@@ -76,21 +123,86 @@ def inject_user_info():
         'is_admin': False
     }
 
-# Global Dictionary to store controller instances through session ID
+# Shared instruments: one VISA session, one controller and one lock per address.
+# Set HP4280A_RECORD to a folder to record every instrument session in it (see transport.py).
+instruments = InstrumentRegistry(VisaCon, SimulatedVisaCon, record_folder=os.environ.get("HP4280A_RECORD"))
+
+# Global Dictionary to store the instrument each session works with
 gpib_connections = {}
 
+# Instruments opened in the background after login, keyed by session; opening one can take
+# seconds (or a VISA timeout), so pages only wait for it when they need the instrument
+pending_connections = {}
+connector = ThreadPoolExecutor(max_workers=4, thread_name_prefix="connect")
+
+# Background sweep jobs, one worker thread per instrument
+jobs = JobManager()
+
+# Background health monitors, one per instrument
+health_monitors = {}
+
+def watch_connection(instrument):
+    """Start (or repoint) the health monitor for an instrument."""
+    monitor = health_monitors.get(instrument.key)
+    if monitor is None:
+        monitor = HealthMonitor(instrument.conn, interval=app.config["HEALTH_CHECK_INTERVAL"],
+                                in_use=lambda: instrument.job is not None)
+        health_monitors[instrument.key] = monitor
+        monitor.start()
+    else:
+        monitor.watch(instrument.conn)
+    return monitor
+
+def session_instrument():
+    """Return the registry entry of the session's instrument, or None if it has none yet."""
+    ctrl = gpib_connections.get(session.get('email'))
+    if ctrl is None:
+        return None
+    return instruments.for_controller(ctrl)
+
+def connection_health():
+    """Return the cached health of the session's instrument, or None if it has no connection."""
+    instrument = session_instrument()
+    if instrument is None:
+        return None
+    monitor = health_monitors.get(instrument.key)
+    if monitor is None:
+        return None
+    health = dict(monitor.snapshot(), holder=instrument.lock.holder, waiting=instrument.lock.queue_length())
+    health["busy"] = health["busy"] or instrument.job is not None
+    return health
+
+def describe_health(health):
+    """Turn a health snapshot into terminal output lines."""
+    if health["connected"]:
+        lines = ["Connected to device."]
+        if health["last_seen"]:
+            lines.append(f"Last seen {datetime.fromtimestamp(health['last_seen']).strftime('%H:%M:%S')}"
+                         f" ({health['latency_ms']} ms).")
+    else:
+        lines = ["Not connected."]
+        if health["error"]:
+            lines.append(health["error"])
+    if health["busy"]:
+        lines.append("Instrument busy with a measurement.")
+    return lines
+
 # Status and terminal output for connection status
 @app.context_processor
 def inject_connection_status():
     """Inject connection status into all templates"""
-    if 'email' in session and session['email'] in gpib_connections:
-        ctrl = gpib_connections[session['email']]
-        if hasattr(ctrl, 'conn') and hasattr(ctrl.conn, 'check_connection'):
-            connected = ctrl.conn.check_connection()
-            return {
-                'connection_status': 'success' if connected else 'failure',
-                'terminal_output': ["Connected to device." if connected else "Not connected."]
-            }
+    # Only reads the monitor's cached status, never the GPIB bus
+    if connection_pending():
+        return {
+            'connection_status': 'pending',
+            'terminal_output': ["Connecting to device..."]
+        }
+    health = connection_health()
+    if health is not None:
+        return {
+            'connection_status': 'success' if health["connected"] else 'failure',
+            'terminal_output': describe_health(health)
+        }
     return {
         'connection_status': 'failure',
         'terminal_output': ["No connection."]
@@ -103,25 +215,67 @@ def get_controller():
         raise Exception("No session ID found. User must be logged in.")
 
     if session_id not in gpib_connections:
+        future = pending_connections.get(session_id) or connect_in_background()
+        try:
+            future.result()  # Raises the error that stopped the connection
+        finally:
+            pending_connections.pop(session_id, None)  # A failed connection is tried again next time
+
+    return gpib_connections[session_id]
+
+def connect_in_background():
+    """Start opening the current session's instrument without waiting for it."""
+    session_id = session.get('email')
+    future = pending_connections.get(session_id)
+    if future is None:
         # Determine the connection type
-        user = get_user_by_email(session_id)
+        user = current_user()
         if not user:
             raise Exception("User not found.")
-
-        if user[3] == "demo@hp4280a.com":
-            gpib_connection = SimulatedVisaCon()
-        else:
-            gpib_connection = VisaCon()
-
-        # Connect the GPIB connection
-        gpib_connection.connect()
-        if not gpib_connection.check_connection():
-            raise Exception("Failed to connect to the GPIB device. If reconnected, please wait 10 seconds before trying again.")
-        
-
-        # Create a controller instance and store it in the dictionary
-        gpib_connections[session_id] = controller(
-            conn=gpib_connection,
+        future = connector.submit(connect_session, session_id,
+                                  session.get('instrument') or default_address(user), uses_simulator(user))
+        pending_connections[session_id] = future
+    return future
+
+def connect_session(session_id, addr, simulated):
+    """Open an instrument for a session; runs on a connector thread."""
+    instrument = open_instrument(addr, simulated)
+    instrument.users.add(session_id)
+    gpib_connections[session_id] = instrument.controller
+
+def connection_pending():
+    """Whether the session's instrument is still being opened."""
+    future = pending_connections.get(session.get('email'))
+    return future is not None and not future.done()
+
+def uses_simulator(user):
+    """Whether the user works with simulated stations instead of real instruments."""
+    return user[3] == DEMO_EMAIL or VisaCon is SimulatedVisaCon
+
+def default_address(user):
+    return SIMULATED_ADDRESS if uses_simulator(user) else DEFAULT_ADDRESS
+
+def available_instruments(user):
+    """Addresses the user can pick from: discovered instruments plus any already open."""
+    if uses_simulator(user):
+        return list(SIMULATED_STATIONS)
+    addresses = set(instruments.discover())
+    addresses.update(instrument.addr for instrument in instruments.instruments.values() if not instrument.simulated)
+    addresses.add(DEFAULT_ADDRESS)
+    return sorted(addresses)
+
+def open_instrument(addr, simulated):
+    """Return the shared instrument at addr with its controller, connecting it if needed."""
+    # Everyone shares the instrument's connection; only the first user opens it
+    instrument = instruments.get(addr, simulated=simulated)
+    if not instrument.conn.check_connection():
+        raise Exception(f"Failed to connect to the GPIB device at {addr}. If reconnected, please wait 10 seconds before trying again.")
+    watch_connection(instrument)
+
+    # The controller is shared too, so its cache matches what the instrument is really set to
+    if instrument.controller is None:
+        instrument.controller = controller(
+            conn=instrument.conn,
             DC_V=5.0,
             Start_V=-5.0,
             Stop_V=5.0,
@@ -134,8 +288,114 @@ def get_controller():
             Pulse_Width=1.0,
             Meas_Interval=0.15
         )
+    return instrument
 
-    return gpib_connections[session_id]
+def release_session_instrument():
+    """Stop the session from using its instrument; the connection stays open for other users."""
+    session_id = session.get('email')
+    if session_id in gpib_connections:
+        instrument = instruments.for_controller(gpib_connections[session_id])
+        if instrument is not None:
+            instruments.release(instrument.key, session_id)
+        del gpib_connections[session_id]  # Remove the controller instance from the dictionary
+
+# Form actions that only queue a job; the job takes the instrument when it starts
+QUEUED_ACTIONS = ("start_measurement", "start_pulse_sweep")
+
+def instrument_lease(ctrl):
+    """Hold the controller's instrument for the rest of a request; raises InstrumentBusy while a job has it."""
+    return instruments.for_controller(ctrl).lease(session.get('email'), timeout=REQUEST_WAIT)
+
+def job_holder(job):
+    """Label of a job holding an instrument, for the status pages."""
+    return f"job #{job.id} of {job.owner}"
+
+@app.context_processor
+def inject_storage_formats():
+    """Inject the result file formats that can be written on this machine"""
+    return {'storage_formats': available_stores()}
+
+@app.context_processor
+def inject_active_job():
+    """Inject the most recent background job of the session into all templates"""
+    return {'active_job_id': session.get('job_id')}
+
+def submit_sweep(ctrl, test_type, sweep, settings=None):
+    """Queue a sweep on the instrument's worker and record the result when it finishes.
+    The given (planned) settings are sent first, so the sweep runs what was checked."""
+    user = current_user()
+    user_id = user[0]
+    instrument = instruments.for_controller(ctrl)
+
+    def run(job):
+        with instrument.lease(job_holder(job), job=job):
+            if settings:
+                ctrl.apply_settings(settings)
+            csv_file_name = sweep(job)
+        if job.cancelled():
+            return None
+        if not csv_file_name:
+            raise Exception("Measurement failed. No data received.")
+        csv_file_path = os.path.join(data_folder(), csv_file_name)
+        measurement_id = add_measurement(
+            user_id=user_id,
+            test_type=test_type,
+            csv_file_path=csv_file_path,
+            instrument=instrument.addr
+        )
+        return {"csv_file_path": csv_file_path, "measurement_id": measurement_id, "instrument": instrument.addr}
+
+    job = jobs.submit(instrument.key, session['email'], test_type, run)
+    session['job_id'] = job.id
+    return job
+
+def submit_recipe(ctrl, recipe, steps):
+    """Queue a whole recipe as one job on the instrument's worker; every run becomes a measurement."""
+    user_id = current_user()[0]
+    instrument = instruments.for_controller(ctrl)
+    transfer = session["settings"].get("Transfer", "ascii")
+    storage = session["settings"].get("Storage", "csv")
+    test_type = f"Recipe {recipe[2]}"
+
+    def record(step, repeat, csv_file_name):
+        csv_file_path = os.path.join(data_folder(), csv_file_name)
+        return add_measurement(user_id=user_id, test_type=test_type, csv_file_path=csv_file_path, instrument=instrument.addr)
+
+    def run(job):
+        hold = lambda: instrument.lease(job_holder(job), job=job)
+        measurement_ids = recipes.run_recipe(ctrl, job, steps, record, transfer, storage, hold)
+        return {
+            "recipe_id": recipe[0],
+            "measurement_ids": measurement_ids,
+            "measurement_id": measurement_ids[-1] if measurement_ids else None,
+        }
+
+    job = jobs.submit(instrument.key, session['email'], test_type, run)
+    session['job_id'] = job.id
+    return job
+
+def sweep_plan(ctrl, sweep_type, settings=None):
+    """Plan a sweep from the session settings (or the given ones) for the controller's instrument."""
+    return plan_sweep(settings if settings is not None else session["settings"], sweep_type, ctrl.measurement_speed(), ctrl.double_sweep())
+
+def plan_allows(plan):
+    """Flash the plan's problems; True if the sweep may be sent to the instrument."""
+    for error in plan.errors:
+        flash(error, "error")
+    for warning in plan.warnings:
+        flash(warning, "warning")
+    return plan.ok
+
+def selected_storage():
+    """Return the storage format picked on the form (or the last one used) and remember it."""
+    storage = request.form.get("Storage") or session["settings"].get("Storage", "csv")
+    if storage not in available_stores():
+        if storage == "parquet":
+            flash("Parquet needs pandas and pyarrow, which are not installed. Saving as CSV instead.", "warning")
+        storage = "csv"
+    session["settings"]["Storage"] = storage
+    session.modified = True
+    return storage
 
 def initialize_settings():
     """Initialize session settings with default values if not already set."""
@@ -151,7 +411,9 @@ def initialize_settings():
             "Meas": 0.0,
             "Nofread": 10.0,
             "Pulse_Width": 1.0,
-            "Meas_Interval": 0.15
+            "Meas_Interval": 0.15,
+            "Transfer": "ascii",
+            "Storage": "csv"
         }
 
 def check_connection_status():
@@ -160,29 +422,30 @@ def check_connection_status():
         return "failure", ["User not logged in."]
     
     session_id = session.get('email')
+    if connection_pending():
+        return "pending", ["Connecting to device..."]
     if session_id not in gpib_connections:
         return "failure", ["No GPIB connection found for current session."]
 
-    ctrl = gpib_connections[session_id]
-    if hasattr(ctrl, 'conn') and hasattr(ctrl.conn, 'check_connection'):
-        connected = ctrl.conn.check_connection()
-        if connected:
-            return "success", ["Connection to device established."]
+    health = connection_health()
+    if health is not None:
+        if health["connected"]:
+            return "success", ["Connection to device established."] + describe_health(health)[1:]
         else:
-            return "failure", ["Failed to connect to device."]
+            return "failure", ["Failed to connect to device."] + describe_health(health)[1:]
     return "failure", ["Controller or connection is invalid."]
 
 def add_user(first_name, last_name, email, password):
     """Add a new user to the database."""
+    import bcrypt
     hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())  # Hash and salt the password
-    conn = sqlite3.connect(DB_path)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
         INSERT INTO users (first_name, last_name, email, password)
         VALUES (?, ?, ?, ?)
     ''', (first_name, last_name, email, hashed_password))
     conn.commit()
-    conn.close()
 
 # GENERAL PAGES ###############################################################################################################################################
 
@@ -211,156 +474,154 @@ def configuration():
         ctrl = get_controller()
 
         if request.method == "POST":
+            # Keep the whole request together on the bus when others share the instrument;
+            # starting a sweep only queues a job, so it does not need the instrument yet
             action = request.form.get("action")
-            match action:
-                case "start_measurement":
-                    # Start the measurement using the sweep_measure function
-                    csv_file_path = ctrl.sweep_measure()
-                    if csv_file_path:
-                        # Add the measurement to the database
-                        user = get_user_by_email(session['email'])
-                        measurement_id = add_measurement(
-                            user_id=user[0], 
-                            test_type="C-V Measurement",
-                            csv_file_path=csv_file_path
-                        )
-                        flash("Measurement started successfully! Data saved to CSV.", "success")
-                    else:
-                        flash("Measurement failed. No data received.", "error")
-                case "set_mode":
-                    mode = request.form.get("mode")
-                    match mode:
-                        case "ct":
-                            ctrl.set_ctfunc()
-                            flash("Machine set to C-T mode successfully!", "success")
-                        case "cgt":
-                            ctrl.set_cgtfunc()
-                            flash("Machine set to C-G-T mode successfully!", "success")
-                        case _:
-                            flash("Invalid mode selected.", "error")
-                case "set_connection_mode":
-                    connection_mode = request.form.get("connection_mode")
-                    match connection_mode:
-                        case "float":
-                            ctrl.set_float()
-                            flash("Connection set to Float mode successfully!", "success")
-                        case "ground":
-                            ctrl.set_ground()
-                            flash("Connection set to Ground mode successfully!", "success")
-                        case _:
-                            flash("Invalid connection mode selected.", "error")
-                case "set_cable_length":
-                    cable_length = request.form.get("cable_length")
-                    match cable_length:
-                        case "1":
-                            ctrl.set_cable_1()
-                            flash("Cable length set to 0 meters successfully!", "success")
-                        case "2":
-                            ctrl.set_cable_2()
-                            flash("Cable length set to 1 meter successfully!", "success")
-                        case _:
-                            flash("Invalid cable length selected.", "error")
-                case "set_function":
-                    function = request.form.get("function")
-                    match function:
-                        case "cg":
-                            ctrl.set_cg()
-                            flash("Function set to C-G successfully!", "success")
-                        case "c":
-                            ctrl.set_c()
-                            flash("Function set to C successfully!", "success")
-                        case "g":
-                            ctrl.set_g()
-                            flash("Function set to G successfully!", "success")
-                        case "cgt":
-                            ctrl.set_cgtfunc()
-                            flash("Function set to C-G-T successfully!", "success")
-                        case "ct":
-                            ctrl.set_ctfunc()
-                            flash("Function set to C-T successfully!", "success")
-                        case "gt":
-                            ctrl.set_gtfunc()
-                            flash("Function set to G-T successfully!", "success")
-                        case _:
-                            flash("Invalid function selected.", "error")
-                case "set_meas_speed":
-                    meas_speed = request.form.get("meas_speed")
-                    match meas_speed:
-                        case "fast":
-                            ctrl.set_fast()
-                            flash("Measurement speed set to Fast successfully!", "success")
-                        case "medium":
-                            ctrl.set_medium()
-                            flash("Measurement speed set to Medium successfully!", "success")
-                        case "slow":
-                            ctrl.set_slow()
-                            flash("Measurement speed set to Slow successfully!", "success")
-                        case _:
-                            flash("Invalid measurement speed selected.", "error")
-                case "set_meas_range":
-                    meas_range = request.form.get("meas_range")
-                    match meas_range:
-                        case "auto":
-                            ctrl.set_auto()
-                            flash("Measurement range set to Auto successfully!", "success")
-                        case "manual1":
-                            ctrl.set_10nf()
-                            flash("Measurement range set to 10nF/10mS successfully!", "success")
-                        case "manual2":
-                            ctrl.set_100pf()
-                            flash("Measurement range set to 100pF/1mS successfully!", "success")
-                        case "manual3":
-                            ctrl.set_10pf()
-                            flash("Measurement range set to 1pF/100uS successfully!", "success")
-                        case _:
-                            flash("Invalid measurement range selected.", "error")
-                case "set_sweep":
-                    sweep_mode = request.form.get("sweep_mode")
-                    match sweep_mode:
-                        case "int":
-                            ctrl.set_int()
-                            flash("Sweep mode set to Repeat successfully!", "success")
-                        case "ext":
-                            ctrl.set_ext()
-                            flash("Sweep mode set to External successfully!", "success")
-                        case "hold":
-                            ctrl.set_hold()
-                            flash("Sweep mode set to Single successfully!", "success")
-                        case _:
-                            flash("Invalid sweep mode selected.", "error")
-                case "set_bias_mode":
-                    bias_mode = request.form.get("bias_mode")
-                    match bias_mode:
-                        case "dc":
-                            #ctrl.set_DCV()
-                            flash("Bias mode set to DC successfully!", "success")
-                        case "single":
-                            ctrl.single_config()
-                            flash("Bias mode set to Single successfully!", "success")
-                        case "double":
-                            ctrl.set_double()
-                            flash("Bias mode set to Double successfully!", "success") 
-                        case _:
-                            flash("Invalid bias mode selected.", "error")
-                case "set_sig_level":
-                    sig_level = request.form.get("sig_level")
-                    match sig_level:
-                        case "30":
-                            ctrl.set_signal_30()
-                            flash("Signal level set to 30V successfully!", "success")
-                        case "10":
-                            ctrl.set_signal_10()
-                            flash("Signal level set to 10V successfully!", "success")
-                        case _:
-                            flash("Invalid signal level selected.", "error")
-                case _:
-                    flash("Invalid action selected.", "error")
+            with nullcontext() if action in QUEUED_ACTIONS else instrument_lease(ctrl):
+                match action:
+                    case "start_measurement":
+                        # Run the sweep_measure function in the background
+                        transfer = session["settings"].get("Transfer", "ascii")
+                        storage = session["settings"].get("Storage", "csv")
+                        job = submit_sweep(ctrl, "C-V Measurement", lambda job: ctrl.sweep_measure(job, transfer, storage))
+                        flash(f"Measurement started as job #{job.id}. Data will be saved to CSV when it finishes.", "success")
+                    case "set_mode":
+                        mode = request.form.get("mode")
+                        match mode:
+                            case "ct":
+                                ctrl.set_ctfunc()
+                                flash("Machine set to C-T mode successfully!", "success")
+                            case "cgt":
+                                ctrl.set_cgtfunc()
+                                flash("Machine set to C-G-T mode successfully!", "success")
+                            case _:
+                                flash("Invalid mode selected.", "error")
+                    case "set_connection_mode":
+                        connection_mode = request.form.get("connection_mode")
+                        match connection_mode:
+                            case "float":
+                                ctrl.set_float()
+                                flash("Connection set to Float mode successfully!", "success")
+                            case "ground":
+                                ctrl.set_ground()
+                                flash("Connection set to Ground mode successfully!", "success")
+                            case _:
+                                flash("Invalid connection mode selected.", "error")
+                    case "set_cable_length":
+                        cable_length = request.form.get("cable_length")
+                        match cable_length:
+                            case "1":
+                                ctrl.set_cable_1()
+                                flash("Cable length set to 0 meters successfully!", "success")
+                            case "2":
+                                ctrl.set_cable_2()
+                                flash("Cable length set to 1 meter successfully!", "success")
+                            case _:
+                                flash("Invalid cable length selected.", "error")
+                    case "set_function":
+                        function = request.form.get("function")
+                        match function:
+                            case "cg":
+                                ctrl.set_cg()
+                                flash("Function set to C-G successfully!", "success")
+                            case "c":
+                                ctrl.set_c()
+                                flash("Function set to C successfully!", "success")
+                            case "g":
+                                ctrl.set_g()
+                                flash("Function set to G successfully!", "success")
+                            case "cgt":
+                                ctrl.set_cgtfunc()
+                                flash("Function set to C-G-T successfully!", "success")
+                            case "ct":
+                                ctrl.set_ctfunc()
+                                flash("Function set to C-T successfully!", "success")
+                            case "gt":
+                                ctrl.set_gtfunc()
+                                flash("Function set to G-T successfully!", "success")
+                            case _:
+                                flash("Invalid function selected.", "error")
+                    case "set_meas_speed":
+                        meas_speed = request.form.get("meas_speed")
+                        match meas_speed:
+                            case "fast":
+                                ctrl.set_fast()
+                                flash("Measurement speed set to Fast successfully!", "success")
+                            case "medium":
+                                ctrl.set_medium()
+                                flash("Measurement speed set to Medium successfully!", "success")
+                            case "slow":
+                                ctrl.set_slow()
+                                flash("Measurement speed set to Slow successfully!", "success")
+                            case _:
+                                flash("Invalid measurement speed selected.", "error")
+                    case "set_meas_range":
+                        meas_range = request.form.get("meas_range")
+                        match meas_range:
+                            case "auto":
+                                ctrl.set_auto()
+                                flash("Measurement range set to Auto successfully!", "success")
+                            case "manual1":
+                                ctrl.set_10nf()
+                                flash("Measurement range set to 10nF/10mS successfully!", "success")
+                            case "manual2":
+                                ctrl.set_100pf()
+                                flash("Measurement range set to 100pF/1mS successfully!", "success")
+                            case "manual3":
+                                ctrl.set_10pf()
+                                flash("Measurement range set to 1pF/100uS successfully!", "success")
+                            case _:
+                                flash("Invalid measurement range selected.", "error")
+                    case "set_sweep":
+                        sweep_mode = request.form.get("sweep_mode")
+                        match sweep_mode:
+                            case "int":
+                                ctrl.set_int()
+                                flash("Sweep mode set to Repeat successfully!", "success")
+                            case "ext":
+                                ctrl.set_ext()
+                                flash("Sweep mode set to External successfully!", "success")
+                            case "hold":
+                                ctrl.set_hold()
+                                flash("Sweep mode set to Single successfully!", "success")
+                            case _:
+                                flash("Invalid sweep mode selected.", "error")
+                    case "set_bias_mode":
+                        bias_mode = request.form.get("bias_mode")
+                        match bias_mode:
+                            case "dc":
+                                #ctrl.set_DCV()
+                                flash("Bias mode set to DC successfully!", "success")
+                            case "single":
+                                ctrl.single_config()
+                                flash("Bias mode set to Single successfully!", "success")
+                            case "double":
+                                ctrl.set_double()
+                                flash("Bias mode set to Double successfully!", "success") 
+                            case _:
+                                flash("Invalid bias mode selected.", "error")
+                    case "set_sig_level":
+                        sig_level = request.form.get("sig_level")
+                        match sig_level:
+                            case "30":
+                                ctrl.set_signal_30()
+                                flash("Signal level set to 30V successfully!", "success")
+                            case "10":
+                                ctrl.set_signal_10()
+                                flash("Signal level set to 10V successfully!", "success")
+                            case _:
+                                flash("Invalid signal level selected.", "error")
+                    case _:
+                        flash("Invalid action selected.", "error")
         
         # Default to cgt mode if no mode is set
         if "mode" not in session:
             session["mode"] = "cgt"
 
         return render_template("configuration.html", connection_type="Real Connection", settings=session["settings"])
+    except InstrumentBusy as e:
+        flash(str(e), "warning")
+        return redirect(url_for("configuration"))
     except Exception as e:
         flash(f"Error: {str(e)}", "error")
         return redirect(url_for("home"))
@@ -380,91 +641,83 @@ def parameter():
         ctrl = get_controller()
 
         if request.method == "POST":
+            # Keep the whole request together on the bus when others share the instrument;
+            # starting a sweep only queues a job, so it does not need the instrument yet
             action = request.form.get("action")
-            match action:
-                case "update_settings":
-                    sweep_type = request.form.get("sweep_type", "")
-                    if sweep_type == "voltage":
-                        session["settings"].update({
-                            "DC_V": float(request.form['DC_V']),
-                            "Start_V": float(request.form['Start_V']),
-                            "Stop_V": float(request.form['Stop_V']),
-                            "Step_V": float(request.form['Step_V']),
-                            "Hold_T": float(request.form['Hold_T']),
-                            "Step_T": float(request.form['Step_T']),
-                        })
-                        ctrl.set_DCV(session["settings"]["DC_V"])
-                        ctrl.set_StartV(session["settings"]["Start_V"])
-                        ctrl.set_StopV(session["settings"]["Stop_V"])
-                        ctrl.set_StepV(session["settings"]["Step_V"])
-                        ctrl.set_Hold_Time(session["settings"]["Hold_T"])
-                        ctrl.set_StepT(session["settings"]["Step_T"])
-                        flash("Voltage settings updated successfully!", "success")
-
-                    elif sweep_type == "time":
-                        session["settings"].update({
-                            "Pulse": float(request.form['Pulse']),
-                            "Meas": float(request.form['Meas']),
-                            "Nofread": float(request.form['Nofread']),
-                            "Pulse_Width": float(request.form['Pulse_Width']),
-                            "Meas_Interval": float(request.form['Meas_Interval']),
-                        })
-                        ctrl.set_Pulse(session["settings"]["Pulse"])
-                        ctrl.set_Measure_pulse(session["settings"]["Meas"])
-                        ctrl.set_NOFREAD(session["settings"]["Nofread"])
-                        ctrl.set_th(session["settings"]["Pulse_Width"])
-                        ctrl.set_td(session["settings"]["Meas_Interval"])
-                        flash("Time settings updated successfully!", "success")
-
-                    else:
-                        flash("Invalid sweep type provided for settings update.", "danger")
-
-                case "start_pulse_sweep":
-                    csv_file_name = ctrl.pulse_sweep()
-                    if csv_file_name:
-                        csv_file_path = os.path.join(os.environ['USERPROFILE'], 'Documents', 'HPData', csv_file_name)
-                        user = get_user_by_email(session['email'])
-                        add_measurement(
-                            user_id=user[0],
-                            test_type="Pulse Measurement",
-                            csv_file_path=csv_file_path
-                        )
-                        flash("Pulse Sweep Measurement completed! Data saved to CSV and database.", "success")
-                    else:
-                        flash("Pulse Sweep Measurement failed. No data received.", "error")
-
-                case "start_measurement":
-                    measurement_type = request.form.get("sweep_type") or "voltage"
-                    print(f"Measurement type selected: {measurement_type}")
-
-                    csv_file_name = None
-                    if measurement_type == "voltage":
-                        print(f"Executing C-V measurement...")
-                        csv_file_name = ctrl.sweep_measure()  # Assuming this is for C-V
-                    elif measurement_type == "time":
-                        print(f"Executing C-T measurement...")
-                        csv_file_name = ctrl.sweep_measure()  # Assuming this is for C-T
-
-
-                    if csv_file_name:
-                        csv_file_path = os.path.join(os.environ['USERPROFILE'], 'Documents', 'HPData', csv_file_name)
-                        user = get_user_by_email(session['email'])
-                        add_measurement(
-                            user_id=user[0],
-                            test_type=measurement_type.upper() + " Measurement",
-                            csv_file_path=csv_file_path
-                        )
-                        flash("Measurement completed successfully! Data saved to CSV and database.", "success")
-                    else:
-                        flash("Measurement failed. No data received.", "error")
-
-                case _:
-                    flash("Unknown action.", "error")
+            with nullcontext() if action in QUEUED_ACTIONS else instrument_lease(ctrl):
+                match action:
+                    case "update_settings":
+                        sweep_type = request.form.get("sweep_type", "")
+                        if sweep_type == "voltage":
+                            # Check and round the values before anything is sent
+                            plan = sweep_plan(ctrl, "voltage", request.form)
+                            if plan_allows(plan):
+                                session["settings"].update(plan.settings)
+                                with ctrl.batched():
+                                    ctrl.set_DCV(session["settings"]["DC_V"])
+                                    ctrl.set_StartV(session["settings"]["Start_V"])
+                                    ctrl.set_StopV(session["settings"]["Stop_V"])
+                                    ctrl.set_StepV(session["settings"]["Step_V"])
+                                    ctrl.set_Hold_Time(session["settings"]["Hold_T"])
+                                    ctrl.set_StepT(session["settings"]["Step_T"])
+                                flash("Voltage settings updated successfully!", "success")
+
+                        elif sweep_type == "time":
+                            plan = sweep_plan(ctrl, "time", request.form)
+                            if plan_allows(plan):
+                                session["settings"].update(plan.settings)
+                                with ctrl.batched():
+                                    ctrl.set_Pulse(session["settings"]["Pulse"])
+                                    ctrl.set_Measure_pulse(session["settings"]["Meas"])
+                                    ctrl.set_NOFREAD(session["settings"]["Nofread"])
+                                    ctrl.set_th(session["settings"]["Pulse_Width"])
+                                    ctrl.set_td(session["settings"]["Meas_Interval"])
+                                flash("Time settings updated successfully!", "success")
+
+                        else:
+                            flash("Invalid sweep type provided for settings update.", "danger")
+
+                    case "start_pulse_sweep":
+                        storage = selected_storage()
+                        plan = sweep_plan(ctrl, "pulse")
+                        if plan_allows(plan):
+                            job = submit_sweep(ctrl, "Pulse Measurement", lambda job: ctrl.pulse_sweep(job, storage), plan.settings)
+                            flash(f"Pulse Sweep Measurement started as job #{job.id}. Data will be saved to CSV and database when it finishes.", "success")
+
+                    case "start_measurement":
+                        measurement_type = request.form.get("sweep_type") or "voltage"
+                        print(f"Measurement type selected: {measurement_type}")
+
+                        # Block transfer mode chosen for this sweep
+                        transfer = request.form.get("Transfer") or session["settings"].get("Transfer", "ascii")
+                        if transfer not in ctrl.TRANSFER_MODES:
+                            transfer = "ascii"
+                        session["settings"]["Transfer"] = transfer
+                        session.modified = True
+                        storage = selected_storage()
+
+                        plan = sweep_plan(ctrl, measurement_type) if measurement_type in ("voltage", "time") else None
+                        if plan is not None and not plan_allows(plan):
+                            flash("Measurement not started.", "error")
+                        elif plan is not None:
+                            # Both C-V and C-T use sweep_measure
+                            job = submit_sweep(ctrl, measurement_type.upper() + " Measurement", lambda job: ctrl.sweep_measure(job, transfer, storage), plan.settings)
+                            flash(f"Measurement started as job #{job.id}. Data will be saved to CSV and database when it finishes.", "success")
+                        else:
+                            flash("Measurement failed. Unknown measurement type.", "error")
+
+                    case _:
+                        flash("Unknown action.", "error")
 
                     
         connection_status, terminal_output = check_connection_status()
-        return render_template("parameter.html", connection_status=connection_status, terminal_output=terminal_output, settings=session["settings"])
+        plans = {sweep_type: sweep_plan(ctrl, sweep_type).to_dict() for sweep_type in ("voltage", "time", "pulse")}
+        return render_template("parameter.html", connection_status=connection_status, terminal_output=terminal_output,
+                               settings=session["settings"], plans=plans)
 
+    except InstrumentBusy as e:
+        flash(str(e), "warning")
+        return redirect(url_for("parameter"))
     except Exception as e:
         flash(f"Error: {str(e)}", "error")
         return redirect(url_for("home"))
@@ -480,7 +733,8 @@ def graph():
     graph_settings = {
         "csv_file_name": "example.csv",  # Replace with a default or example file name
         "csv_file_path": "",  # No file path available when accessed directly
-        "measurement": None  # No measurement data available
+        "measurement": None,  # No measurement data available
+        "job_id": request.args.get("job", type=int)  # Running job to plot live, if any
     }
 
     return render_template("graph.html", graph_settings=graph_settings)
@@ -499,9 +753,20 @@ def wizardgraph():
         return redirect(url_for('history'))
 
     # Pass the file path to the template
-    graph_settings = {'csv_file_path': csv_file_path}
+    graph_settings = {'csv_file_path': csv_file_path, 'csv_file_name': os.path.basename(csv_file_path)}
     return render_template('wizardgraph.html', graph_settings=graph_settings)
 
+def history_filters():
+    """Read the paging and filter query parameters shared by the history pages."""
+    return {
+        "test_type": request.args.get("test_type") or None,
+        "instrument": request.args.get("instrument") or None,
+        "date_from": request.args.get("date_from") or None,
+        "date_to": request.args.get("date_to") or None,
+        "before": parse_page_cursor(request.args.get("before")),
+        "limit": min(max(request.args.get("limit", 50, type=int), 1), 500),
+    }
+
 @app.route('/history', methods=["GET"])
 def history():
     # Check if the user is logged in
@@ -510,15 +775,48 @@ def history():
         return redirect(url_for("login"))
 
     # Get the user information
-    user = get_user_by_email(session['email'])
+    user = current_user()
     if not user:
         flash("User not found. Please log in again.", "error")
         return redirect(url_for("login"))
 
-    # Fetch measurements for the logged-in user
-    measurements = get_measurements(user_id=user[0])  # user[0] is the user ID
+    # Fetch one page of measurements for the logged-in user
+    filters = history_filters()
+    measurements, next_cursor = get_measurements_page(user_id=user[0], **filters)  # user[0] is the user ID
 
-    return render_template("history.html", measurements=measurements)
+    return render_template("history.html", measurements=measurements, next_cursor=next_cursor,
+                           filters=request.args, test_types=get_test_types(user[0]), instruments=get_instruments(user[0]))
+
+def measurement_file(measurement_id):
+    """Measurement row and the absolute path of its data file, or (None, None)."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT measurement_id, date_recorded, time_recorded, user_id, test_type, csv_file_path
+        FROM measurements WHERE measurement_id = ?
+    ''', (measurement_id,))
+    measurement = cursor.fetchone()
+    if not measurement:
+        return None, None
+
+    csv_file_path = measurement[5]
+    if not os.path.isabs(csv_file_path):
+        # Convert relative path to absolute path in the HPData folder
+        csv_file_path = os.path.join(data_folder(), csv_file_path)
+    return measurement, csv_file_path
+
+def measurement_for_path(path, filename):
+    """The measurement saved as the given file of the data folder (old rows keep only its name), or None."""
+    cursor = get_db().cursor()
+    cursor.execute('''
+        SELECT measurement_id, date_recorded, time_recorded, user_id, test_type, csv_file_path
+        FROM measurements WHERE csv_file_path IN (?, ?)
+    ''', (path, filename))
+    return cursor.fetchone()
+
+def may_open(measurement, user):
+    """Users may open their own measurements; admins may open everyone's."""
+    return measurement is not None and user is not None and (measurement[3] == user[0] or user[5] != 0)
 
 @app.route('/view_measurement/<int:measurement_id>', methods=["GET"])
 def view_measurement(measurement_id):
@@ -528,25 +826,13 @@ def view_measurement(measurement_id):
         return redirect(url_for("login"))
 
     # Fetch the measurement data by ID
-    conn = sqlite3.connect(DB_path)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT measurement_id, date_recorded, time_recorded, user_id, test_type, csv_file_path
-        FROM measurements WHERE measurement_id = ?
-    ''', (measurement_id,))
-    measurement = cursor.fetchone()
-    conn.close()
+    measurement, csv_file_path = measurement_file(measurement_id)
 
-    if not measurement:
+    if not may_open(measurement, current_user()):
         flash("Measurement not found.", "error")
         return redirect(url_for("history"))
 
     # Verify that the CSV file exists in the HPData folder
-    csv_file_path = measurement[5]
-    if not os.path.isabs(csv_file_path):
-        # Convert relative path to absolute path in the HPData folder
-        csv_file_path = os.path.join(os.environ['USERPROFILE'], 'Documents', 'HPData', csv_file_path)
-
     if not os.path.isfile(csv_file_path):
         flash("CSV file not found or is not a valid file.", "error")
         return redirect(url_for("history"))
@@ -564,6 +850,18 @@ def view_measurement(measurement_id):
         }
     )
 
+@app.route('/analysis/<int:measurement_id>', methods=["GET"])
+def measurement_analysis(measurement_id):
+    """Flat-band, threshold and hysteresis (C-V) or decay fit (C-t) of a saved measurement as JSON."""
+    if 'email' not in session:
+        return jsonify({"error": "Not logged in."}), 401
+    measurement, path = measurement_file(measurement_id)
+    if not may_open(measurement, current_user()):
+        return jsonify({"error": "Measurement not found."}), 404
+    if not os.path.isfile(path):
+        return jsonify({"error": "Data file not found."}), 404
+    return jsonify(dict(analyze_file(path), measurement_id=measurement_id))
+
 @app.route('/delete_measurement/<int:measurement_id>', methods=["POST"])
 def delete_measurement(measurement_id):
     # Check if the user is logged in
@@ -572,7 +870,7 @@ def delete_measurement(measurement_id):
         return redirect(url_for("login"))
 
     # Fetch the measurement data to get the file path
-    conn = sqlite3.connect(DB_path)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
         SELECT csv_file_path FROM measurements WHERE measurement_id = ?
@@ -598,7 +896,6 @@ def delete_measurement(measurement_id):
     else:
         flash("Measurement not found.", "error")
 
-    conn.close()
     return redirect(url_for("history"))
 
 @app.route('/admin_measure', methods=["GET"])
@@ -610,7 +907,7 @@ def admin_measure():
         return redirect(url_for("login"))
 
     # Get the user information
-    user = get_user_by_email(session['email'])
+    user = current_user()
     if not user:
         flash("User not found. Please log in again.", "error")
         return redirect(url_for("login"))
@@ -620,19 +917,204 @@ def admin_measure():
         flash("You do not have permission to access this page.", "error")
         return redirect(url_for("home"))
 
-    # Fetch all measurements from the database
-    conn = sqlite3.connect(DB_path)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT m.measurement_id, m.date_recorded, m.time_recorded, u.first_name || ' ' || u.last_name AS full_name, m.test_type
-        FROM measurements m
-        JOIN users u ON m.user_id = u.id
-        ORDER BY m.date_recorded DESC, m.time_recorded DESC
-    ''')
-    measurements = cursor.fetchall()
-    conn.close()
+    # Fetch one page of all measurements from the database
+    filters = history_filters()
+    measurements, next_cursor = get_measurements_page(**filters)
+
+    return render_template("admin_measure.html", measurements=measurements, next_cursor=next_cursor,
+                           filters=request.args, test_types=get_test_types(), instruments=get_instruments())
+
+@app.route('/admin_metrics', methods=["GET"])
+def admin_metrics():
+    """Admin page with the timing of instrument I/O and of recent sweeps."""
+    # Check if the user is logged in
+    if 'email' not in session:
+        flash("Please log in to access this page.", "error")
+        return redirect(url_for("login"))
+
+    # Get the user information
+    user = current_user()
+    if not user:
+        flash("User not found. Please log in again.", "error")
+        return redirect(url_for("login"))
+
+    # Ensure the user is an admin
+    if user[5] == 0:  # Check the `is_admin` value
+        flash("You do not have permission to access this page.", "error")
+        return redirect(url_for("home"))
+
+    return render_template("admin_metrics.html", summary=tracer.summary(), commands=tracer.command_summary(),
+                           sweeps=tracer.recent_sweeps(), calls=tracer.recent_calls())
+
+# Prometheus scrapers on this computer need no login; requests from elsewhere must come from an admin
+LOCAL_ADDRESSES = ("127.0.0.1", "::1")
+
+@app.route('/metrics', methods=["GET"])
+def metrics():
+    """Instrument I/O and sweep totals in the Prometheus text format."""
+    if request.remote_addr not in LOCAL_ADDRESSES:
+        user = current_user()
+        if not user or user[5] == 0:
+            return Response("Not allowed.\n", status=403, mimetype="text/plain")
+    return Response(tracer.prometheus(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/instruments', methods=["GET", "POST"])
+def instruments_page():
+    """Pick the session's instrument and start sweeps on several instruments at once."""
+    # Check if the user is logged in
+    if 'email' not in session:
+        flash("Please log in to access this page.", "error")
+        return redirect(url_for("login"))
+
+    initialize_settings()
+    user = current_user()
+    if not user:
+        flash("User not found. Please log in again.", "error")
+        return redirect(url_for("login"))
+
+    simulated = uses_simulator(user)
+    addresses = available_instruments(user)
+
+    if request.method == "POST":
+        # The row buttons send the address to select, the form button an action
+        action = "select" if "select" in request.form else request.form.get("action")
+        match action:
+            case "select":
+                addr = request.form.get("select")
+                if addr not in addresses:
+                    flash("Unknown instrument selected.", "error")
+                else:
+                    try:
+                        instrument = open_instrument(addr, simulated)
+                        release_session_instrument()
+                        session['instrument'] = addr
+                        instrument.users.add(session['email'])
+                        gpib_connections[session['email']] = instrument.controller
+                        flash(f"Now working with {addr}.", "success")
+                    except Exception as e:
+                        flash(f"Error: {str(e)}", "error")
+            case "start_sweeps":
+                # Every instrument has its own job worker, so these sweeps run in parallel
+                selected = [addr for addr in request.form.getlist("instruments") if addr in addresses]
+                sweep_type = request.form.get("sweep_type", "voltage")
+                transfer = session["settings"].get("Transfer", "ascii")
+                storage = selected_storage()
+                started = []
+                for addr in selected:
+                    try:
+                        ctrl = open_instrument(addr, simulated).controller
+                    except Exception as e:
+                        flash(f"Error: {str(e)}", "error")
+                        continue
+                    # Every instrument is set to the checked settings before its sweep starts
+                    plan = sweep_plan(ctrl, "pulse" if sweep_type == "pulse" else "voltage")
+                    if not plan_allows(plan):
+                        continue
+                    if sweep_type == "pulse":
+                        job = submit_sweep(ctrl, "Pulse Measurement", lambda job, ctrl=ctrl: ctrl.pulse_sweep(job, storage), plan.settings)
+                    else:
+                        job = submit_sweep(ctrl, "C-V Measurement", lambda job, ctrl=ctrl: ctrl.sweep_measure(job, transfer, storage), plan.settings)
+                    started.append(f"#{job.id} on {addr}")
+                if started:
+                    flash(f"Started jobs {', '.join(started)}.", "success")
+                elif not selected:
+                    flash("No instruments selected.", "error")
+            case _:
+                flash("Unknown action.", "error")
+        return redirect(url_for("instruments_page"))
+
+    stations = []
+    for addr in addresses:
+        instrument = instruments.find(addr, simulated)
+        monitor = health_monitors.get(instrument.key) if instrument is not None else None
+        stations.append({
+            "address": addr,
+            "status": instrument.status() if instrument is not None else None,
+            "health": monitor.snapshot() if monitor is not None else None,
+            "busy": instrument is not None and jobs.busy(instrument.key),
+        })
+    current = session_instrument()
+    return render_template("instruments.html", stations=stations, current=current.addr if current else None,
+                           settings=session["settings"])
+
+@app.route('/recipes', methods=["GET", "POST"])
+def recipes_page():
+    """Build recipes (lists of sweeps) and run them unattended."""
+    # Check if the user is logged in
+    if 'email' not in session:
+        flash("Please log in to access this page.", "error")
+        return redirect(url_for("login"))
 
-    return render_template("admin_measure.html", measurements=measurements)
+    initialize_settings()
+    user = current_user()
+    if not user:
+        flash("User not found. Please log in again.", "error")
+        return redirect(url_for("login"))
+
+    if request.method == "POST":
+        action = request.form.get("action")
+        recipe_id = request.form.get("recipe_id", type=int)
+        recipe = get_recipe(recipe_id) if recipe_id is not None else None
+        if action != "create" and (recipe is None or recipe[1] != user[0]):
+            flash("Recipe not found.", "error")
+            return redirect(url_for("recipes_page"))
+
+        match action:
+            case "create":
+                name = request.form.get("name", "").strip()
+                if name:
+                    add_recipe(user[0], name)
+                    flash(f"Recipe {name} created.", "success")
+                else:
+                    flash("Please enter a recipe name.", "error")
+            case "add_step":
+                function = request.form.get("function")
+                bias = request.form.get("bias", "single")
+                meas_range = request.form.get("meas_range", "auto")
+                if function not in recipes.FUNCTIONS or bias not in recipes.BIASES or meas_range not in recipes.RANGES:
+                    flash("Invalid step settings.", "error")
+                else:
+                    # Values left empty fall back to the session settings
+                    settings = {name: request.form.get(name) or session["settings"][name] for name in recipes.step_settings_names(function)}
+                    plan = plan_sweep(settings, "time" if function in recipes.TIME_FUNCTIONS else "voltage", double=bias == "double")
+                    if plan_allows(plan):
+                        add_recipe_step(recipe_id, function, bias, meas_range, plan.settings,
+                                        repeat_count=max(1, request.form.get("repeat_count", 1, type=int)),
+                                        delay=max(0.0, request.form.get("delay", 0.0, type=float)))
+                        flash("Step added.", "success")
+            case "delete_step":
+                step_id = request.form.get("step_id", type=int)
+                if any(step["step_id"] == step_id for step in get_recipe_steps(recipe_id)):
+                    delete_recipe_step(step_id)
+                    flash("Step deleted.", "success")
+            case "delete":
+                delete_recipe(recipe_id)
+                flash(f"Recipe {recipe[2]} deleted.", "success")
+            case "run":
+                try:
+                    ctrl = get_controller()
+                    steps = get_recipe_steps(recipe_id)
+                    problems = recipes.check_recipe(steps, ctrl.measurement_speed())
+                    if problems:
+                        for problem in problems:
+                            flash(problem, "error")
+                    else:
+                        job = submit_recipe(ctrl, recipe, steps)
+                        flash(f"Recipe {recipe[2]} started as job #{job.id}. Every run is saved as its own measurement.", "success")
+                except Exception as e:
+                    flash(f"Error: {str(e)}", "error")
+            case _:
+                flash("Unknown action.", "error")
+        return redirect(url_for("recipes_page"))
+
+    user_recipes = []
+    for recipe_id, name in get_recipes(user[0]):
+        steps = get_recipe_steps(recipe_id)
+        for step in steps:
+            step["description"] = recipes.describe_step(step)
+        user_recipes.append({"id": recipe_id, "name": name, "steps": steps})
+    return render_template("recipes.html", recipes=user_recipes, functions=recipes.FUNCTIONS, biases=recipes.BIASES,
+                           ranges=recipes.RANGES, settings=session["settings"])
 
 # USER PAGES ################################################################################################################################################
 @app.route('/documentation', methods=["GET", "POST"])
@@ -643,7 +1125,7 @@ def documentation():
         return redirect(url_for("login"))
 
     # Get the user information
-    user = get_user_by_email(session['email'])
+    user = current_user()
     if not user:
         flash("User not found. Please log in again.", "error")
         return redirect(url_for("login"))
@@ -657,7 +1139,7 @@ def documentation():
         action = request.form.get("action")
         user_id = request.form.get("user_id")
 
-        conn = sqlite3.connect(DB_path)
+        conn = get_db()
         cursor = conn.cursor()
 
         if action == "delete":
@@ -674,20 +1156,20 @@ def documentation():
             flash("Admin access revoked!", "success")
 
         conn.commit()
-        conn.close()
+        invalidate_user_cache()  # Admin rights or accounts of other users changed
 
     # Fetch all users except the demo user
-    conn = sqlite3.connect(DB_path)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("SELECT first_name, last_name, email, id, is_admin FROM users WHERE email != 'demo@hp4280a.com'")
     users = cursor.fetchall()
-    conn.close()
 
     return render_template("documentation.html", users=users, logged_in_email=session['email'])
 
 @app.route('/login', methods=["POST", "GET"])
 def login():
     if request.method == "POST":
+        import bcrypt
         email = request.form.get('email')
         password = request.form.get('password')
         
@@ -705,11 +1187,11 @@ def login():
                 # If the stored password is plain text, hash it and update the database
                 if password == stored_password:  # Plain-text password match
                     hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-                    conn = sqlite3.connect(DB_path)
+                    conn = get_db()
                     cursor = conn.cursor()
                     cursor.execute("UPDATE users SET password = ? WHERE id = ?", (hashed_password, user[0]))
                     conn.commit()
-                    conn.close()
+                    invalidate_user_cache(email)
                     
                     # Log the user in after updating the password
                     session["email"] = email
@@ -718,9 +1200,9 @@ def login():
             
             if logged_in:
                 try:
-                    # Try to get or create controller to establish connection
-                    get_controller()
-                    flash("Login successful! Device connection established.", "success")
+                    # Connect in the background so the home page shows straight away
+                    connect_in_background()
+                    flash("Login successful! Connecting to the device...", "success")
                 except Exception as e:
                     flash(f"Login successful, but device connection failed: {str(e)}", "warning")
                 return redirect(url_for("home"))
@@ -757,12 +1239,8 @@ def register():
 
 @app.route('/logout')
 def logout():
-    session_id = session.get('email')
-    if session_id in gpib_connections:
-        ctrl = gpib_connections[session_id]  # Get the controller instance
-        if hasattr(ctrl, 'conn') and hasattr(ctrl.conn, 'disconnect'):
-            ctrl.conn.disconnect()  # Disconnect the GPIB connection
-        del gpib_connections[session_id]  # Remove the controller instance from the dictionary
+    release_session_instrument()
+    session.pop("instrument", None)
     session.pop("email", None)  # Remove email from session
     flash("You have been logged out.", "success")
     return redirect(url_for("home"))
@@ -780,12 +1258,13 @@ def settings():
         return redirect(url_for("home"))
 
     # Get the current user
-    user = get_user_by_email(session['email'])
+    user = current_user()
     if not user:
         flash("User not found. Please log in again.", "error")
         return redirect(url_for("login"))
 
     if request.method == "POST":
+        import bcrypt
         current_password = request.form.get("current_password")
         new_password = request.form.get("new_password")
         confirm_password = request.form.get("confirm_password")
@@ -802,7 +1281,7 @@ def settings():
             return redirect(url_for("settings"))
 
         # Update the user's email and/or password
-        conn = sqlite3.connect(DB_path)
+        conn = get_db()
         cursor = conn.cursor()
         if new_email:
             cursor.execute("UPDATE users SET email = ? WHERE id = ?", (new_email, user[0]))
@@ -811,7 +1290,8 @@ def settings():
             hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())  # Hash and salt the new password
             cursor.execute("UPDATE users SET password = ? WHERE id = ?", (hashed_password, user[0]))
         conn.commit()
-        conn.close()
+        invalidate_user_cache(user[3])
+        g.pop('user', None)
 
         flash("Settings updated successfully!", "success")
         return redirect(url_for("settings"))
@@ -821,9 +1301,156 @@ def settings():
 # NON PAGES ####################################################################################################################################################
 @app.route('/uploads/<path:filename>')
 def serve_uploads(filename):
-    # Update the path to point to the Documents/HPData folder
-    hp_data_folder = os.path.join(os.environ['USERPROFILE'], 'Documents', 'HPData')
-    return send_from_directory(hp_data_folder, filename)
+    path = safe_join(data_folder(), filename)
+    if 'email' not in session or path is None or not may_open(measurement_for_path(path, filename), current_user()):
+        return "File not found.", 404
+    return send_from_directory(data_folder(), filename)
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    """Bundled front-end file, precompressed when the browser accepts it and cached for a year."""
+    found = find_asset(filename, request.headers.get("Accept-Encoding", ""))
+    if found is None:
+        return "File not found.", 404
+    path, encoding, etag = found
+
+    response = send_file(path, mimetype=mimetypes.guess_type(filename)[0], conditional=False, etag=False, max_age=CACHE_SECONDS)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Vary"] = "Accept-Encoding"
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+@app.route('/jobs', methods=["GET"])
+def list_jobs():
+    if 'email' not in session:
+        return jsonify({"error": "Not logged in."}), 401
+    return jsonify([job.to_dict() for job in jobs.jobs_for(session['email'])])
+
+def get_job_for_session(job_id):
+    """Return the job if the logged in user may see it, otherwise None."""
+    job = jobs.get(job_id)
+    if job is None:
+        return None
+    if job.owner != session['email']:
+        user = current_user()
+        if not user or user[5] == 0:
+            return None
+    return job
+
+@app.route('/jobs/<int:job_id>', methods=["GET"])
+def job_status(job_id):
+    if 'email' not in session:
+        return jsonify({"error": "Not logged in."}), 401
+    job = get_job_for_session(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<int:job_id>/cancel', methods=["POST"])
+def cancel_job(job_id):
+    if 'email' not in session:
+        return jsonify({"error": "Not logged in."}), 401
+    job = get_job_for_session(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    jobs.cancel(job_id)
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<int:job_id>/stream', methods=["GET"])
+def job_stream(job_id):
+    """Server-sent events with the data points of a job as they are read from the instrument."""
+    if 'email' not in session:
+        return jsonify({"error": "Not logged in."}), 401
+    job = get_job_for_session(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+
+    def events():
+        index = 0
+        while True:
+            # Check first so no point published before the job finished is missed
+            finished = job.finished_running()
+            points = job.wait_for_points(index)
+            if points:
+                index += len(points)
+                yield f"data: {json.dumps(points)}\n\n"
+            elif finished:
+                yield f"event: done\ndata: {json.dumps(job.to_dict())}\n\n"
+                return
+            else:
+                yield ": keep-alive\n\n"
+
+    return Response(events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.route('/jobs/<int:job_id>/result', methods=["GET"])
+def job_result(job_id):
+    if 'email' not in session:
+        return jsonify({"error": "Not logged in."}), 401
+    job = get_job_for_session(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    if not job.finished_running():
+        return jsonify({"error": "Job has not finished.", "status": job.status}), 409
+    if job.status != "done":
+        return jsonify({"error": job.error or "Job did not complete.", "status": job.status}), 409
+    return jsonify(job.result)
+
+@app.route('/plan', methods=["GET"])
+def plan():
+    """Sweep plan for the session settings, with any setting overridden by a query parameter."""
+    if 'email' not in session:
+        return jsonify({"error": "Not logged in."}), 401
+    initialize_settings()
+    settings = dict(session["settings"], **request.args.to_dict())
+    ctrl = gpib_connections.get(session['email'])
+    speed = ctrl.measurement_speed() if ctrl is not None else None
+    double = ctrl.double_sweep() if ctrl is not None else False
+    return jsonify(plan_sweep(settings, request.args.get("sweep_type", "voltage"), speed, double).to_dict())
+
+@app.route('/export_csv/<path:filename>')
+def export_csv_file(filename):
+    """Serve one of the user's saved measurement files, in any format, as CSV text."""
+    if 'email' not in session:
+        flash("Please log in to access this page.", "error")
+        return redirect(url_for("login"))
+
+    path = safe_join(data_folder(), filename)
+    if path is None or not may_open(measurement_for_path(path, filename), current_user()) or not os.path.isfile(path):
+        return "File not found.", 404
+
+    headers = {}
+    if request.args.get("download"):
+        headers["Content-Disposition"] = f"attachment; filename={os.path.splitext(os.path.basename(path))[0]}.csv"
+    return Response(export_csv(path), mimetype="text/csv", headers=headers)
+
+@app.route('/plot_data/<path:filename>')
+def plot_data_file(filename):
+    """Downsampled plot series of a saved measurement as JSON, optionally for an x range only."""
+    if 'email' not in session:
+        return jsonify({"error": "Not logged in."}), 401
+
+    path = safe_join(data_folder(), filename)
+    if path is None or not may_open(measurement_for_path(path, filename), current_user()) or not os.path.isfile(path):
+        return jsonify({"error": "File not found."}), 404
+
+    return jsonify(plot_data(path, points=request.args.get("points", DEFAULT_POINTS, type=int),
+                             x0=request.args.get("x0", type=float), x1=request.args.get("x1", type=float),
+                             method=request.args.get("method", "lttb")))
+
+@app.route('/connection_status', methods=["GET"])
+def connection_status():
+    """Cached health of the session's instrument as JSON."""
+    if 'email' not in session:
+        return jsonify({"error": "Not logged in."}), 401
+    if connection_pending():
+        return jsonify({"connected": False, "pending": True})
+    health = connection_health()
+    if health is None:
+        return jsonify({"connected": False, "error": "No connection."})
+    return jsonify(health)
 
 @app.route('/reset_connection', methods=["POST"])
 def reset_connection():
@@ -833,28 +1460,38 @@ def reset_connection():
 
     session_id = session['email']
     try:
-        # Remove existing controller instance if it exists
-        if session_id in gpib_connections:
-            # Try to disconnect the current connection
-            old_ctrl = gpib_connections[session_id]
-            if hasattr(old_ctrl.conn, "disconnect"):
-                old_ctrl.conn.disconnect()
-            del gpib_connections[session_id]
-
-        # Reinitialize the controller with a fresh connection
+        # Reopen the shared session of the instrument once it is our turn on the bus
+        instrument = session_instrument()
+        if instrument is not None:
+            with instrument.lease(session_id, timeout=REQUEST_WAIT):
+                instruments.reconnect(instrument.key)
+
         ctrl = get_controller()
-        ctrl.clear()  # Clear the controller
+        with instrument_lease(ctrl):
+            ctrl.clear()  # Clear the controller and its cached instrument state
         flash("Connection reset and re-established successfully!", "success")
     except Exception as e:
         flash(f"Error during reset: {str(e)}", "error")
 
     return redirect(request.referrer or url_for("home"))
 
+# Loads the VISA library and compresses missing front-end copies once the window is showing, so the first login does not wait for them
+def warm_up():
+    precompress_in_background()
+    if VisaCon is SimulatedVisaCon:
+        return
+    try:
+        instruments.resource_manager()
+    except Exception as e:
+        print(f"VISA library unavailable: {e}")
+
 # LAUNCHING THE APP #######################################################################################################################################
 if __name__ == '__main__':
+    import webview  # Only the desktop window needs it
+
     # Create a WebView window. Use for production.
     webview.create_window('HP 4280A Controller', app, width=1920, height=1080)  # Pass the Flask app to the WebView window
-    webview.start()
+    webview.start(warm_up)
 
     # Start the Flask app via web browser. Use for debugging and testing.
     #app.run(debug=True, host="0.0.0.0", port=5001)
\ No newline at end of file
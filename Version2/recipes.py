@@ -0,0 +1,110 @@
+from contextlib import nullcontext
+from sweep_planner import plan_sweep
+
+# Recipes: lists of sweeps run back to back by one background job.
+# Every run configures the instrument through the controller's state cache, so only
+# the settings that differ from the previous run are sent.
+
+# Choices for a recipe step: name shown on the page and the program code sent
+FUNCTIONS = {
+    "cg": ("C-G", "FN1"),
+    "c": ("C", "FN2"),
+    "g": ("G", "FN3"),
+    "cgt": ("C-G-t", "FN4"),
+    "ct": ("C-t", "FN5"),
+    "gt": ("G-t", "FN6"),
+}
+TIME_FUNCTIONS = ("cgt", "ct", "gt")
+BIASES = {
+    "single": ("Single sweep", "IB2"),
+    "double": ("Double sweep", "IB3"),
+}
+TIME_BIAS = "IB5"  # C-t measurements always use pulse bias
+RANGES = {
+    "auto": ("Auto", "RA1"),
+    "10nf": ("10nF/10mS", "RM3"),
+    "100pf": ("100pF/1mS", "RM2"),
+    "10pf": ("1pF/100uS", "RM1"),
+}
+
+# Settings each kind of step needs, as named in the session settings
+VOLTAGE_SETTINGS = ("DC_V", "Start_V", "Stop_V", "Step_V", "Hold_T", "Step_T")
+TIME_SETTINGS = ("Pulse", "Meas", "Nofread", "Pulse_Width", "Meas_Interval")
+
+def step_sweep_type(step):
+    return "time" if step["function"] in TIME_FUNCTIONS else "voltage"
+
+def step_settings_names(function):
+    return TIME_SETTINGS if function in TIME_FUNCTIONS else VOLTAGE_SETTINGS
+
+def describe_step(step):
+    text = f"{FUNCTIONS[step['function']][0]}, {RANGES[step['meas_range']][0]} range"
+    if step_sweep_type(step) == "voltage":
+        settings = step["settings"]
+        text += f", {BIASES[step['bias']][0].lower()} {settings['Start_V']:g} to {settings['Stop_V']:g} V in {settings['Step_V']:g} V steps"
+    else:
+        text += f", {step['settings']['Nofread']:g} readings every {step['settings']['Meas_Interval']:g} s"
+    return text
+
+# Checks every step before the run starts; returns a list of problems
+def check_recipe(steps, speed=None):
+    problems = []
+    if not steps:
+        problems.append("The recipe has no steps.")
+    for step in steps:
+        plan = plan_sweep(step["settings"], step_sweep_type(step), speed)
+        problems.extend(f"Step {step['position']}: {error}" for error in plan.errors)
+    return problems
+
+# Sends one step's configuration as a single program string
+def configure_step(ctrl, step, settings):
+    with ctrl.batched():
+        ctrl.command(FUNCTIONS[step["function"]][1])
+        ctrl.command(RANGES[step["meas_range"]][1])
+        if step_sweep_type(step) == "time":
+            ctrl.command(TIME_BIAS)
+            ctrl.set_Pulse(settings["Pulse"])
+            ctrl.set_Measure_pulse(settings["Meas"])
+            ctrl.set_NOFREAD(settings["Nofread"])
+            ctrl.set_th(settings["Pulse_Width"])
+            ctrl.set_td(settings["Meas_Interval"])
+        else:
+            ctrl.command(BIASES[step["bias"]][1])
+            ctrl.set_DCV(settings["DC_V"])
+            ctrl.set_StartV(settings["Start_V"])
+            ctrl.set_StopV(settings["Stop_V"])
+            ctrl.set_StepV(settings["Step_V"])
+            ctrl.set_Hold_Time(settings["Hold_T"])
+            ctrl.set_StepT(settings["Step_T"])
+
+# Runs every step repeat_count times. record(step, repeat, filename) stores a result
+# and returns its measurement ID. Returns the IDs of all stored results. hold() is
+# entered around every run to keep other users off the instrument (e.g. its lease).
+def run_recipe(ctrl, job, steps, record, transfer="ascii", storage="csv", hold=nullcontext):
+    problems = check_recipe(steps, ctrl.measurement_speed())
+    if problems:
+        raise Exception(" ".join(problems))
+
+    runs = [(step, repeat) for step in steps for repeat in range(max(1, step["repeat_count"]))]
+    measurement_ids = []
+    for index, (step, repeat) in enumerate(runs):
+        if job.cancelled():
+            break
+        # The delay comes before every run but the first, so back to back runs can settle
+        if index > 0 and step["delay"] > 0:
+            job.set_progress(index / len(runs), f"Waiting {step['delay']:g} s before step {step['position']}")
+            if ctrl.pause(job, step["delay"]):
+                break
+        job.set_progress(index / len(runs), f"Step {step['position']}, run {repeat + 1} of {step['repeat_count']}")
+
+        settings = plan_sweep(step["settings"], step_sweep_type(step)).settings
+        # Hold the instrument from configuration to readout; it is free again during delays
+        with hold():
+            configure_step(ctrl, step, settings)
+            filename = ctrl.sweep_measure(job, transfer, storage, show_progress=False)
+        if job.cancelled():
+            break
+        if not filename:
+            raise Exception(f"Step {step['position']}, run {repeat + 1}: no data received.")
+        measurement_ids.append(record(step, repeat, filename))
+    return measurement_ids
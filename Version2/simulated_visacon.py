@@ -1,14 +1,153 @@
+import math
+import re
 import time
-import random
+import threading
 import os
+import numpy as np
+from sweep_planner import MAX_READINGS
+
+DEFAULT_ADDRESS = "GPIB0::17::INSTR"
+
+# Simulated HP4280A.
+# Parses the program codes the controller sends, keeps the instrument settings, and
+# answers sweeps with C-V and C-t curves of a MOS capacitor plus measurement noise.
+# Commands, readings and transfers take about as long as on the real instrument,
+# multiplied by time_scale (0 answers at once, 0.1 runs ten times faster).
+
+DEFAULT_NOISE = 0.002  # Relative standard deviation of the capacitance readings
+NOISE_FLOOR = 2e-15  # Absolute capacitance noise (F)
+DEFAULT_TIME_SCALE = 1.0
+
+# Approximate timing of the instrument and the bus
+COMMAND_TIME = 0.003  # Parsing one program code (s)
+BUS_TIME = 0.001  # Addressing overhead of one GPIB transfer (s)
+BYTE_TIME = 1e-5  # Per byte read back, about 100 kB/s
+READING_TIME = {"1": 0.02, "2": 0.05, "3": 0.2}  # One reading at MS1 (fast), MS2 (medium), MS3 (slow)
+
+TEST_FREQUENCY = 1e6  # Hz
+RANGE_FULL_SCALE = {"1": 10e-12, "2": 100e-12, "3": 10e-9}  # RM1..RM3; RA1 (auto) never overflows
+OVERFLOW_VALUE = 9.9999e37
+
+# Settings after power on, keyed by program code
+DEFAULT_SETTINGS = {
+    "FN": "1", "IB": "2", "RA": "1", "RM": None, "MS": "2", "TR": "1", "SL": "2", "LE": "1",
+    "PV": 0.0, "PS": 0.0, "PP": 5.0, "PE": 0.1, "PL": 0.01, "PD": 0.03,
+    "PN": 100.0, "PU": 0.0, "PM": 0.0, "PH": 0.01, "PT": 0.01,
+}
+NUMERIC_CODES = ("PV", "PS", "PP", "PE", "PL", "PD", "PN", "PU", "PM", "PH", "PT")
+MODE_CODES = ("FN", "IB", "RA", "RM", "MS", "TR", "SL", "LE", "SW", "BL")
+TIME_FUNCTIONS = ("4", "5", "6")  # C-G-t, C-t, G-t
+CODE_PATTERN = re.compile(r'^([A-Z]{2})\s*(.*)$')
+
+# Physical constants (SI)
+Q = 1.602e-19
+EPS_OX = 3.45e-11  # SiO2
+EPS_SI = 1.04e-10
+KT = 0.02585  # Thermal voltage at 300 K
+NI = 1e16  # Intrinsic carrier density of Si (m^-3)
+
+class MosCapacitor:
+    """High frequency C-V and C-t response of a MOS capacitor (depletion approximation)."""
+    def __init__(self, area=1e-7, oxide_thickness=50e-9, doping=1e21, substrate="p", flat_band=-0.8,
+                 hysteresis=0.05, generation_time=2.0, loss_tangent=0.002):
+        self.area = area  # Gate area (m^2)
+        self.doping = doping  # Substrate doping (m^-3)
+        self.polarity = 1 if substrate == "p" else -1
+        self.flat_band = flat_band  # V
+        self.hysteresis = hysteresis  # Shift between the up and down sweep (V)
+        self.generation_time = generation_time  # Recovery time constant from deep depletion (s)
+        self.loss_tangent = loss_tangent
+
+        self.cox_area = EPS_OX / oxide_thickness
+        self.cox = self.cox_area * area
+        phi_f = KT * math.log(doping / NI)
+        w_max = math.sqrt(4 * EPS_SI * phi_f / (Q * doping))
+        self.cmin = series(self.cox, EPS_SI * area / w_max)
+        self.threshold = 2 * phi_f + math.sqrt(4 * EPS_SI * Q * doping * phi_f) / self.cox_area  # Above flat band
+        # The accumulation to depletion corner is rounded so C at flat band matches the Debye length
+        debye = math.sqrt(EPS_SI * KT / (Q * doping))
+        cfb = series(self.cox, EPS_SI * area / debye)
+        self.corner = ((self.cox / cfb) ** 2 - 1) * Q * EPS_SI * doping / (2 * self.cox_area ** 2 * math.log(2))
+
+    # Gate voltage beyond flat band, towards depletion
+    def depletion_bias(self, v, shift=0.0):
+        return self.polarity * (np.asarray(v, dtype=float) - self.flat_band - shift)
+
+    # deep=True is the response before an inversion layer has formed (right after a pulse)
+    def capacitance(self, v, shift=0.0, deep=False):
+        u = self.depletion_bias(v, shift)
+        u = self.corner * np.logaddexp(0, u / self.corner)
+        c = self.cox / np.sqrt(1 + 2 * self.cox_area ** 2 * u / (Q * EPS_SI * self.doping))
+        return c if deep else np.maximum(c, self.cmin)
+
+    # Loss of the oxide plus interface traps, which peak in depletion
+    def conductance(self, v, c, shift=0.0):
+        u = self.depletion_bias(v, shift)
+        traps = 0.02 * np.exp(-((u - self.threshold / 2) / (self.threshold / 4)) ** 2)
+        return 2 * math.pi * TEST_FREQUENCY * c * (self.loss_tangent + traps)
+
+    # C-t recovery at measure_v after a pulse, t in seconds since the pulse ended
+    def recovery(self, t, measure_v):
+        start = self.capacitance(measure_v, deep=True)
+        end = self.capacitance(measure_v)
+        return end - (end - start) * np.exp(-np.asarray(t, dtype=float) / self.generation_time)
+
+def series(a, b):
+    return a * b / (a + b)
+
+class SimulatedSweep:
+    def __init__(self, readings, axis, start, step_time, settle_time):
+        self.readings = readings  # One row per reading: C, G, swept value
+        self.axis = axis
+        self.start = start  # time.monotonic() when SW1 was received
+        self.step_time = step_time  # Real seconds per reading
+        self.settle_time = settle_time  # Real seconds before the first reading
+        self.stopped_at = None
+
+    @property
+    def duration(self):
+        return self.settle_time + len(self.readings) * self.step_time
+
+    def remaining(self):
+        end = self.start + self.duration
+        if self.stopped_at is not None:
+            end = min(end, self.stopped_at)
+        return max(0.0, end - time.monotonic())
+
+    # SW0 during the sweep keeps only the readings taken so far
+    def stop(self):
+        if self.remaining() > 0:
+            self.stopped_at = time.monotonic()
+            taken = int((self.stopped_at - self.start - self.settle_time) // self.step_time) if self.step_time > 0 else 0
+            self.readings = self.readings[:max(0, taken)]
+
 
 class SimulatedVisaCon:
-    def __init__(self, addr="GPIB0::17::INSTR", timeout=10000):
+    def __init__(self, addr=DEFAULT_ADDRESS, timeout=10000, noise=DEFAULT_NOISE, time_scale=DEFAULT_TIME_SCALE,
+                 device=None, seed=None, verbose=True):
         self.addr = addr
         self.timeout = timeout
         self.connected = False  # Simulated connection state
         self.inst = self  # Simulated `inst` attribute
-        self.query_delay = 0.1  # Simulated query delay
+        self.io_lock = threading.RLock()  # Held for every exchange with the instrument
+        self.noise = noise
+        self.time_scale = time_scale
+        self.device = device or MosCapacitor()
+        self.rng = np.random.default_rng(seed)
+        self.verbose = verbose
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.binary = False  # BN (binary) or AS (ASCII) output format
+        self.sweep = None  # Sweep started by SW1, kept until its block has been read
+        self.commands = 0  # Program codes received, for tests and benchmarks
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+    # Real time taken by something that takes `seconds` on the instrument
+    def wait(self, seconds):
+        if self.time_scale > 0 and seconds > 0:
+            time.sleep(seconds * self.time_scale)
 
     # Simulates connecting to the instrument
     def connect(self):
@@ -31,39 +170,203 @@ class SimulatedVisaCon:
             print("Simulating forced connection check...")
         return self.connected  # Return the simulated connection state
 
-    # Simulates writing a command to the instrument
+    # Simulates writing a program string; codes are separated by ';'
     def write(self, command):
-        print(f"Simulated write: {command}")
+        self.log(f"Simulated write: {command}")
+        codes = [code.strip() for code in command.strip().split(';') if code.strip()]
+        self.wait(BUS_TIME + COMMAND_TIME * len(codes))
+        for code in codes:
+            self.execute(code)
+
+    def execute(self, code):
+        self.commands += 1
+        upper = code.upper()
+        match upper:
+            case "SW1":
+                self.start_sweep()
+            case "SW0":
+                if self.sweep is not None:
+                    self.sweep.stop()
+            case "AS":
+                self.binary = False
+            case "BN":
+                self.binary = True
+            case "READ?" | "BD" | "BLO" | "INIT" | "MEASURE" | "FL" | "GR" | "CEI" | "V01":
+                pass  # Output requests and settings the simulation does not depend on
+            case _:
+                match = CODE_PATTERN.match(upper)
+                if match is None:
+                    self.log(f"Simulated: unknown command {code}")
+                    return
+                name, value = match.groups()
+                if name in NUMERIC_CODES:
+                    try:
+                        self.settings[name] = float(value)
+                    except ValueError:
+                        self.log(f"Simulated: bad value in {code}")
+                elif name in MODE_CODES and value.isdigit():
+                    self.settings[name] = value
+                    # Auto range and a manual range replace each other
+                    if name == "RA" and value == "1":
+                        self.settings["RM"] = None
+                    elif name == "RM":
+                        self.settings["RA"] = "0"
+                else:
+                    self.log(f"Simulated: unknown command {code}")
 
     # Simulates querying the instrument
     def query(self, command):
-        print(f"Simulated query: {command}")
-        # Return simulated responses for specific queries
-        simulated_responses = {
-            "ID?": "Simulated HP4280A Device",
-            "*IDN?": "Simulated HP4280A,12345,1.0",
-            "PV?": "5.0",
-            "PS?": "0.0",
-            "PP?": "5.0",
-            "PE?": "0.1",
-            "PL?": "0.01",
-            "PD?": "0.03",
-        }
-        return simulated_responses.get(command, "Simulated Response")
+        self.log(f"Simulated query: {command}")
+        command = command.strip()
+        self.wait(2 * BUS_TIME + COMMAND_TIME)
+        match command:
+            case "ID?":
+                return "HP4280A"
+            case "*IDN?":
+                return "HEWLETT-PACKARD,4280A,SIMULATED,1.0"
+        name = command[:-1] if command.endswith("?") else None
+        if name in NUMERIC_CODES:
+            return f"{self.settings[name]:g}"
+        self.write(command)
+        return self.read()
+
+    def reading_time(self):
+        return READING_TIME.get(self.settings["MS"], READING_TIME["2"])
+
+    # Bias points of the C-V sweep set up by PS, PP, PE and IB
+    def sweep_voltages(self):
+        start, stop, step = self.settings["PS"], self.settings["PP"], abs(self.settings["PE"])
+        if step == 0 or start == stop:
+            voltages = np.array([start])
+        else:
+            steps = int(math.floor(abs(stop - start) / step + 1e-9))
+            voltages = np.round(start + math.copysign(step, stop - start) * np.arange(steps + 1), 6)
+        if self.settings["IB"] == "3":  # Double sweep: back to the start voltage
+            voltages = np.concatenate([voltages, voltages[-2::-1]])
+        return voltages[:MAX_READINGS]
+
+    # Generates the sweep's readings when SW1 arrives; they become readable as the sweep time passes
+    def start_sweep(self):
+        device = self.device
+        if self.settings["FN"] in TIME_FUNCTIONS:
+            count = int(min(max(self.settings["PN"], 1), MAX_READINGS))
+            interval = max(self.settings["PT"], self.reading_time())
+            times = np.round(np.arange(count) * interval, 6)
+            measure = self.settings["PM"]
+            c = device.recovery(times, measure)
+            g = device.conductance(measure, c)
+            swept, axis = times, "T"
+            settle = self.settings["PH"]
+        else:
+            swept = self.sweep_voltages()
+            # Traps shift the curve in the direction the bias moves
+            direction = np.sign(np.gradient(swept)) if len(swept) > 1 else np.zeros(1)
+            shift = direction * device.hysteresis / 2
+            c = device.capacitance(swept, shift)
+            g = device.conductance(swept, c, shift)
+            axis = "V"
+            interval = self.settings["PD"] + self.reading_time()
+            settle = self.settings["PL"]
+
+        c = c * (1 + self.noise * self.rng.standard_normal(len(c))) + NOISE_FLOOR * self.rng.standard_normal(len(c))
+        g = g * (1 + self.noise * self.rng.standard_normal(len(g)))
+        readings = np.column_stack([c, g, swept])
+        self.sweep = SimulatedSweep(readings, axis, time.monotonic(), interval * self.time_scale, settle * self.time_scale)
+        self.log(f"Simulated sweep: {len(readings)} readings over {self.sweep.duration:.2f} s")
+
+    # Waits for the running sweep like READ? does, raising a VISA timeout if it takes too long
+    def wait_for_sweep(self):
+        remaining = self.sweep.remaining()
+        limit = self.timeout / 1000 if self.timeout is not None else math.inf
+        if remaining > limit:
+            time.sleep(limit)
+            raise visa_timeout()
+        time.sleep(remaining)
+
+    # Takes the block of the last sweep, or a single reading at the DC bias (PV) if there is none
+    def take_readings(self):
+        if self.sweep is None:
+            c = self.device.capacitance(self.settings["PV"])
+            g = self.device.conductance(self.settings["PV"], c)
+            c = c * (1 + self.noise * self.rng.standard_normal()) + NOISE_FLOOR * self.rng.standard_normal()
+            return np.array([[c, g, self.settings["PV"]]]), "V"
+        self.wait_for_sweep()
+        sweep, self.sweep = self.sweep, None
+        return sweep.readings, sweep.axis
+
+    # Values of each reading in the order the instrument sends them for the current function
+    def columns(self, readings, axis):
+        if axis == "T":
+            if self.settings["FN"] == "4":
+                return readings
+            if self.settings["FN"] == "6":
+                return readings[:, [1, 2]]
+            return readings[:, [0, 2]]
+        return readings
+
+    # Status letter of each capacitance reading: N normal, O over the manual range
+    def overflow(self, capacitance):
+        if self.settings["RA"] == "1" or self.settings["RM"] is None:
+            return np.zeros(len(capacitance), dtype=bool)
+        return np.abs(capacitance) > RANGE_FULL_SCALE.get(self.settings["RM"], math.inf)
+
+    def format_block(self, readings, axis):
+        over = self.overflow(readings[:, 0])
+        rows = []
+        for (c, g, x), overflow in zip(readings.tolist(), over.tolist()):
+            status = "O" if overflow else "N"
+            c = OVERFLOW_VALUE if overflow else c
+            if axis == "T":
+                fields = {"4": [f"{status}CM{c:+.4E}", f"NGM{g:+.4E}", f"T{x:+.3E}"],
+                          "6": [f"NGM{g:+.4E}", f"T{x:+.3E}"]}.get(self.settings["FN"], [f"{status}CM{c:+.4E}", f"T{x:+.3E}"])
+            else:
+                fields = [f"{status}CM{c:+.4E}", f"NGM{g:+.4E}", f"V{x:+.3E}"]
+            rows.append(",".join(fields))
+        return "\r\n".join(rows)
 
     # Simulates reading data from the instrument
     def read(self):
-        print("Simulated read: Returning default data.")
-        return "Simulated,Data,1.0,2.0,3.0"
+        text = self.format_block(*self.take_readings())
+        self.wait(BUS_TIME + BYTE_TIME * len(text))
+        self.log(f"Simulated read: {text.count(chr(10)) + 1} readings")
+        return text
+
+    # Serial poll: bit 0 is set once the sweep's data is ready
+    def read_stb(self):
+        if self.sweep is None or self.sweep.remaining() == 0:
+            return 0x01
+        return 0x00
 
-    # Simulates reading raw data from the instrument
+    # Simulates reading a response in chunks, each arriving after its transfer time
+    def read_stream(self, chunk_size=256):
+        data = (self.format_block(*self.take_readings()) + "\r\n").encode("ascii")
+        for start in range(0, len(data), chunk_size):
+            chunk = data[start:start + chunk_size]
+            self.wait(BYTE_TIME * len(chunk))
+            yield chunk
+
+    def binary_block(self):
+        readings, axis = self.take_readings()
+        values = self.columns(readings, axis).astype('>f4')
+        self.wait(BUS_TIME + BYTE_TIME * values.nbytes)
+        return values
+
+    # Simulates reading raw data: big endian floats in BN format, the ASCII block otherwise
     def read_raw(self):
-        print("Simulated read_raw: Returning dummy binary data.")
-        return b"Simulated,Data,1.0,2.0,3.0"
+        if self.binary:
+            return self.binary_block().tobytes() + b"\r\n"
+        return (self.read() + "\r\n").encode("ascii")
 
-    # Simulates clearing the instrument's state
+    # Simulates a binary block of big endian 32 bit floats
+    def read_binary_values(self, datatype='f', is_big_endian=True, container=list, header_fmt='empty', expect_termination=True):
+        values = self.binary_block().ravel().astype(float)
+        self.log(f"Simulated read_binary_values: {len(values)} values")
+        return container(values)
+
+    # Simulates a device clear: the running sweep and any unread data are dropped
     def clear(self):
         if self.connected:
+            self.sweep = None
             print("Simulated: Instrument cleared successfully.")
         else:
             print("Simulated: No instrument connected to clear.")
@@ -91,10 +394,10 @@ class SimulatedVisaCon:
         else:
             return "No device connected"
 
-    # Simulates querying measurement
+    # Simulates a spot measurement of capacitance and conductance at the given bias
     def query_measurement(self, value):
-        c = random.uniform(1.0, 10.0)  # Simulated capacitance
-        g = random.uniform(0.1, 1.0)   # Simulated conductivity
+        c = float(self.device.capacitance(value))
+        g = float(self.device.conductance(value, c))
         return c, g
 
     # Simulates a default sweep using a CSV file
@@ -107,4 +410,12 @@ class SimulatedVisaCon:
             return data
         except FileNotFoundError:
             print("Simulated sweep data file not found.")
-            return "Error: Simulated data file not found."
\ No newline at end of file
+            return "Error: Simulated data file not found."
+
+# The error pyvisa raises when a read times out (a plain TimeoutError without pyvisa)
+def visa_timeout():
+    try:
+        import pyvisa
+        return pyvisa.errors.VisaIOError(pyvisa.constants.StatusCode.error_timeout)
+    except ImportError:
+        return TimeoutError("Simulated read timed out.")
@@ -0,0 +1,140 @@
+import io
+import re
+import numpy as np
+
+# Helpers for the ASCII data the HP4280A returns for a sweep.
+# Each reading is one line of comma separated fields such as
+#   NCM+1.2345E-12,NGM+0.0012E-06,V+1.000E+00   (C-V)
+#   NCM+1.2345E-12,T+0.150E+00                  (C-t)
+# where the leading letters are status/unit codes and the rest is the value.
+
+FIELD_PATTERN = re.compile(r'^"?([A-Za-z]*)\s*([-+]?\d*\.?\d+(?:[Ee][-+]?\d+)?)"?$')
+
+# Splits a field into its letter prefix and numeric value
+def split_field(field):
+    match = FIELD_PATTERN.match(field.strip())
+    if match is None:
+        return None, None
+    return match.group(1), float(match.group(2))
+
+# Converts one line of instrument output to a plot point, or None if it is not a reading
+def parse_row(row):
+    fields = row.strip().split(',')
+    if len(fields) < 2:
+        return None
+
+    _, capacitance = split_field(fields[0])
+    if capacitance is None or capacitance == 0:
+        return None
+
+    # C-V rows carry the bias voltage in the third field, C-t rows the time in the second
+    if len(fields) >= 3 and fields[2].strip().strip('"').startswith('V'):
+        axis = "V"
+        _, x = split_field(fields[2])
+    elif fields[1].strip().strip('"').startswith('T'):
+        axis = "T"
+        _, x = split_field(fields[1])
+    else:
+        return None
+
+    if x is None:
+        return None
+    return {"axis": axis, "x": x, "c": capacitance}
+
+# Parses every reading in a block of instrument output
+def parse_block(data):
+    prefixes, values = to_columns(data)
+    axis, column = reading_axis(prefixes)
+    if axis is None:
+        # Not a uniform block of readings, so look at every row on its own
+        points = []
+        for row in data.split('\n'):
+            point = parse_row(row)
+            if point is not None:
+                points.append(point)
+        return points
+    return points_from_values(values[:, [0, column]], axis)
+
+# Swept value of a block from the prefixes of its first reading: ("V", column), ("T", column) or (None, None)
+def reading_axis(prefixes):
+    if len(prefixes) >= 3 and prefixes[2].startswith('V'):
+        return "V", 2
+    if len(prefixes) >= 2 and prefixes[1].startswith('T'):
+        return "T", 1
+    return None, None
+
+# Block with one reading per CR LF terminated line and no blank lines
+def normalize_block(data):
+    return "".join(f"{line}\r\n" for line in block_lines(data))
+
+def block_lines(data):
+    return [line.strip() for line in data.split('\n') if line.strip()]
+
+# Decodes a raw binary block of big endian 32 bit floats, ignoring the line terminator
+def decode_binary_block(raw):
+    usable = len(raw) - len(raw) % 4
+    return np.frombuffer(raw[:usable], dtype='>f4').astype(float)
+
+# Splits a block into typed columns. Returns the letter prefix of each field in the
+# first reading and a float array with one row per reading (non numbers become NaN).
+# The first reading's prefixes are removed from the whole block with plain string
+# replacement and NumPy parses the rest in one pass. Blocks where that does not leave
+# clean numbers (other status codes, text, ragged rows) are parsed field by field.
+def to_columns(data):
+    text = data.replace('\r', '').replace('"', '').strip()
+    if not text:
+        return [], np.empty((0, 0))
+    prefixes = [split_field(field)[0] or "" for field in text.split('\n', 1)[0].split(',')]
+
+    numbers = '\n' + text
+    for i, prefix in enumerate(prefixes):
+        separator = '\n' if i == 0 else ','
+        if prefix:
+            numbers = numbers.replace(separator + prefix, separator)
+    try:
+        values = np.loadtxt(io.StringIO(numbers), delimiter=',', ndmin=2)
+    except ValueError:
+        return columns_by_field(block_lines(text), prefixes)
+    if values.shape[1] != len(prefixes):
+        return columns_by_field(block_lines(text), prefixes)
+    return prefixes, values
+
+def columns_by_field(lines, prefixes):
+    rows = [line.split(',') for line in lines]
+    width = max(len(row) for row in rows)
+    prefixes = prefixes + [""] * (width - len(prefixes))
+    values = np.full((len(rows), width), np.nan)
+    for i, row in enumerate(rows):
+        for j, field in enumerate(row):
+            _, value = split_field(field)
+            if value is not None:
+                values[i, j] = value
+    return prefixes, values
+
+# Formats typed columns back into instrument style fields, e.g. NCM+1.2345E-12
+def format_fields(prefixes, values):
+    values = np.asarray(values, dtype=float)
+    if values.size == 0:
+        return []
+    columns = [np.where(np.isnan(column), "", np.char.add(prefix, np.char.mod("%+.4E", column)))
+               for prefix, column in zip(prefixes, values.T)]
+    return np.stack(columns, axis=1).tolist()
+
+# Field prefixes of binary readings: capacitance, conductance (when present) and the swept value
+def binary_prefixes(columns, axis):
+    return ["NCM", "NGM", axis] if columns > 2 else ["NCM", axis]
+
+# Turns binary readings (one row per reading, capacitance first and the swept value last)
+# into plot points
+def points_from_values(values, axis):
+    values = np.asarray(values, dtype=float)
+    if values.size == 0:
+        return []
+    capacitance, x = values[:, 0], values[:, -1]
+    keep = (capacitance != 0) & np.isfinite(capacitance) & np.isfinite(x)
+    return [{"axis": axis, "x": x_value, "c": c_value}
+            for x_value, c_value in zip(x[keep].tolist(), capacitance[keep].tolist())]
+
+# Formats binary readings as ASCII style fields so CSV files look the same for both transfer modes
+def format_rows(values, axis):
+    return format_fields(binary_prefixes(values.shape[1], axis), values)
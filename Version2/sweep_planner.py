@@ -0,0 +1,163 @@
+import math
+
+# Sweep planner.
+# Works out what a sweep will do from the session settings before anything is sent:
+# number of steps and readings, how long it takes and how much data it returns.
+# Values the HP4280A cannot honor are rounded to its resolution or rejected.
+
+# Instrument limits (HP4280A operation manual)
+BIAS_LIMIT = 100.0  # Bias voltages are -100 V to +100 V...
+VOLTAGE_RESOLUTION = 0.01  # ...set in 10 mV steps
+TIME_RESOLUTION = 0.001  # Times are set in 1 ms steps
+HOLD_TIME_RANGE = (0.0, 650.0)  # Hold time / pulse width (s)
+STEP_TIME_RANGE = (0.0, 650.0)  # Step delay time (s)
+MEAS_INTERVAL_RANGE = (0.01, 650.0)  # C-t measurement interval (s)
+MAX_READINGS = 680  # Readings the instrument can buffer for one block
+
+# Minimum C-t interval for each measurement speed (see the parameter page)
+MIN_INTERVAL_FAST = 0.15
+MIN_INTERVAL_MEDIUM = 0.25
+
+# Approximate size of one reading
+ASCII_BYTES_PER_READING = 45  # e.g. NCM+1.2345E-12,NGM+0.0012E-06,V+1.000E+00 and CR LF
+BINARY_BYTES_PER_VALUE = 4  # Big endian 32 bit float
+
+OVERHEAD_TIME = 1.0  # Seconds added to every sweep for setup and transfer
+PULSE_SETTLE_TIME = 0.5  # Write delay of the program string sent for every pulse
+
+def round_to(value, resolution):
+    return round(round(value / resolution) * resolution, 6)
+
+class Plan:
+    def __init__(self, sweep_type):
+        self.sweep_type = sweep_type
+        self.settings = {}  # Settings as they will be sent, after rounding
+        self.errors = []
+        self.warnings = []
+        self.steps = 0
+        self.readings = 0
+        self.pulses = 0
+        self.duration = 0.0
+        self.columns = 3
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    # Rounds a setting to the instrument's resolution and checks it is in range
+    def setting(self, name, value, resolution, low, high, unit):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            self.errors.append(f"{name} is not a number.")
+            return None
+        rounded = round_to(value, resolution)
+        if not math.isclose(rounded, value, abs_tol=1e-9):
+            self.warnings.append(f"{name} rounded from {value:g} to {rounded:g} {unit}.")
+        if rounded < low or rounded > high:
+            self.errors.append(f"{name} must be between {low:g} and {high:g} {unit}.")
+        self.settings[name] = rounded
+        return rounded
+
+    def to_dict(self):
+        return {
+            "sweep_type": self.sweep_type,
+            "ok": self.ok,
+            "errors": self.errors,
+            "warnings": self.warnings,
+            "settings": self.settings,
+            "steps": self.steps,
+            "readings": self.readings,
+            "pulses": self.pulses,
+            "duration": round(self.duration, 2),
+            "ascii_bytes": self.readings * ASCII_BYTES_PER_READING,
+            "binary_bytes": self.readings * self.columns * BINARY_BYTES_PER_VALUE,
+        }
+
+# Steps, readings and duration (s) of a C-V sweep from start to stop in steps of step, up or
+# down. A double sweep (IB3) runs back to the start voltage, reading every point but the
+# turning one twice. The controller times its completion polling with the same estimate
+def cv_sweep(start, stop, step, hold, step_time, double=False):
+    span = abs(stop - start)
+    steps = int(math.floor(span / abs(step) + 1e-9)) if step and span else 0
+    if double:
+        steps *= 2
+    readings = steps + 1
+    return steps, readings, readings * (step_time + hold) + OVERHEAD_TIME
+
+# C-V sweep from Start_V to Stop_V in steps of Step_V, and back again for a double sweep
+def plan_cv(settings, double=False):
+    plan = Plan("voltage")
+    plan.setting("DC_V", settings.get("DC_V", 0.0), VOLTAGE_RESOLUTION, -BIAS_LIMIT, BIAS_LIMIT, "V")
+    start = plan.setting("Start_V", settings.get("Start_V"), VOLTAGE_RESOLUTION, -BIAS_LIMIT, BIAS_LIMIT, "V")
+    stop = plan.setting("Stop_V", settings.get("Stop_V"), VOLTAGE_RESOLUTION, -BIAS_LIMIT, BIAS_LIMIT, "V")
+    step = plan.setting("Step_V", settings.get("Step_V"), VOLTAGE_RESOLUTION, VOLTAGE_RESOLUTION, 2 * BIAS_LIMIT, "V")
+    hold = plan.setting("Hold_T", settings.get("Hold_T"), TIME_RESOLUTION, *HOLD_TIME_RANGE, "s")
+    step_time = plan.setting("Step_T", settings.get("Step_T"), TIME_RESOLUTION, *STEP_TIME_RANGE, "s")
+    if None in (start, stop, step, hold, step_time) or plan.errors:
+        return plan
+
+    span = abs(stop - start)
+    if span == 0:
+        plan.errors.append("Start and stop voltage are the same.")
+        return plan
+    if step > span:
+        plan.errors.append(f"Step voltage ({step:g} V) is larger than the sweep ({span:g} V).")
+        return plan
+
+    plan.steps, plan.readings, plan.duration = cv_sweep(start, stop, step, hold, step_time, double)
+    last = round_to(start + math.copysign(math.floor(span / step + 1e-9) * step, stop - start), VOLTAGE_RESOLUTION)
+    if not math.isclose(last, stop, abs_tol=1e-9):
+        plan.warnings.append(f"The sweep ends at {last:g} V, the last whole step before {stop:g} V.")
+    if plan.readings > MAX_READINGS:
+        plan.errors.append(f"{plan.readings} readings exceed the {MAX_READINGS} the instrument can buffer. Use a larger step.")
+    return plan
+
+# C-t measurement: Nofread readings every Meas_Interval after a pulse of Pulse_Width
+def plan_ct(settings, speed=None):
+    plan = Plan("time")
+    plan.columns = 2
+    plan.setting("Pulse", settings.get("Pulse", 0.0), VOLTAGE_RESOLUTION, -BIAS_LIMIT, BIAS_LIMIT, "V")
+    plan.setting("Meas", settings.get("Meas", 0.0), VOLTAGE_RESOLUTION, -BIAS_LIMIT, BIAS_LIMIT, "V")
+    readings = plan.setting("Nofread", settings.get("Nofread"), 1, 1, MAX_READINGS, "readings")
+    width = plan.setting("Pulse_Width", settings.get("Pulse_Width"), TIME_RESOLUTION, *HOLD_TIME_RANGE, "s")
+    interval = plan.setting("Meas_Interval", settings.get("Meas_Interval"), TIME_RESOLUTION, *MEAS_INTERVAL_RANGE, "s")
+    if None in (readings, width, interval) or plan.errors:
+        return plan
+
+    minimum = {"fast": MIN_INTERVAL_FAST, "medium": MIN_INTERVAL_MEDIUM}.get(speed)
+    if minimum is not None and interval < minimum:
+        plan.errors.append(f"The measurement interval must be at least {minimum * 1000:g} ms at {speed} speed.")
+
+    plan.readings = int(readings)
+    plan.steps = plan.readings
+    plan.duration = plan.readings * interval + width + OVERHEAD_TIME
+    return plan
+
+# Pulse sweep: one two point sweep from 0 V to every multiple of Step_V up to Stop_V
+def plan_pulse(settings):
+    plan = Plan("pulse")
+    stop = plan.setting("Stop_V", settings.get("Stop_V"), VOLTAGE_RESOLUTION, -BIAS_LIMIT, BIAS_LIMIT, "V")
+    step = plan.setting("Step_V", settings.get("Step_V"), VOLTAGE_RESOLUTION, VOLTAGE_RESOLUTION, 2 * BIAS_LIMIT, "V")
+    hold = plan.setting("Hold_T", settings.get("Hold_T"), TIME_RESOLUTION, *HOLD_TIME_RANGE, "s")
+    step_time = plan.setting("Step_T", settings.get("Step_T"), TIME_RESOLUTION, *STEP_TIME_RANGE, "s")
+    if None in (stop, step, hold, step_time) or plan.errors:
+        return plan
+    if stop < step:
+        plan.errors.append(f"A pulse sweep needs a stop voltage of at least one step ({step:g} V).")
+        return plan
+
+    plan.pulses = int(math.floor(stop / step + 1e-9))
+    plan.steps = plan.pulses
+    plan.readings = plan.pulses * 2
+    plan.duration = plan.pulses * (2 * (step_time + hold) + OVERHEAD_TIME + PULSE_SETTLE_TIME)
+    return plan
+
+def plan_sweep(settings, sweep_type="voltage", speed=None, double=False):
+    match sweep_type:
+        case "time":
+            return plan_ct(settings, speed)
+        case "pulse":
+            return plan_pulse(settings)
+        case _:
+            return plan_cv(settings, double)
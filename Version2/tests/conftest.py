@@ -0,0 +1,105 @@
+import os
+import sys
+import tempfile
+import time
+import pytest
+
+# The app's modules live next to this folder and import each other by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from controller import controller
+from simulated_visacon import SimulatedVisaCon
+
+# Simulated HP4280A that also keeps every program string it was sent, with the write delay at the time
+class LoggingSimulator(SimulatedVisaCon):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.writes = []
+
+    def write(self, command):
+        self.writes.append((command, getattr(self, "write_delay", None)))
+        super().write(command)
+
+    def sent(self):
+        return [command for command, _ in self.writes]
+
+@pytest.fixture(autouse=True)
+def user_profile(tmp_path, monkeypatch):
+    # Measurement files are saved under USERPROFILE/Documents/HPData
+    monkeypatch.setenv("USERPROFILE", str(tmp_path))
+    return tmp_path
+
+@pytest.fixture
+def conn():
+    conn = LoggingSimulator(time_scale=0, seed=0, verbose=False)
+    conn.connect()
+    return conn
+
+@pytest.fixture
+def ctrl(conn):
+    return controller(conn, DC_V=0.0, Start_V=-1.0, Stop_V=1.0, Step_V=0.5, Hold_T=0.0, Step_T=0.0,
+                      Pulse=0.0, Meas=0.0, Nofread=10.0, Pulse_Width=1.0, Meas_Interval=0.15)
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # A fresh database for this test only; the app's connection is reopened afterwards
+    import database
+    database.close_db()
+    database.invalidate_user_cache()
+    monkeypatch.setattr(database, "DB_path", str(tmp_path / "database.db"))
+    database.init_db()
+    yield database
+    database.close_db()
+    database.invalidate_user_cache()
+
+@pytest.fixture(scope="session")
+def main():
+    # main creates its tables when imported, so the database is moved to a temporary file first
+    import database
+    database.close_db()
+    database.DB_path = os.path.join(tempfile.mkdtemp(), "database.db")
+    import main
+    return main
+
+def login(main, email, password):
+    client = main.app.test_client()
+    client.post('/login', data={'email': email, 'password': password})
+    return client
+
+@pytest.fixture
+def client(main):
+    # Logged in as the demo user, whose simulated station answers at once
+    client = login(main, main.DEMO_EMAIL, "demo")
+    with client.session_transaction() as session:
+        email = session["email"]
+    future = main.pending_connections.get(email)
+    if future is not None:
+        future.result()
+    main.gpib_connections[email].conn.time_scale = 0
+    return client
+
+@pytest.fixture
+def admin_client(main, monkeypatch):
+    # The admin would open the real instrument; the tests give it a simulated one
+    monkeypatch.setattr(main, "uses_simulator", lambda user: True)
+    return login(main, "admin@hp4280a.com", "Welcome1")
+
+OTHER_EMAIL = "other@hp4280a.com"
+
+@pytest.fixture
+def other_client(main, monkeypatch):
+    # An ordinary user besides the demo user, working on the same simulated stations
+    monkeypatch.setattr(main, "uses_simulator", lambda user: True)
+    if main.get_user_by_email(OTHER_EMAIL) is None:
+        main.add_user("Other", "User", OTHER_EMAIL, "other")
+    return login(main, OTHER_EMAIL, "other")
+
+# Waits for a background job started through the app and returns its status
+def wait_for_job(client, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = client.get(f'/jobs/{job_id}').json
+        if status["status"] in ("done", "failed", "cancelled"):
+            return status
+        time.sleep(0.02)
+    raise AssertionError(f"Job {job_id} did not finish")
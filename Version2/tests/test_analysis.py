@@ -0,0 +1,110 @@
+import os
+import numpy as np
+import pytest
+from analysis import analyze, analyze_cv, analyze_ct, analyze_file, sweep_branches, crossing
+from data_save import data_folder
+from simulated_visacon import MosCapacitor
+
+VOLTAGES = np.round(np.arange(-5, 5.001, 0.05), 6)
+
+def test_cv_parameters_of_an_ideal_capacitor():
+    device = MosCapacitor()
+    result = analyze_cv(VOLTAGES, device.capacitance(VOLTAGES))
+    assert result["sweep"] == "single"
+    assert result["substrate"] == "p"
+    assert result["cox"] == pytest.approx(device.cox, rel=1e-3)
+    assert result["cmin"] == pytest.approx(device.cmin, rel=1e-3)
+    assert result["vfb"] == pytest.approx(device.flat_band, abs=0.05)
+    assert result["vth"] == pytest.approx(device.flat_band + device.threshold, abs=0.1)
+
+def test_cv_substrate_type_follows_the_slope():
+    device = MosCapacitor(substrate="n", flat_band=0.5)
+    assert analyze_cv(VOLTAGES, device.capacitance(VOLTAGES))["substrate"] == "n"
+
+def test_double_sweep_hysteresis():
+    device = MosCapacitor(hysteresis=0.2)
+    v = np.concatenate([VOLTAGES, VOLTAGES[-2::-1]])
+    shift = np.sign(np.gradient(v)) * device.hysteresis / 2
+    result = analyze_cv(v, device.capacitance(v, shift))
+    assert result["sweep"] == "double" and len(result["branches"]) == 2
+    # The down sweep sits further left by the trap shift
+    assert result["hysteresis"]["vmid_shift"] == pytest.approx(-0.2, abs=0.02)
+    assert result["hysteresis"]["vfb_shift"] == pytest.approx(-0.2, abs=0.06)
+
+def test_too_few_points_are_not_analysed():
+    assert analyze_cv(np.array([0.0, 1.0]), np.array([1e-11, 2e-11])) is None
+    assert analyze_ct(np.arange(3.0), np.array([3e-11, 2e-11, 1e-11])) is None
+
+def test_sweep_branches():
+    assert sweep_branches(np.array([0.0, 1.0, 2.0])) == [slice(0, 3)]
+    assert sweep_branches(np.array([0.0, 1.0, 2.0, 1.0, 0.0])) == [slice(0, 3), slice(2, 5)]
+    assert sweep_branches(np.zeros(4)) == [slice(0, 4)]
+
+def test_crossing_interpolates():
+    assert crossing(np.array([0.0, 1.0, 2.0]), np.array([3.0, 2.0, 1.0]), 1.5) == pytest.approx(1.5)
+    assert crossing(np.array([0.0, 1.0]), np.array([3.0, 2.0]), 5.0) is None
+
+@pytest.mark.parametrize("sign", [1, -1])
+def test_ct_fit_recovers_the_time_constant(sign):
+    t = np.linspace(0, 10, 60)
+    c = 1e-11 + sign * 5e-12 * np.exp(-t / 2.0)
+    result = analyze_ct(t, c)
+    assert result["tau"] == pytest.approx(2.0, rel=0.05)
+    assert result["c_inf"] == pytest.approx(1e-11, rel=0.02)
+    assert result["r_squared"] > 0.999
+
+def test_ct_fit_accepts_unsorted_times():
+    t = np.linspace(0, 10, 60)
+    c = 1e-11 - 5e-12 * np.exp(-t / 2.0)
+    order = np.random.default_rng(0).permutation(len(t))
+    assert analyze_ct(t[order], c[order])["tau"] == pytest.approx(2.0, rel=0.05)
+
+def test_analyze_picks_the_curve_from_the_prefixes():
+    assert analyze(["NCM", "NGM", "V"], np.column_stack([np.full(3, 1e-11), np.zeros(3), np.arange(3.0)]))["type"] == "C-V"
+    assert analyze(["NCM", "T"], np.column_stack([np.full(3, 1e-11), np.arange(3.0)]))["type"] == "C-t"
+    assert analyze(["X", "Y"], np.ones((3, 2))) == {"type": None, "result": None}
+
+@pytest.mark.parametrize("storage", ["csv", "npz"])
+def test_saved_simulated_sweep_is_analysed(ctrl, conn, storage):
+    conn.noise = 0.0
+    ctrl.apply_settings({"Start_V": -5.0, "Stop_V": 5.0, "Step_V": 0.1, "Hold_T": 0.0, "Step_T": 0.0})
+    filename = ctrl.sweep_measure(storage=storage)
+    analysis = analyze_file(os.path.join(data_folder(), filename))
+    assert analysis["type"] == "C-V"
+    assert analysis["result"]["points"] == 101
+    assert analysis["result"]["cox"] == pytest.approx(conn.device.cox, rel=0.01)
+    assert analysis["result"]["vmid"] == pytest.approx(-0.81, abs=0.1)
+
+# Saves a simulated sweep as a measurement of the given user; returns (measurement id, file name)
+def saved_measurement(main, ctrl, email):
+    filename = f"{email.split('@')[0]}_{ctrl.sweep_measure()}"  # Sweeps in the same second share a name
+    os.replace(os.path.join(data_folder(), filename.split('_', 1)[1]), os.path.join(data_folder(), filename))
+    user = main.get_user_by_email(email)
+    return main.add_measurement(user[0], "C-V", os.path.join(data_folder(), filename)), filename
+
+def opened(client, measurement_id, filename):
+    return {
+        "analysis": client.get(f'/analysis/{measurement_id}').status_code,
+        "view": client.get(f'/view_measurement/{measurement_id}').status_code,
+        "export": client.get(f'/export_csv/{filename}').status_code,
+        "plot": client.get(f'/plot_data/{filename}').status_code,
+        "upload": client.get(f'/uploads/{filename}').status_code,
+    }
+
+def test_users_open_only_their_own_measurements(main, client, ctrl):
+    own = saved_measurement(main, ctrl, main.DEMO_EMAIL)
+    other = saved_measurement(main, ctrl, "admin@hp4280a.com")
+    assert opened(client, *own) == {"analysis": 200, "view": 200, "export": 200, "plot": 200, "upload": 200}
+    # Someone else's measurement looks like one that does not exist
+    assert opened(client, *other) == {"analysis": 404, "view": 302, "export": 404, "plot": 404, "upload": 404}
+
+def test_admins_open_every_measurement(main, admin_client, ctrl):
+    measurement = saved_measurement(main, ctrl, main.DEMO_EMAIL)
+    assert opened(admin_client, *measurement) == {"analysis": 200, "view": 200, "export": 200, "plot": 200, "upload": 200}
+
+def test_files_that_are_no_measurement_are_not_served(main, client):
+    with open(os.path.join(data_folder(), "notes.csv"), "w") as file:
+        file.write("NCM+1.0000E-11,NGM+1.0000E-07,V-1.0000E+00\n")
+    assert client.get('/export_csv/notes.csv').status_code == 404
+    assert client.get('/plot_data/notes.csv').status_code == 404
+    assert client.get('/export_csv/../database.db').status_code == 404
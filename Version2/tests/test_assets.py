@@ -0,0 +1,46 @@
+import gzip
+import os
+import assets
+from assets import precompress, find_asset, plotly_bundle
+
+def make_static(tmp_path):
+    folder = tmp_path / "static"
+    (folder / "vendor").mkdir(parents=True)
+    (folder / "vendor" / "lib.js").write_text("var x = 1;" * 100)
+    return folder
+
+def test_precompress_makes_the_missing_copies_once(tmp_path):
+    folder = make_static(tmp_path)
+    path = folder / "vendor" / "lib.js"
+    precompress(str(folder), verbose=False)
+    assert gzip.decompress((folder / "vendor" / "lib.js.gz").read_bytes()) == path.read_bytes()
+
+    # Up-to-date copies are left alone, copies older than their file are made again
+    stamp = os.path.getmtime(str(path) + ".gz")
+    precompress(str(folder), verbose=False)
+    assert os.path.getmtime(str(path) + ".gz") == stamp
+    path.write_text("var y = 2;")
+    os.utime(path, (stamp + 10, stamp + 10))
+    precompress(str(folder), verbose=False)
+    assert gzip.decompress((folder / "vendor" / "lib.js.gz").read_bytes()) == b"var y = 2;"
+    assert not any(name.endswith(".part") for name in os.listdir(folder / "vendor"))
+
+def test_compressed_copy_is_served_once_made(tmp_path, monkeypatch):
+    folder = make_static(tmp_path)
+    monkeypatch.setattr(assets, "STATIC_FOLDER", str(folder))
+    monkeypatch.setattr(assets, "_etags", {})
+    path, encoding, etag = find_asset("vendor/lib.js", "gzip, deflate")
+    assert encoding is None and path.endswith("lib.js")
+
+    precompress(str(folder), verbose=False)
+    path, encoding, gzip_etag = find_asset("vendor/lib.js", "gzip, deflate")
+    assert (encoding, gzip_etag) == ("gzip", f"{etag}-gzip")
+    assert find_asset("vendor/lib.js.gz") is None
+
+def test_basic_plotly_bundle_is_preferred(tmp_path, monkeypatch):
+    folder = make_static(tmp_path)
+    monkeypatch.setattr(assets, "STATIC_FOLDER", str(folder))
+    (folder / "vendor" / "plotly-3.0.1.min.js").write_text("full")
+    assert plotly_bundle() == "vendor/plotly-3.0.1.min.js"
+    (folder / "vendor" / "plotly-basic-3.0.1.min.js").write_text("basic")
+    assert plotly_bundle() == "vendor/plotly-basic-3.0.1.min.js"
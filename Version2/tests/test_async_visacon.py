@@ -0,0 +1,116 @@
+import asyncio
+import threading
+import time
+import pytest
+from conftest import LoggingSimulator
+from async_visacon import AsyncController, AsyncVisaCon, CancelToken, probe_all
+from controller import controller
+
+# Controller on a simulator at the instrument's real speed, set up for a sweep of about 20 s
+@pytest.fixture
+def slow():
+    conn = LoggingSimulator(time_scale=1.0, seed=0, verbose=False)
+    conn.connect()
+    conn.io_lock = threading.RLock()
+    ctrl = controller(conn, DC_V=0.0, Start_V=-1.0, Stop_V=1.0, Step_V=0.1, Hold_T=0.0, Step_T=1.0,
+                      Pulse=0.0, Meas=0.0, Nofread=10.0, Pulse_Width=1.0, Meas_Interval=0.15)
+    with ctrl.batched(settle=0):
+        ctrl.single_config()
+    actrl = AsyncController(ctrl, timeout=2.0)
+    yield actrl, conn
+    actrl.close()
+
+def test_sweep_times_out_and_frees_the_instrument(slow):
+    actrl, conn = slow
+
+    async def run():
+        started = time.monotonic()
+        with pytest.raises(asyncio.TimeoutError):
+            await actrl.sweep(timeout=0.3)
+        assert time.monotonic() - started < 1
+        # The sweep thread stopped waiting, so the next call gets the instrument at once
+        return await actrl.query("ID?")
+
+    assert asyncio.run(run())
+    assert "SW0" in ";".join(conn.sent()[-2:])
+    assert actrl.ctrl.state == {}
+
+def test_cancelled_sweep_without_a_job_stops(slow):
+    actrl, conn = slow
+
+    async def run():
+        task = asyncio.create_task(actrl.sweep())
+        await asyncio.sleep(0.3)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        started = time.monotonic()
+        await actrl.command("ID?")
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) < 1
+
+def test_cancelling_keeps_the_event_loop_running(slow):
+    actrl, conn = slow
+    # A slow device clear must not hold up the other tasks on the loop
+    clear = conn.clear
+    def slow_clear():
+        time.sleep(0.5)
+        clear()
+    conn.clear = slow_clear
+
+    async def run():
+        ticks = []
+        async def tick():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.02)
+        ticker = asyncio.create_task(tick())
+        with pytest.raises(asyncio.TimeoutError):
+            await actrl.io.locked(time.sleep, 1.0, timeout=0.2)  # Holds the bus, so it is cleared at once
+        await asyncio.sleep(0.6)
+        ticker.cancel()
+        return max(b - a for a, b in zip(ticks, ticks[1:]))
+
+    assert asyncio.run(run()) < 0.2
+
+def test_call_waiting_for_the_bus_is_dropped(slow):
+    actrl, conn = slow
+    released = threading.Event()
+
+    def hold_bus():
+        with conn.io_lock:
+            released.wait(5)
+    holder = threading.Thread(target=hold_bus)
+    holder.start()
+    time.sleep(0.05)
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await actrl.write("DC 3", timeout=0.2)
+    asyncio.run(run())
+    released.set()
+    holder.join()
+    time.sleep(0.2)
+    assert "DC 3" not in conn.sent()
+
+def test_cancel_token():
+    token = CancelToken()
+    assert not token.cancelled()
+    token.cancel()
+    assert token.cancelled() and token.cancel_event.wait(0)
+
+def test_probe_all_checks_every_instrument():
+    up = LoggingSimulator(time_scale=0, verbose=False)
+    up.connect()
+    down = LoggingSimulator(addr="GPIB0::18::INSTR", time_scale=0, verbose=False)
+    down.inst = None  # Never opened
+    connections = [AsyncVisaCon(up), AsyncVisaCon(down)]
+
+    async def run():
+        return await probe_all(connections)
+    try:
+        assert asyncio.run(run()) == {"GPIB0::17::INSTR": True, "GPIB0::18::INSTR": False}
+    finally:
+        for conn in connections:
+            conn.close()
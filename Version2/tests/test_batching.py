@@ -0,0 +1,62 @@
+import pytest
+
+def test_batch_is_sent_as_one_program_string(ctrl, conn):
+    with ctrl.batched():
+        ctrl.set_StartV(-2.0)
+        ctrl.set_StopV(2.0)
+        ctrl.set_StepV(0.5)
+    assert conn.sent() == ["PS -2.0;PP 2.0;PE 0.5"]
+    assert (conn.settings["PS"], conn.settings["PP"], conn.settings["PE"]) == (-2.0, 2.0, 0.5)
+
+def test_unchanged_settings_are_not_sent_again(ctrl, conn):
+    with ctrl.batched():
+        ctrl.set_StartV(-2.0)
+        ctrl.set_StopV(2.0)
+    with ctrl.batched():
+        ctrl.set_StartV(-2.0)
+        ctrl.set_StopV(3.0)
+    with ctrl.batched():
+        ctrl.set_StartV(-2.0)
+    assert conn.sent() == ["PS -2.0;PP 2.0", "PP 3.0"]
+
+def test_nested_batches_are_folded_into_the_outer_one(ctrl, conn):
+    with ctrl.batched():
+        ctrl.set_StartV(-2.0)
+        with ctrl.batched():
+            ctrl.set_StopV(2.0)
+        assert conn.sent() == []
+    assert conn.sent() == ["PS -2.0;PP 2.0"]
+
+def test_write_delay_is_the_settle_time_and_restored_afterwards(ctrl, conn):
+    conn.write_delay = 0.0
+    with ctrl.batched(settle=0.25):
+        ctrl.set_StartV(-2.0)
+        ctrl.set_StopV(2.0)
+    assert conn.writes == [("PS -2.0;PP 2.0", 0.25)]
+    assert conn.write_delay == 0.0
+
+def test_failed_batch_sends_nothing_and_forgets_the_state(ctrl, conn):
+    with ctrl.batched():
+        ctrl.set_StartV(-2.0)
+    with pytest.raises(RuntimeError):
+        with ctrl.batched():
+            ctrl.set_StopV(5.0)
+            raise RuntimeError("form error")
+    assert conn.sent() == ["PS -2.0"]
+    assert ctrl.state == {}
+    # With the cache dropped the next batch sends everything again
+    with ctrl.batched():
+        ctrl.set_StartV(-2.0)
+    assert conn.sent()[-1] == "PS -2.0"
+
+def test_auto_and_manual_range_replace_each_other_in_the_cache(ctrl, conn):
+    ctrl.command("RA1")
+    ctrl.command("RM2")
+    assert "RA" not in ctrl.state
+    ctrl.command("RA1")
+    assert conn.sent() == ["RA1", "RM2", "RA1"]
+
+def test_apply_settings_sends_a_plan_in_one_write(ctrl, conn):
+    ctrl.apply_settings({"DC_V": 0.0, "Start_V": -3.0, "Stop_V": 3.0, "Step_V": 0.1, "Hold_T": 0.0, "Step_T": 0.0})
+    assert conn.sent() == ["PV 0.0;PS -3.0;PP 3.0;PE 0.1;PL 0.0;PD 0.0"]
+    assert (ctrl.Start_V, ctrl.Stop_V, ctrl.Step_V) == (-3.0, 3.0, 0.1)
@@ -0,0 +1,60 @@
+import json
+import os
+import subprocess
+import sys
+import benchmark
+
+APP_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def results(**medians):
+    return {"results": {name: {"median_ms": value} for name, value in medians.items()}}
+
+# Runs benchmark.py in its own process, so its database and data folder stay apart from the tests'
+def run_benchmark(tmp_path, *args):
+    return subprocess.run([sys.executable, "benchmark.py", "--quick", "-n", "1", *args], cwd=APP_FOLDER,
+                          env=dict(os.environ, USERPROFILE=str(tmp_path)), capture_output=True, text=True, timeout=300)
+
+def test_summary_in_milliseconds():
+    assert benchmark.summary([0.001, 0.003, 0.002]) == {"median_ms": 2.0, "min_ms": 1.0, "max_ms": 3.0, "runs": 3}
+    assert benchmark.throughput({"median_ms": 2.0}, 100)["points_per_s"] == 50000
+    assert benchmark.throughput({"median_ms": 0.0}, 100)["points_per_s"] is None
+
+def test_measure_runs_setup_before_every_timed_call():
+    calls = []
+    result = benchmark.measure(lambda: calls.append("run"), 3, setup=lambda: calls.append("setup"))
+    assert calls == ["setup", "run"] * 3 and result["runs"] == 3
+
+def test_medians_are_keyed_by_their_path():
+    tree = {"readout": {"10": {"ascii": {"median_ms": 1.0, "runs": 5}, "binary": {"median_ms": 0.5}}}, "other": 3}
+    assert benchmark.medians(tree) == {"readout.10.ascii": 1.0, "readout.10.binary": 0.5}
+
+def test_only_medians_slower_than_the_tolerance_are_regressions():
+    baseline = results(a=10.0, b=10.0, c=0.0, gone=1.0)
+    current = results(a=12.0, b=13.0, c=5.0, new=1.0)
+    assert benchmark.compare(current, baseline, 0.25) == [
+        {"benchmark": "b", "baseline_ms": 10.0, "current_ms": 13.0, "ratio": 1.3}]
+
+def test_config_benchmark_counts_the_commands_of_a_cold_setup():
+    result = benchmark.bench_config(0.0, 2)
+    assert set(result) == set(benchmark.CONFIG_METHODS)
+    assert all(entry["commands"] > 0 and entry["cold"]["runs"] == 2 for entry in result.values())
+
+def test_quick_run_writes_results_and_compares_against_a_baseline(tmp_path):
+    output = tmp_path / "results.json"
+    result = run_benchmark(tmp_path, "--only", "config", "readout", "plot_data", "-o", str(output))
+    assert result.returncode == 0, result.stderr
+    report = json.loads(output.read_text())
+    assert report["version"] == benchmark.RESULTS_VERSION and report["quick"] is True
+    assert set(report["results"]) == {"config", "readout", "plot_data"}
+    assert set(report["results"]["readout"]) == {str(points) for points in benchmark.QUICK_SIZES["readout"]}
+    # Nothing outside the temporary folder is touched
+    assert not (tmp_path / "HPData").exists()
+
+    # A baseline far faster than anything can run makes the comparison fail
+    for entry in report["results"]["config"].values():
+        entry["cold"]["median_ms"] = entry["warm"]["median_ms"] = 1e-6
+    baseline = tmp_path / "baseline.json"
+    baseline.write_text(json.dumps(report))
+    result = run_benchmark(tmp_path, "--only", "config", "--compare", str(baseline))
+    assert result.returncode == 1 and "Slower: config." in result.stderr
+    assert json.loads(result.stdout)["regressions"]
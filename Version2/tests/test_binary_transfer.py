@@ -0,0 +1,54 @@
+import os
+import numpy as np
+import pytest
+import simulated_visacon
+from data_save import data_folder, load_measurement
+from jobs import Job
+
+SETTINGS = {"Start_V": -1.0, "Stop_V": 1.0, "Step_V": 0.5, "Hold_T": 0.0, "Step_T": 0.0}
+
+def saved_values(filename):
+    return load_measurement(os.path.join(data_folder(), filename))[1]
+
+def test_binary_sweep_switches_the_format_only_for_its_block(ctrl, conn):
+    ctrl.apply_settings(SETTINGS)
+    ctrl.sweep_measure(transfer="binary")
+    sent = conn.sent()
+    assert sent.index("BN") < sent.index("BD") < sent.index("READ?") < sent.index("AS")
+
+def test_binary_readings_match_the_ascii_ones(ctrl, conn, monkeypatch):
+    conn.noise = 0.0
+    monkeypatch.setattr(simulated_visacon, "NOISE_FLOOR", 0.0)
+    ctrl.apply_settings(SETTINGS)
+    ascii = saved_values(ctrl.sweep_measure(storage="npz"))
+    binary = saved_values(ctrl.sweep_measure(transfer="binary", storage="npz"))
+    assert binary.shape == ascii.shape == (5, 3)
+    # ASCII fields carry 5 significant digits, binary ones are 32 bit floats
+    np.testing.assert_allclose(binary, ascii, rtol=1e-4)
+
+def test_binary_ct_readings_have_two_columns(ctrl, conn):
+    ctrl.command("FN5")
+    ctrl.set_NOFREAD(8)
+    ctrl.set_td(0.01)
+    filename = ctrl.sweep_measure(transfer="binary", storage="npz")
+    prefixes, values, metadata = load_measurement(os.path.join(data_folder(), filename))
+    assert prefixes == ["NCM", "T"] and values.shape == (8, 2)
+    assert metadata["transfer"] == "binary"
+
+def test_binary_readings_are_published_to_the_job(ctrl):
+    job = Job(1, "GPIB0::17::INSTR", "demo", "C-V", None)
+    ctrl.apply_settings(SETTINGS)
+    ctrl.sweep_measure(job, transfer="binary")
+    assert [point["x"] for point in job.points] == [-1.0, -0.5, 0.0, 0.5, 1.0]
+
+def test_partial_reading_at_the_end_is_dropped(ctrl, conn, monkeypatch):
+    ctrl.apply_settings(SETTINGS)
+    read = conn.read_binary_values
+    monkeypatch.setattr(conn, "read_binary_values", lambda *args, **kwargs: read(*args, **kwargs)[:-1])
+    assert saved_values(ctrl.sweep_measure(transfer="binary", storage="npz")).shape == (4, 3)
+
+@pytest.mark.parametrize("transfer, used", [("binary", "binary"), ("hex", "ascii")])
+def test_transfer_mode_chosen_on_the_parameter_page(client, transfer, used):
+    client.post('/parameter', data={"action": "start_measurement", "sweep_type": "voltage", "Transfer": transfer})
+    with client.session_transaction() as session:
+        assert session["settings"]["Transfer"] == used
@@ -0,0 +1,59 @@
+import os
+import numpy as np
+import pytest
+import data_save
+from data_save import DataSave, available_stores, data_folder, export_csv, get_store, load_measurement
+
+PREFIXES = ["NCM", "NGM", "V"]
+# Values a 32 bit float would round (the last one is the binary transfer's full precision)
+VALUES = np.array([[1.2345e-11, 6.789e-7, -5.0], [1.2346e-11, 6.79e-7, -4.99], [1.0000000001e-11, 1e-9, 0.1]])
+METADATA = {"instrument": "GPIB0::17::INSTR", "settings": {"Step_V": 0.01}}
+BLOCK = '"NCM+1.2345E-11,NGM+6.7890E-07,V-5.0000E+00"\r\n\r\nNCM+1.2346E-11,NGM+6.7900E-07,V-4.9900E+00\r\n'
+
+@pytest.mark.parametrize("storage", ["npz", "parquet"])
+def test_typed_stores_keep_full_precision(storage, tmp_path):
+    if storage not in available_stores():
+        pytest.skip(f"{storage} needs {', '.join(get_store(storage).requires)}")
+    store = get_store(storage)
+    path = str(tmp_path / f"sweep{store.extension}")
+    store.save(path, PREFIXES, VALUES, METADATA)
+    prefixes, values, metadata = load_measurement(path)
+    assert prefixes == PREFIXES
+    assert values.dtype == np.float64 and np.array_equal(values, VALUES)
+    assert metadata == METADATA
+
+def test_csv_export_of_a_typed_file_matches_the_csv_store(tmp_path):
+    get_store("npz").save(str(tmp_path / "sweep.npz"), PREFIXES, VALUES, METADATA)
+    get_store("csv").save(str(tmp_path / "sweep.csv"), PREFIXES, VALUES, {})
+    assert export_csv(str(tmp_path / "sweep.npz")) == export_csv(str(tmp_path / "sweep.csv"))
+    assert load_measurement(str(tmp_path / "sweep.csv"))[1][0].tolist() == VALUES[0].tolist()
+
+def test_formats_without_their_packages_are_not_offered(monkeypatch):
+    real = data_save.importlib.util.find_spec
+    monkeypatch.setattr(data_save.importlib.util, "find_spec", lambda name: None if name == "pyarrow" else real(name))
+    assert available_stores() == ["csv", "npz"]
+
+def test_unknown_format_saves_csv():
+    assert get_store("xlsx") is get_store("csv")
+
+def test_failed_save_falls_back_to_csv(ctrl, monkeypatch):
+    def fail(path, prefixes, values, metadata):
+        with open(path, "w") as file:
+            file.write("partial")
+        raise OSError("disk full")
+    monkeypatch.setattr(get_store("npz"), "save", fail)
+    filename = ctrl.save_result(BLOCK, "data.npz", "npz")
+    assert filename == "data.csv"
+    assert not os.path.exists(os.path.join(data_folder(), "data.npz"))
+    assert load_measurement(os.path.join(data_folder(), filename))[1].shape == (2, 3)
+
+def test_data_save_writes_a_timestamped_csv(tmp_path):
+    saver = DataSave(str(tmp_path / "data_save"))
+    filename = saver.save_csv(BLOCK, headers=["C", "G", "V"], prefix="cv")
+    assert os.path.basename(filename).startswith("cv_") and filename.endswith(".csv")
+    with open(filename, newline='') as file:
+        assert file.read().splitlines() == ["C,G,V", "NCM+1.2345E-11,NGM+6.7890E-07,V-5.0000E+00",
+                                           "NCM+1.2346E-11,NGM+6.7900E-07,V-4.9900E+00"]
+
+def test_data_save_defaults_to_the_user_folder(user_profile):
+    assert DataSave().output_dir == os.path.join(str(user_profile), "Documents", "data_save")
@@ -0,0 +1,45 @@
+import sqlite3
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+
+def test_each_thread_reuses_its_own_connection(db):
+    assert db.get_db() is db.get_db()
+    with ThreadPoolExecutor(1) as executor:
+        other = executor.submit(db.get_db).result()
+    assert other is not db.get_db()
+
+def test_connection_is_tuned_for_concurrent_use(db):
+    conn = db.get_db()
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 30000
+
+def test_release_rolls_back_what_a_failed_request_left(db):
+    conn = db.get_db()
+    conn.execute("INSERT INTO measurements (user_id, test_type, date_recorded, time_recorded) VALUES (1, 'C-V', '2025-01-01', '10:00:00')")
+    assert conn.in_transaction
+    db.release_db()
+    assert not conn.in_transaction
+    assert conn.execute("SELECT COUNT(*) FROM measurements").fetchone()[0] == 0
+
+def test_closed_connection_is_reopened(db):
+    conn = db.get_db()
+    db.close_db()
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+    assert db.get_db().execute("SELECT COUNT(*) FROM users").fetchone()[0] == 2
+
+def test_threads_write_at_the_same_time(db):
+    path = db.DB_path
+    def write(n):
+        for _ in range(20):
+            db.add_measurement(1, f"C-V {n}", f"sweep_{n}.csv")
+        db.close_db()
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert db.DB_path == path
+    assert db.get_db().execute("SELECT COUNT(*) FROM measurements").fetchone()[0] == 160
@@ -0,0 +1,84 @@
+import os
+import numpy as np
+import decimate
+from data_save import STORES, data_folder
+from decimate import Pyramid, lttb, minmax, plot_data
+
+PREFIXES = ["NCM", "NGM", "V"]
+
+# A noisy C-V like curve with one spike, so decimation has something to keep
+def curve(n):
+    x = np.linspace(-5.0, 5.0, n)
+    c = 1e-11 * (1.5 + np.tanh(x)) + 1e-14 * np.sin(np.arange(n))
+    c[n // 3] = 5e-11
+    return x, c
+
+def saved_curve(n, name="curve.npz"):
+    x, c = curve(n)
+    path = os.path.join(data_folder(), name)
+    os.makedirs(data_folder(), exist_ok=True)
+    STORES["npz"].save(path, PREFIXES, np.column_stack([c, np.zeros(n), x]), {})
+    return path
+
+def test_minmax_keeps_the_extremes_of_every_bucket():
+    y = np.array([3.0, 1.0, 4.0, 1.0, 5.0, 9.0, 2.0, 6.0, 5.0, 3.0])
+    picked = minmax(y, 2)
+    assert picked[0] == 0 and picked[-1] == len(y) - 1
+    assert {1, 5} <= set(picked) and list(picked) == sorted(set(picked))
+    # Too many buckets for the readings keeps them all
+    assert list(minmax(y, 5)) == list(range(len(y)))
+
+def test_lttb_keeps_the_ends_and_the_spike():
+    x, c = curve(10000)
+    picked = lttb(x, c, 200)
+    assert len(picked) == 200 and picked[0] == 0 and picked[-1] == len(x) - 1
+    assert np.all(np.diff(picked) > 0)
+    assert len(x) // 3 in picked
+    assert list(lttb(x[:5], c[:5], 10)) == list(range(5))
+
+def test_pyramid_levels_get_coarser():
+    x, c = curve(100000)
+    pyramid = Pyramid("V", x, c)
+    sizes = [len(level) for level in pyramid.levels]
+    assert sizes[0] == 100000 and len(sizes) > 2
+    assert all(smaller < larger for larger, smaller in zip(sizes, sizes[1:]))
+    assert sizes[-2] >= decimate.MIN_LEVEL_POINTS
+    # Every level still has the first and last reading
+    assert all(level[0] == 0 and level[-1] == len(x) - 1 for level in pyramid.levels)
+
+def test_query_uses_a_coarse_level_for_the_whole_curve_and_a_fine_one_when_zoomed():
+    x, c = curve(100000)
+    pyramid = Pyramid("V", x, c)
+    whole = pyramid.query(100)
+    assert whole["shown"] <= 100 and whole["total"] == 100000 and whole["level"] > 0
+    assert whole["x_range"] == [-5.0, 5.0] and whole["axis"] == "V"
+    zoomed = pyramid.query(100, -0.01, 0.01)
+    assert zoomed["level"] < whole["level"]
+    assert all(-0.01 <= value <= 0.01 for value in zoomed["x"]) and zoomed["shown"] > 0
+    assert pyramid.query(100, 7.0, 8.0)["shown"] == 0
+
+def test_small_curves_are_shown_whole():
+    x, c = curve(50)
+    result = Pyramid("V", x, c).query(2000, method="minmax")
+    assert result["shown"] == 50 and result["level"] == 0 and result["x"] == x.tolist()
+
+def test_plot_data_clamps_points_and_method():
+    path = saved_curve(5000)
+    assert plot_data(path, points=1)["shown"] <= decimate.MIN_POINTS
+    result = plot_data(path, points=10 ** 9, method="nonsense")
+    assert result["method"] == "lttb" and result["shown"] == 5000
+
+def test_pyramid_is_rebuilt_when_the_file_changes():
+    path = saved_curve(3000)
+    first = decimate.file_pyramid(path)
+    assert decimate.file_pyramid(path) is first
+    saved_curve(4000)
+    assert decimate.file_pyramid(path) is not first and plot_data(path)["total"] == 4000
+
+def test_plot_data_route_serves_the_visible_range(client, main):
+    path = saved_curve(20000, "plot_route.npz")
+    main.add_measurement(main.get_user_by_email(main.DEMO_EMAIL)[0], "C-V", path)
+    data = client.get('/plot_data/plot_route.npz?points=50&x0=-1&x1=1&method=minmax').json
+    assert data["shown"] <= 50 and data["method"] == "minmax" and data["total"] == 20000
+    assert all(-1.0 <= value <= 1.0 for value in data["x"])
+    assert main.app.test_client().get('/plot_data/plot_route.npz').status_code == 401
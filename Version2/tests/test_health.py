@@ -0,0 +1,112 @@
+import threading
+import time
+from conftest import LoggingSimulator
+from health import HealthMonitor, PROBE_TIMEOUT
+
+class CountingSimulator(LoggingSimulator):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.queries = []
+        self.probe_timeouts = []
+
+    def query(self, command):
+        self.queries.append(command)
+        self.probe_timeouts.append(self.timeout)
+        return super().query(command)
+
+def simulator():
+    conn = CountingSimulator(time_scale=0, seed=0, verbose=False)
+    conn.connect()
+    conn.io_lock = threading.RLock()
+    return conn
+
+def test_probe_records_a_working_instrument():
+    conn = simulator()
+    monitor = HealthMonitor(conn)
+    monitor.probe()
+    health = monitor.snapshot()
+    assert health["connected"] and not health["busy"] and health["error"] is None
+    assert health["last_seen"] is not None and health["latency_ms"] >= 0
+    # The probe uses a short timeout and puts the old one back
+    assert conn.queries == ["ID?"] and conn.probe_timeouts == [PROBE_TIMEOUT] and conn.timeout == 10000
+
+def test_failed_probe_marks_the_connection_down():
+    conn = simulator()
+    def fail(command):
+        raise OSError("bus error")
+    conn.query = fail
+    monitor = HealthMonitor(conn)
+    monitor.probe()
+    assert not monitor.connected and monitor.error == "bus error"
+    assert conn.connected is False
+
+def test_missing_instrument_is_not_connected():
+    conn = simulator()
+    conn.inst = None
+    monitor = HealthMonitor(conn)
+    monitor.probe()
+    assert not monitor.connected and monitor.error == "No connection to instrument."
+
+def test_probe_never_waits_for_the_bus():
+    conn = simulator()
+    monitor = HealthMonitor(conn)
+    held, release = threading.Event(), threading.Event()
+    def hold():
+        with conn.io_lock:
+            held.set()
+            release.wait(5)
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait(5)
+    started = time.monotonic()
+    monitor.probe()
+    release.set()
+    thread.join()
+    assert time.monotonic() - started < 0.5
+    assert monitor.busy and conn.queries == []
+
+def test_probe_skips_an_instrument_in_use():
+    conn = simulator()
+    in_use = [True]
+    monitor = HealthMonitor(conn, in_use=lambda: in_use[0])
+    monitor.probe()
+    assert monitor.busy and conn.queries == []
+    in_use[0] = False
+    monitor.probe()
+    assert not monitor.busy and conn.queries == ["ID?"]
+
+def test_monitor_probes_until_stopped():
+    conn = simulator()
+    monitor = HealthMonitor(conn, interval=0.01)
+    monitor.start()
+    time.sleep(0.2)
+    monitor.stop()
+    monitor.join(1)
+    assert not monitor.is_alive() and len(conn.queries) >= 3
+
+def test_watching_a_new_connection():
+    old, new = simulator(), simulator()
+    monitor = HealthMonitor(old)
+    monitor.watch(new)
+    monitor.probe()
+    assert old.queries == [] and new.queries == ["ID?"]
+
+def test_status_page_reads_the_cached_health(client, main):
+    status = client.get('/connection_status').json
+    assert status["connected"] and "busy" in status and "holder" in status
+    with client.session_transaction() as session:
+        ctrl = main.gpib_connections[session["email"]]
+    conn = ctrl.conn
+    queries = []  # Made while serving the requests; the monitor's own probes run on its thread
+    query = conn.query
+    def counted(command):
+        if threading.current_thread() is threading.main_thread():
+            queries.append(command)
+        return query(command)
+    conn.query = counted
+    try:
+        for _ in range(3):
+            client.get('/connection_status')
+    finally:
+        del conn.query
+    assert queries == []
@@ -0,0 +1,91 @@
+import re
+import sqlite3
+
+# Base tables as they were before the migrations existed
+OLD_SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, first_name TEXT NOT NULL, last_name TEXT NOT NULL, "
+    "email TEXT NOT NULL UNIQUE, password TEXT NOT NULL, is_admin INTEGER NOT NULL DEFAULT 0)",
+    "CREATE TABLE measurements (measurement_id INTEGER PRIMARY KEY AUTOINCREMENT, date_recorded DATE NOT NULL, "
+    "time_recorded TIME NOT NULL, user_id INTEGER NOT NULL, test_type TEXT NOT NULL, csv_file_path TEXT)",
+    "INSERT INTO users (first_name, last_name, email, password) VALUES ('Old', 'User', 'old@hp4280a.com', 'x')",
+    "INSERT INTO measurements (date_recorded, time_recorded, user_id, test_type, csv_file_path) "
+    "VALUES ('2024-01-01', '09:00:00', 1, 'C-V', 'old.csv')",
+]
+
+def insert(db, user_id, date, clock, test_type="C-V", instrument="GPIB0::17::INSTR"):
+    conn = db.get_db()
+    cursor = conn.execute("INSERT INTO measurements (user_id, test_type, date_recorded, time_recorded, instrument) "
+                          "VALUES (?, ?, ?, ?, ?)", (user_id, test_type, date, clock, instrument))
+    conn.commit()
+    return cursor.lastrowid
+
+def all_pages(db, limit, **filters):
+    pages, before = [], None
+    while True:
+        rows, cursor = db.get_measurements_page(before=before, limit=limit, **filters)
+        pages.append([row[0] for row in rows])
+        if cursor is None:
+            return pages
+        before = db.parse_page_cursor(cursor)
+
+def test_old_database_is_migrated_and_keeps_its_rows(tmp_path, monkeypatch, db):
+    path = str(tmp_path / "old.db")
+    with sqlite3.connect(path) as conn:
+        for statement in OLD_SCHEMA:
+            conn.execute(statement)
+    db.close_db()
+    monkeypatch.setattr(db, "DB_path", path)
+    db.init_db()
+
+    conn = db.get_db()
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(db.MIGRATIONS)
+    assert conn.execute("SELECT csv_file_path, instrument FROM measurements").fetchall() == [("old.csv", None)]
+    indexes = {row[1] for row in conn.execute("SELECT * FROM sqlite_master WHERE type = 'index'")}
+    assert {"idx_measurements_user_date", "idx_measurements_date", "idx_measurements_instrument"} <= indexes
+    # Migrating again changes nothing
+    db.migrate_db(conn)
+    assert conn.execute("SELECT COUNT(*) FROM measurements").fetchone()[0] == 1
+
+def test_pages_are_newest_first_without_gaps_or_repeats(db):
+    ids = [insert(db, 2, "2025-01-0" + str(day), clock) for day in (1, 2, 3) for clock in ("09:00:00", "10:00:00")]
+    ids += [insert(db, 2, "2025-01-03", "10:00:00")]  # Same time as the newest, so the id decides
+    pages = all_pages(db, 3)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert [id for page in pages for id in page] == [ids[6], ids[5], ids[4], ids[3], ids[2], ids[1], ids[0]]
+
+def test_filters_apply_to_every_page(db):
+    insert(db, 1, "2025-01-01", "09:00:00")
+    insert(db, 2, "2025-01-02", "09:00:00", test_type="C-t")
+    insert(db, 2, "2025-01-03", "09:00:00", instrument="GPIB0::18::INSTR")
+    wanted = [insert(db, 2, f"2025-02-0{day}", "09:00:00") for day in range(1, 6)]
+    assert all_pages(db, 2, user_id=2, test_type="C-V", instrument="GPIB0::17::INSTR", date_from="2025-02-01") \
+        == [[wanted[4], wanted[3]], [wanted[2], wanted[1]], [wanted[0]]]
+    assert db.get_test_types(2) == ["C-V", "C-t"]
+    assert db.get_instruments(2) == ["GPIB0::17::INSTR", "GPIB0::18::INSTR"]
+
+def test_rows_carry_the_users_name(db):
+    insert(db, 2, "2025-01-01", "09:00:00")
+    rows, cursor = db.get_measurements_page()
+    assert rows[0][3] == "Demo User" and cursor is None
+
+def test_cursor_round_trip_and_bad_cursors():
+    from database import parse_page_cursor
+    assert parse_page_cursor("2025-01-03|10:00:00|7") == ("2025-01-03", "10:00:00", 7)
+    assert parse_page_cursor(None) is None
+    assert parse_page_cursor("2025-01-03|x") is None
+    assert parse_page_cursor("a|b|c") is None
+
+def test_user_history_uses_the_index(db):
+    plan = db.get_db().execute(
+        "EXPLAIN QUERY PLAN SELECT measurement_id FROM measurements WHERE user_id = ? "
+        "ORDER BY date_recorded DESC, time_recorded DESC", (2,)).fetchall()
+    assert "idx_measurements_user_date" in " ".join(row[-1] for row in plan)
+
+def test_history_page_links_to_the_older_rows(main, client):
+    user = main.get_user_by_email(main.DEMO_EMAIL)
+    for name in ("first.csv", "second.csv"):
+        main.add_measurement(user[0], "History test", name)
+    page = client.get('/history?limit=1&test_type=History+test').get_data(as_text=True)
+    older = re.search(r'href="([^"]*before=[^"]*)"', page).group(1).replace("&amp;", "&")
+    assert client.get(older).status_code == 200
+    assert client.get('/history?limit=1&before=not-a-cursor').status_code == 200
@@ -0,0 +1,179 @@
+import threading
+import time
+import pytest
+from instruments import FairLock, Instrument, InstrumentBusy, InstrumentRegistry
+from simulated_visacon import SimulatedVisaCon
+
+def fast_simulator(addr):
+    return SimulatedVisaCon(addr, time_scale=0, seed=0, verbose=False)
+
+# Starts a thread that takes the lock and waits until it stands in the queue
+def queue_for(lock, order, name, timeout=-1):
+    waiting = lock.queue_length()
+    def run():
+        if lock.acquire(timeout=timeout, label=name):
+            order.append(name)
+            lock.release()
+        else:
+            order.append(f"{name} gave up")
+    thread = threading.Thread(target=run)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while lock.queue_length() == waiting and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return thread
+
+def test_waiting_threads_get_the_lock_in_order():
+    lock = FairLock()
+    order = []
+    lock.acquire(label="first")
+    threads = [queue_for(lock, order, name) for name in ("a", "b", "c")]
+    assert lock.queue_length() == 3 and lock.holder == "first"
+    lock.release()
+    for thread in threads:
+        thread.join(5)
+    assert order == ["a", "b", "c"]
+    assert lock.owner is None and lock.holder is None and lock.queue_length() == 0
+
+def test_lock_is_reentrant():
+    lock = FairLock()
+    with lock:
+        with lock:
+            assert lock.depth == 2
+        assert lock.owner == threading.get_ident()
+    assert lock.owner is None
+
+def test_lock_cannot_be_released_by_another_thread():
+    lock = FairLock()
+    lock.acquire()
+    errors = []
+    def release():
+        try:
+            lock.release()
+        except RuntimeError as e:
+            errors.append(e)
+    thread = threading.Thread(target=release)
+    thread.start()
+    thread.join(5)
+    assert errors and lock.owner == threading.get_ident()
+    lock.release()
+
+def test_timed_out_waiter_lets_the_next_one_move_up():
+    lock = FairLock()
+    order = []
+    lock.acquire()
+    impatient = queue_for(lock, order, "impatient", timeout=0.05)
+    patient = queue_for(lock, order, "patient")
+    impatient.join(5)
+    assert order == ["impatient gave up"]
+    lock.release()
+    patient.join(5)
+    assert order == ["impatient gave up", "patient"]
+
+def test_newcomer_does_not_jump_the_queue():
+    lock = FairLock()
+    done = threading.Event()
+    def wait():
+        with lock:
+            done.wait(5)
+    lock.acquire()
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    while lock.queue_length() == 0:
+        time.sleep(0.001)
+    lock.release()
+    # Whether the waiter has woken up yet or not, the lock is not free for anyone else
+    assert lock.acquire(blocking=False) is False
+    done.set()
+    waiter.join(5)
+    assert lock.acquire(blocking=False) is True
+    lock.release()
+
+# Holds the lease of an instrument from another thread until released
+def hold_lease(instrument, **kwargs):
+    held, done = threading.Event(), threading.Event()
+    def run():
+        with instrument.lease(**kwargs):
+            held.set()
+            done.wait(5)
+    thread = threading.Thread(target=run)
+    thread.start()
+    assert held.wait(5)
+    return thread, done
+
+def test_page_gives_up_at_once_while_a_job_holds_the_lease():
+    instrument = Instrument("GPIB0::1::INSTR", "GPIB0::1::INSTR", False)
+    thread, done = hold_lease(instrument, owner="user@example.com", job=object())
+    start = time.monotonic()
+    with pytest.raises(InstrumentBusy, match="user@example.com"):
+        with instrument.lease("other@example.com", timeout=10):
+            pass
+    assert time.monotonic() - start < 1
+    done.set()
+    thread.join(5)
+    assert instrument.job is None and instrument.lock.owner is None
+
+def test_page_waits_for_another_request_up_to_its_timeout():
+    instrument = Instrument("GPIB0::1::INSTR", "GPIB0::1::INSTR", False)
+    thread, done = hold_lease(instrument, owner="user@example.com")
+    with pytest.raises(InstrumentBusy):
+        with instrument.lease("other@example.com", timeout=0.05):
+            pass
+    done.set()
+    thread.join(5)
+    with instrument.lease("other@example.com", timeout=0.05):
+        assert instrument.lock.holder == "other@example.com"
+
+def test_job_can_lease_its_own_instrument_again():
+    instrument = Instrument("GPIB0::1::INSTR", "GPIB0::1::INSTR", False)
+    job = object()
+    with instrument.lease("user@example.com", job=job):
+        with instrument.lease("user@example.com", timeout=0):
+            assert instrument.job is job
+    assert instrument.job is None
+
+def test_registry_opens_each_address_once():
+    registry = InstrumentRegistry(None, fast_simulator)
+    first = registry.get("GPIB0::17::INSTR", simulated=True)
+    second = registry.get("GPIB0::17::INSTR", simulated=True)
+    assert first is second and first.key == "SIM::GPIB0::17::INSTR"
+    assert first.conn.check_connection() and first.conn.io_lock is first.bus
+    assert registry.find("GPIB0::17::INSTR", simulated=True) is first
+    assert registry.find("GPIB0::17::INSTR") is None
+    assert registry.get("GPIB0::18::INSTR", simulated=True) is not first
+
+def test_registry_reopens_a_dropped_session_and_forgets_the_settings(ctrl):
+    registry = InstrumentRegistry(None, fast_simulator)
+    instrument = registry.get("GPIB0::17::INSTR", simulated=True)
+    ctrl.conn = instrument.conn
+    instrument.controller = ctrl
+    ctrl.state = {"PS": 1.0}
+    instrument.conn.disconnect()
+    assert registry.get("GPIB0::17::INSTR", simulated=True) is instrument
+    assert instrument.conn.check_connection() and ctrl.state == {}
+    assert registry.for_controller(ctrl) is instrument
+
+def test_reconnect_clears_the_settings(ctrl):
+    registry = InstrumentRegistry(None, fast_simulator)
+    instrument = registry.get("GPIB0::17::INSTR", simulated=True)
+    ctrl.conn = instrument.conn
+    instrument.controller = ctrl
+    ctrl.state = {"PS": 1.0}
+    assert registry.reconnect(instrument.key) is instrument
+    assert instrument.conn.check_connection() and ctrl.state == {}
+    assert registry.reconnect("GPIB0::99::INSTR") is None
+
+def test_page_reports_busy_while_another_users_job_holds_the_instrument(main, client, other_client):
+    with client.session_transaction() as session:
+        ctrl = main.gpib_connections[session["email"]]
+    with other_client.session_transaction() as session:
+        assert main.gpib_connections[session["email"]] is ctrl
+    instrument = main.instruments.for_controller(ctrl)
+    thread, done = hold_lease(instrument, owner=main.DEMO_EMAIL, job=object())
+    try:
+        response = other_client.post("/configuration", data={"action": "set_sig_level", "sig_level": "30"},
+                                     follow_redirects=True)
+    finally:
+        done.set()
+        thread.join(5)
+    assert b"is busy with" in response.data
@@ -0,0 +1,104 @@
+import os
+import threading
+from conftest import wait_for_job
+from data_save import data_folder
+from jobs import JobManager
+
+KEY = "GPIB0::17::INSTR"
+
+# Job function that runs until released, so the jobs behind it stay queued
+def blocking(started, release):
+    def run(job):
+        started.set()
+        release.wait(5)
+        return "done" if not job.cancelled() else None
+    return run
+
+def wait_until_finished(job):
+    with job.updated:
+        job.updated.wait_for(job.finished_running, timeout=5)
+    return job
+
+def test_jobs_on_one_instrument_run_in_order():
+    manager = JobManager()
+    order = []
+    jobs = [manager.submit(KEY, "demo", f"sweep {n}", lambda job, n=n: order.append(n) or n) for n in range(3)]
+    for job in jobs:
+        wait_until_finished(job)
+    assert order == [0, 1, 2]
+    assert [job.status for job in jobs] == ["done"] * 3
+    assert [job.result for job in jobs] == [0, 1, 2]
+    assert all(job.progress == 1.0 and job.finished >= job.started for job in jobs)
+
+def test_cancelled_queued_job_is_finished_at_once_and_never_runs():
+    manager = JobManager()
+    started, release = threading.Event(), threading.Event()
+    first = manager.submit(KEY, "demo", "sweep", blocking(started, release))
+    ran = []
+    queued = manager.submit(KEY, "demo", "sweep", ran.append)
+    assert started.wait(5)
+
+    manager.cancel(queued.id)
+    assert queued.status == "cancelled" and queued.finished is not None
+    assert queued.to_dict()["finished"] == queued.finished
+
+    release.set()
+    wait_until_finished(first)
+    assert first.status == "done"
+    # The worker skips the cancelled job and goes on with the next one
+    wait_until_finished(manager.submit(KEY, "demo", "sweep", lambda job: None))
+    assert ran == [] and queued.status == "cancelled" and queued.started is None
+
+def test_cancelled_running_job_ends_cancelled():
+    manager = JobManager()
+    started, release = threading.Event(), threading.Event()
+    job = manager.submit(KEY, "demo", "sweep", blocking(started, release))
+    assert started.wait(5)
+    manager.cancel(job.id)
+    assert job.status == "running" and job.finished is None
+    release.set()
+    wait_until_finished(job)
+    assert job.status == "cancelled" and job.result is None and job.finished is not None
+
+def test_failed_job_keeps_the_error():
+    manager = JobManager()
+    def fail(job):
+        raise Exception("Measurement failed. No data received.")
+    job = wait_until_finished(manager.submit(KEY, "demo", "sweep", fail))
+    assert (job.status, job.error) == ("failed", "Measurement failed. No data received.")
+
+def test_instruments_have_their_own_queue():
+    manager = JobManager()
+    started, release = threading.Event(), threading.Event()
+    manager.submit(KEY, "demo", "sweep", blocking(started, release))
+    other = wait_until_finished(manager.submit("GPIB0::18::INSTR", "demo", "sweep", lambda job: "other"))
+    assert other.result == "other" and manager.busy(KEY)
+    release.set()
+
+def test_only_the_newest_finished_jobs_are_kept():
+    manager = JobManager(keep=2)
+    jobs = [wait_until_finished(manager.submit(KEY, "demo", "sweep", lambda job: None)) for _ in range(4)]
+    manager.submit(KEY, "demo", "sweep", lambda job: None)
+    assert manager.get(jobs[0].id) is None and manager.get(jobs[3].id) is jobs[3]
+    assert [job.owner for job in manager.jobs_for("demo")] == ["demo"] * len(manager.jobs)
+
+def test_sweep_job_records_its_file_in_the_data_folder(client, user_profile):
+    client.post('/parameter', data={"action": "start_measurement", "sweep_type": "voltage"})
+    job = max(client.get('/jobs').json, key=lambda job: job["id"])
+    assert wait_for_job(client, job["id"])["status"] == "done"
+    result = client.get(f'/jobs/{job["id"]}/result').json
+    assert os.path.dirname(result["csv_file_path"]) == data_folder()
+    assert data_folder().startswith(str(user_profile)) and os.path.isfile(result["csv_file_path"])
+
+def test_cancelled_queued_sweep_reports_when_it_finished(client, main):
+    with client.session_transaction() as session:
+        ctrl = main.gpib_connections[session["email"]]
+    instrument = main.instruments.for_controller(ctrl)
+    with instrument.lease("test"):  # Keeps the first sweep waiting for the instrument
+        client.post('/parameter', data={"action": "start_measurement", "sweep_type": "voltage"})
+        client.post('/parameter', data={"action": "start_measurement", "sweep_type": "voltage"})
+        running, queued = sorted(client.get('/jobs').json, key=lambda job: job["id"])[-2:]
+        client.post(f'/jobs/{queued["id"]}/cancel')
+        status = client.get(f'/jobs/{queued["id"]}').json
+        assert status["status"] == "cancelled" and status["finished"] is not None
+    assert wait_for_job(client, running["id"])["status"] == "done"
@@ -0,0 +1,47 @@
+import json
+import threading
+from conftest import wait_for_job
+from jobs import Job
+
+def stream_events(response):
+    events = []
+    for block in response.get_data(as_text=True).split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if "data" in lines:
+            events.append((lines.get("event", "message"), json.loads(lines["data"])))
+    return events
+
+def test_every_reading_is_published_as_it_is_read(ctrl):
+    job = Job(1, "GPIB0::17::INSTR", "demo", "C-V", None)
+    ctrl.apply_settings({"Start_V": -1.0, "Stop_V": 1.0, "Step_V": 0.5, "Hold_T": 0.0, "Step_T": 0.0})
+    assert ctrl.sweep_measure(job)
+    assert [point["x"] for point in job.points] == [-1.0, -0.5, 0.0, 0.5, 1.0]
+    assert all(point["axis"] == "V" and point["c"] > 0 for point in job.points)
+
+def test_waiting_for_points_returns_only_new_ones():
+    job = Job(1, "GPIB0::17::INSTR", "demo", "C-V", None)
+    job.publish({"x": 0.0})
+    assert job.wait_for_points(0) == [{"x": 0.0}]
+    threading.Timer(0.05, job.publish, [{"x": 1.0}]).start()
+    assert job.wait_for_points(1, timeout=5) == [{"x": 1.0}]
+    job.status = "done"
+    assert job.wait_for_points(2, timeout=5) == []
+
+def test_stream_sends_the_points_then_the_finished_job(client):
+    client.post('/parameter', data={"action": "start_measurement", "sweep_type": "voltage"})
+    job = max(client.get('/jobs').json, key=lambda job: job["id"])
+    response = client.get(f'/jobs/{job["id"]}/stream')
+    assert response.mimetype == "text/event-stream"
+    events = stream_events(response)
+    points = [point for kind, data in events if kind == "message" for point in data]
+    kind, finished = events[-1]
+    assert kind == "done" and finished["status"] == "done"
+    # The session's default sweep, -5 V to 5 V in 0.5 V steps
+    assert len(points) == 21 and points[0]["x"] == -5.0 and points[-1]["x"] == 5.0
+
+def test_only_the_owner_and_admins_see_a_job(client, other_client, admin_client):
+    client.post('/parameter', data={"action": "start_measurement", "sweep_type": "voltage"})
+    job = max(client.get('/jobs').json, key=lambda job: job["id"])
+    wait_for_job(client, job["id"])
+    assert other_client.get(f'/jobs/{job["id"]}/stream').status_code == 404
+    assert admin_client.get(f'/jobs/{job["id"]}/stream').status_code == 200
@@ -0,0 +1,68 @@
+import os
+from conftest import wait_for_job
+
+# Opens both simulated stations up front so their sweeps run without the simulated delays
+def stations(main):
+    opened = [main.open_instrument(addr, True) for addr in main.SIMULATED_STATIONS]
+    for instrument in opened:
+        instrument.conn.time_scale = 0
+    return opened
+
+def new_jobs(client, before):
+    return sorted((job for job in client.get('/jobs').json if job["id"] not in before), key=lambda job: job["id"])
+
+def test_instruments_page_lists_the_demo_stations(client, main):
+    page = client.get('/instruments').data.decode()
+    assert all(addr in page for addr in main.SIMULATED_STATIONS)
+
+def test_selecting_an_instrument_moves_the_session_to_it(client, main):
+    first, second = stations(main)
+    client.post('/instruments', data={"select": second.addr})
+    with client.session_transaction() as session:
+        assert session["instrument"] == second.addr
+        assert main.gpib_connections[session["email"]] is second.controller
+        email = session["email"]
+    assert email in second.users and email not in first.users
+    client.post('/instruments', data={"select": first.addr})
+    assert email in first.users and email not in second.users
+
+def test_unknown_instrument_is_not_selected(client):
+    response = client.post('/instruments', data={"select": "GPIB0::5::INSTR"}, follow_redirects=True)
+    assert b"Unknown instrument selected." in response.data
+    with client.session_transaction() as session:
+        assert session.get("instrument") != "GPIB0::5::INSTR"
+
+def test_sweeps_start_on_every_selected_instrument(client, main):
+    opened = stations(main)
+    client.get('/instruments')
+    with client.session_transaction() as session:
+        session["settings"] = dict(session["settings"], Start_V=-2.0, Stop_V=2.0)
+    before = {job["id"] for job in client.get('/jobs').json}
+    response = client.post('/instruments', data={"action": "start_sweeps", "sweep_type": "voltage",
+                                                 "instruments": main.SIMULATED_STATIONS}, follow_redirects=True)
+    assert b"Started jobs" in response.data
+
+    started = new_jobs(client, before)
+    assert sorted(job["instrument"] for job in started) == sorted(instrument.key for instrument in opened)
+    results = []
+    for job in started:
+        assert wait_for_job(client, job["id"])["status"] == "done"
+        results.append(client.get(f'/jobs/{job["id"]}/result').json)
+
+    # Each result is tagged with its instrument and has a file of its own
+    assert sorted(result["instrument"] for result in results) == sorted(main.SIMULATED_STATIONS)
+    paths = [result["csv_file_path"] for result in results]
+    assert len(set(paths)) == 2 and all(os.path.isfile(path) for path in paths)
+    # Every instrument got the session's settings before its sweep
+    for instrument in opened:
+        assert instrument.controller.state["PS"] == -2.0 and instrument.controller.state["PP"] == 2.0
+
+def test_sweeps_are_not_started_on_unknown_addresses(client, main):
+    before = {job["id"] for job in client.get('/jobs').json}
+    response = client.post('/instruments', data={"action": "start_sweeps", "instruments": ["GPIB0::5::INSTR"]},
+                           follow_redirects=True)
+    assert b"Started jobs" not in response.data and new_jobs(client, before) == []
+
+def test_no_selected_instruments_is_reported(client):
+    response = client.post('/instruments', data={"action": "start_sweeps"}, follow_redirects=True)
+    assert b"No instruments selected." in response.data
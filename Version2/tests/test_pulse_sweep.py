@@ -0,0 +1,61 @@
+import os
+import threading
+from sweep_data import to_columns
+
+def test_schedule_steps_up_to_the_stop_voltage(ctrl):
+    ctrl.Step_V, ctrl.Stop_V = 0.5, 2.0
+    assert ctrl.pulse_schedule() == [(0.5, 0.5), (1.0, 1.0), (1.5, 1.5), (2.0, 2.0)]
+
+def test_schedule_keeps_a_last_step_lost_to_rounding(ctrl):
+    # 3 * 0.1 is 0.30000000000000004 in floating point
+    ctrl.Step_V, ctrl.Stop_V = 0.1, 0.3
+    assert ctrl.pulse_schedule() == [(0.1, 0.1), (0.2, 0.2), (0.3, 0.3)]
+
+def test_schedule_stops_before_a_partial_step(ctrl):
+    ctrl.Step_V, ctrl.Stop_V = 0.4, 1.0
+    assert [stop for stop, _ in ctrl.pulse_schedule()] == [0.4, 0.8]
+
+def test_no_schedule_without_a_positive_step(ctrl):
+    ctrl.Step_V, ctrl.Stop_V = 0.0, 2.0
+    assert ctrl.pulse_schedule() == []
+    ctrl.Step_V = -0.5
+    assert ctrl.pulse_schedule() == []
+
+def test_every_pulse_is_one_program_string_with_only_what_changed(ctrl, conn):
+    ctrl.Step_V, ctrl.Stop_V = 0.5, 1.5
+    ctrl.pulse_sweep()
+    pulses = [command for command in conn.sent() if command.endswith("BD")]
+    assert pulses == [
+        "PS 0;PP 0.5;PE 0.5;SW1;BL1;BD",
+        "SW0;PP 1.0;PE 1.0;SW1;BL1;BD",
+        "SW0;PP 1.5;PE 1.5;SW1;BL1;BD",
+    ]
+    assert conn.sent()[-1] == "SW0"
+
+def test_pulse_readings_are_saved_once_at_the_end(ctrl, conn, user_profile):
+    ctrl.Step_V, ctrl.Stop_V = 0.5, 1.5
+    filename = ctrl.pulse_sweep()
+    path = os.path.join(user_profile, "Documents", "HPData", filename)
+    with open(path, newline='') as file:
+        prefixes, values = to_columns(file.read())
+    # Every pulse sweeps 0 V and its stop voltage
+    assert prefixes == ["NCM", "NGM", "V"]
+    assert values[:, 2].tolist() == [0.0, 0.5, 0.0, 1.0, 0.0, 1.5]
+
+def test_cancelled_pulse_sweep_keeps_what_was_read(ctrl, user_profile):
+    class Job:
+        def __init__(self):
+            self.pulses = 0
+            self.cancel_event = threading.Event()
+        def cancelled(self):
+            return self.pulses >= 2
+        def set_progress(self, fraction, message=None):
+            self.pulses += 1
+        def publish(self, point):
+            pass
+
+    ctrl.Step_V, ctrl.Stop_V = 0.5, 2.0
+    filename = ctrl.pulse_sweep(Job())
+    with open(os.path.join(user_profile, "Documents", "HPData", filename), newline='') as file:
+        _, values = to_columns(file.read())
+    assert len(values) == 4
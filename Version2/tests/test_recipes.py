@@ -0,0 +1,122 @@
+import pytest
+import recipes
+from async_visacon import CancelToken
+from conftest import OTHER_EMAIL, wait_for_job
+
+VOLTAGE = {"DC_V": 0.0, "Start_V": -1.0, "Stop_V": 1.0, "Step_V": 0.5, "Hold_T": 0.0, "Step_T": 0.05}
+TIME = {"Pulse": 0.0, "Meas": 0.0, "Nofread": 5.0, "Pulse_Width": 1.0, "Meas_Interval": 0.15}
+
+def step(position, function="c", settings=VOLTAGE, repeat_count=1, delay=0.0, bias="single", meas_range="auto"):
+    return {"step_id": position, "position": position, "function": function, "bias": bias, "meas_range": meas_range,
+            "settings": dict(settings), "repeat_count": repeat_count, "delay": delay}
+
+# Records every run and hands out measurement IDs in order
+class Recorder:
+    def __init__(self):
+        self.runs = []
+
+    def __call__(self, step, repeat, filename):
+        self.runs.append((step["position"], repeat, filename))
+        return len(self.runs)
+
+def test_steps_are_described_for_the_recipe_page():
+    assert recipes.describe_step(step(1, bias="double")) == "C, Auto range, double sweep -1 to 1 V in 0.5 V steps"
+    assert recipes.describe_step(step(2, "ct", TIME, meas_range="10nf")) == "C-t, 10nF/10mS range, 5 readings every 0.15 s"
+
+def test_settings_a_step_needs_depend_on_its_function():
+    assert recipes.step_settings_names("cg") == recipes.VOLTAGE_SETTINGS
+    assert recipes.step_settings_names("gt") == recipes.TIME_SETTINGS
+    assert recipes.step_sweep_type(step(1, "cgt", TIME)) == "time"
+
+def test_recipe_is_checked_before_it_runs(ctrl):
+    assert recipes.check_recipe([]) == ["The recipe has no steps."]
+    problems = recipes.check_recipe([step(1), step(2, settings=dict(VOLTAGE, Step_V=0.0))])
+    assert problems and all(problem.startswith("Step 2: ") for problem in problems)
+    with pytest.raises(Exception, match="no steps"):
+        recipes.run_recipe(ctrl, CancelToken(), [], Recorder())
+
+def test_every_run_is_recorded_and_unchanged_settings_are_not_sent_again(ctrl, conn):
+    record = Recorder()
+    ids = recipes.run_recipe(ctrl, CancelToken(), [step(1, repeat_count=2), step(2, settings=dict(VOLTAGE, Stop_V=2.0))], record)
+    assert ids == [1, 2, 3]
+    assert [run[:2] for run in record.runs] == [(1, 0), (1, 1), (2, 0)]
+    programs = [command for command in conn.sent() if command.startswith("FN")]
+    # The first run sends the whole configuration, the repeat nothing, the next step only what changed
+    assert programs[0].startswith("FN2;RA1;IB2;") and "PS -1.0" in programs[0]
+    assert "PP 2.0" in conn.sent() and len(programs) == 1
+
+def test_time_step_uses_pulse_bias(ctrl, conn):
+    recipes.run_recipe(ctrl, CancelToken(), [step(1, "ct", TIME)], Recorder())
+    program = conn.sent()[0]
+    assert program.startswith("FN5;RA1;" + recipes.TIME_BIAS) and "IB2" not in program
+
+def test_instrument_is_held_for_every_run_but_not_during_delays(ctrl, monkeypatch):
+    held = []
+    class Hold:
+        def __enter__(self):
+            held.append("enter")
+        def __exit__(self, *exc):
+            held.append("exit")
+    pauses = []
+    monkeypatch.setattr(ctrl, "pause", lambda job, seconds: pauses.append((held[:], seconds)) or False)
+    recipes.run_recipe(ctrl, CancelToken(), [step(1, repeat_count=2, delay=3.0)], Recorder(), hold=Hold)
+    assert held == ["enter", "exit", "enter", "exit"]
+    # Only the second run waits, and the instrument is free while it does
+    assert pauses == [(["enter", "exit"], 3.0)]
+
+def test_cancelled_recipe_stops_between_runs(ctrl):
+    job = CancelToken()
+    record = Recorder()
+    def cancel_after_first(step, repeat, filename):
+        job.cancel()
+        return record(step, repeat, filename)
+    assert recipes.run_recipe(ctrl, job, [step(1, repeat_count=3)], cancel_after_first) == [1]
+
+def test_cancelled_delay_ends_the_recipe(ctrl, monkeypatch):
+    monkeypatch.setattr(ctrl, "pause", lambda job, seconds: True)
+    assert recipes.run_recipe(ctrl, CancelToken(), [step(1), step(2, delay=60.0)], Recorder()) == [1]
+
+def recipe_ids(main, email):
+    return [recipe_id for recipe_id, name in main.get_recipes(main.get_user_by_email(email)[0])]
+
+def test_recipe_is_built_and_run_from_the_page(client, main):
+    client.get('/recipes')
+    client.post('/recipes', data={"action": "create", "name": "Test recipe"})
+    recipe_id = max(recipe_ids(main, main.DEMO_EMAIL))
+    response = client.post('/recipes', data={"action": "add_step", "recipe_id": recipe_id, "function": "c",
+                                             "Start_V": "-1", "Stop_V": "1", "Step_V": "0.5", "Hold_T": "0",
+                                             "Step_T": "0.05", "repeat_count": "2"}, follow_redirects=True)
+    assert b"Step added." in response.data
+    steps = main.get_recipe_steps(recipe_id)
+    assert len(steps) == 1 and steps[0]["repeat_count"] == 2 and steps[0]["settings"]["Stop_V"] == 1.0
+    # Values left empty come from the session settings
+    assert steps[0]["settings"]["DC_V"] == 5.0
+
+    client.post('/recipes', data={"action": "run", "recipe_id": recipe_id})
+    job = max(client.get('/jobs').json, key=lambda job: job["id"])
+    assert job["description"] == "Recipe Test recipe"
+    assert wait_for_job(client, job["id"])["status"] == "done"
+    assert len(client.get(f'/jobs/{job["id"]}/result').json["measurement_ids"]) == 2
+
+    client.post('/recipes', data={"action": "delete_step", "recipe_id": recipe_id, "step_id": steps[0]["step_id"]})
+    assert main.get_recipe_steps(recipe_id) == []
+    client.post('/recipes', data={"action": "delete", "recipe_id": recipe_id})
+    assert main.get_recipe(recipe_id) is None
+
+def test_step_with_impossible_settings_is_not_added(client, main):
+    client.get('/recipes')
+    client.post('/recipes', data={"action": "create", "name": "Bad steps"})
+    recipe_id = max(recipe_ids(main, main.DEMO_EMAIL))
+    client.post('/recipes', data={"action": "add_step", "recipe_id": recipe_id, "function": "c", "Step_V": "0"})
+    client.post('/recipes', data={"action": "add_step", "recipe_id": recipe_id, "function": "xx"})
+    assert main.get_recipe_steps(recipe_id) == []
+    response = client.post('/recipes', data={"action": "run", "recipe_id": recipe_id}, follow_redirects=True)
+    assert b"The recipe has no steps." in response.data
+
+def test_recipes_of_other_users_cannot_be_changed(client, other_client, main):
+    other_client.get('/recipes')
+    other_client.post('/recipes', data={"action": "create", "name": "Private"})
+    recipe_id = max(recipe_ids(main, OTHER_EMAIL))
+    client.get('/recipes')
+    response = client.post('/recipes', data={"action": "delete", "recipe_id": recipe_id}, follow_redirects=True)
+    assert b"Recipe not found." in response.data and main.get_recipe(recipe_id) is not None
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+import simulated_visacon
+from simulated_visacon import MosCapacitor, SimulatedVisaCon, OVERFLOW_VALUE, READING_TIME
+
+def simulator(**kwargs):
+    conn = SimulatedVisaCon(**dict(dict(time_scale=0, seed=0, noise=0.0, verbose=False), **kwargs))
+    conn.connect()
+    return conn
+
+def rows(text):
+    return [line.split(",") for line in text.split("\r\n")]
+
+def test_cv_curve_runs_from_the_oxide_capacitance_to_the_minimum():
+    device = MosCapacitor()
+    c = device.capacitance(np.array([-5.0, device.flat_band, 5.0]))
+    assert c[0] == pytest.approx(device.cox, rel=0.01)
+    assert device.cmin < c[1] < device.cox
+    assert c[2] == pytest.approx(device.cmin)
+    # An n substrate turns the curve around
+    n = MosCapacitor(substrate="n", flat_band=0.0)
+    assert n.capacitance(5.0) == pytest.approx(n.cox, rel=0.01) and n.capacitance(-5.0) == pytest.approx(n.cmin)
+
+def test_deep_depletion_recovers_to_inversion():
+    device = MosCapacitor(generation_time=2.0)
+    c = device.recovery([0.0, 2.0, 100.0], 5.0)
+    assert c[0] == pytest.approx(device.capacitance(5.0, deep=True)) and c[0] < device.cmin
+    assert c[2] == pytest.approx(device.cmin)
+    assert (c[1] - c[2]) / (c[0] - c[2]) == pytest.approx(np.exp(-1))
+
+def test_sweep_block_follows_the_programmed_voltages():
+    conn = simulator()
+    conn.write("FN2;PS -1;PP 1;PE 0.5;SW1")
+    voltages = [float(row[2][1:]) for row in rows(conn.read())]
+    assert voltages == [-1.0, -0.5, 0.0, 0.5, 1.0]
+    # The block is read once; another read is a spot reading at the DC bias
+    assert len(rows(conn.read())) == 1
+
+def test_downward_and_double_sweeps():
+    conn = simulator()
+    conn.write("PS 1;PP -1;PE 0.5;IB3;SW1")
+    voltages = [float(row[2][1:]) for row in rows(conn.read())]
+    assert voltages == [1.0, 0.5, 0.0, -0.5, -1.0, -0.5, 0.0, 0.5, 1.0]
+
+def test_double_sweep_shows_hysteresis(monkeypatch):
+    monkeypatch.setattr(simulated_visacon, "NOISE_FLOOR", 0.0)
+    conn = simulator(device=MosCapacitor(hysteresis=0.2))
+    conn.write("PS -3;PP 3;PE 0.1;IB3;SW1")
+    c = np.array([float(row[0][3:]) for row in rows(conn.read())])
+    up, down = c[:61], c[60:][::-1]
+    # Going up the curve is shifted to higher voltages, so it stays in accumulation longer
+    assert np.all(up >= down) and np.max(up - down) > 0.05 * conn.device.cox
+
+def test_time_function_returns_the_recovery():
+    conn = simulator()
+    conn.write("FN5;PM 5;PN 4;PT 0.5;SW1")
+    block = rows(conn.read())
+    assert [float(row[1][1:]) for row in block] == [0.0, 0.5, 1.0, 1.5]
+    c = [float(row[0][3:]) for row in block]
+    assert c == sorted(c)  # Capacitance rises while the inversion layer forms
+
+def test_time_interval_is_at_least_the_reading_time():
+    conn = simulator()
+    conn.write("FN5;MS3;PN 3;PT 0.01;SW1")
+    assert [float(row[1][1:]) for row in rows(conn.read())] == [0.0, READING_TIME["3"], 2 * READING_TIME["3"]]
+
+def test_sweep_takes_its_programmed_time():
+    conn = simulator()
+    conn.time_scale = 1e-6  # Keeps the duration, but the test does not wait for it
+    conn.write("PS 0;PP 1;PE 0.1;PD 0.05;PL 0.2;MS1;SW1")
+    assert conn.sweep.duration == pytest.approx((0.2 + 11 * (0.05 + READING_TIME["1"])) * 1e-6)
+
+def test_status_byte_reports_the_data_when_the_sweep_has_finished():
+    conn = simulator(time_scale=1.0)
+    conn.write("PS 0;PP 1;PE 0.5;PD 0.05;SW1")
+    assert conn.read_stb() == 0x00
+    conn.execute("SW0")
+    assert conn.read_stb() == 0x01
+    # Stopping early keeps only the readings taken so far
+    assert conn.sweep.readings.shape[0] < 3
+
+def test_slow_sweep_times_out_like_the_instrument():
+    conn = simulator(time_scale=1.0, timeout=10)
+    conn.write("PS 0;PP 5;PE 0.1;SW1")
+    with pytest.raises(type(simulated_visacon.visa_timeout())):
+        conn.read()
+
+def test_manual_range_overflows():
+    conn = simulator()
+    conn.write("RM1;PS -5;PP -5;SW1")
+    row = rows(conn.read())[0]
+    assert row[0].startswith("OCM") and float(row[0][3:]) == OVERFLOW_VALUE
+    conn.write("RA1;SW1")
+    assert rows(conn.read())[0][0].startswith("NCM")
+
+def test_settings_are_queried_back():
+    conn = simulator()
+    conn.write("PS -2.5;FN5")
+    assert conn.query("PS?") == "-2.5"
+    assert conn.settings["FN"] == "5" and conn.commands == 2
+    assert conn.query("ID?") == "HP4280A"
@@ -0,0 +1,67 @@
+import os
+import subprocess
+import sys
+import threading
+import pytest
+from visacon import VisaCon
+
+APP_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class FakeResourceManager:
+    def __init__(self):
+        self.opened = []
+
+    def open_resource(self, addr):
+        self.opened.append(addr)
+        return FakeResource()
+
+class FakeResource:
+    timeout = None
+    query_delay = None
+
+    def query(self, command):
+        return "HP4280A"
+
+def test_visacon_connects_when_created():
+    pytest.importorskip("pyvisa")
+    rm = FakeResourceManager()
+    conn = VisaCon("GPIB0::17::INSTR", rm=rm)
+    assert conn.connected and rm.opened == ["GPIB0::17::INSTR"]
+    assert conn.inst.timeout == 10000
+
+def test_visacon_can_wait_to_connect():
+    rm = FakeResourceManager()
+    conn = VisaCon("GPIB0::17::INSTR", rm=rm, connect=False)
+    assert not conn.connected and conn.inst is None and rm.opened == []
+
+# Modules a fresh interpreter has loaded after importing the app (other tests may have imported them here)
+def imported_by_main(tmp_path, names):
+    script = ("import sys, database; database.DB_path = sys.argv[1]; import main; "
+              f"print('loaded:' + ','.join(name for name in {names!r} if name in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", script, str(tmp_path / "database.db")], cwd=APP_FOLDER,
+                            env=dict(os.environ, USERPROFILE=str(tmp_path)), capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    loaded = result.stdout.strip().splitlines()[-1].removeprefix("loaded:")
+    return [name for name in loaded.split(",") if name]
+
+def test_importing_the_app_skips_the_slow_packages(tmp_path):
+    imported_by_main(tmp_path, ())  # The first start creates the database, hashing the admin password
+    assert imported_by_main(tmp_path, ("pyvisa", "webview", "bcrypt", "pytz")) == []
+
+def test_login_does_not_wait_for_the_instrument(main, monkeypatch):
+    opened = threading.Event()
+    connect_session = main.connect_session
+    def slow_connect(session_id, addr, simulated):
+        opened.wait(5)
+        connect_session(session_id, addr, simulated)
+    monkeypatch.setattr(main, "connect_session", slow_connect)
+    monkeypatch.setattr(main, "uses_simulator", lambda user: True)
+    main.gpib_connections.pop("admin@hp4280a.com", None)
+    main.pending_connections.pop("admin@hp4280a.com", None)
+
+    client = main.app.test_client()
+    assert client.post('/login', data={'email': "admin@hp4280a.com", 'password': "Welcome1"}).status_code == 302
+    assert client.get('/connection_status').json == {"connected": False, "pending": True}
+    opened.set()
+    main.pending_connections["admin@hp4280a.com"].result(5)
+    assert client.get('/connection_status').json.get("pending") is None
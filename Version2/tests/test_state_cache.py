@@ -0,0 +1,55 @@
+import pytest
+
+def test_settings_are_parsed_into_cache_entries(ctrl):
+    assert ctrl.state_entry("PS -2.0") == ("PS", -2.0)
+    assert ctrl.state_entry("PS 2") == ("PS", 2.0)
+    assert ctrl.state_entry("FN2") == ("FN", "2")
+    # Actions and values that are no number are never cached
+    assert ctrl.state_entry("SW1") == (None, None)
+    assert ctrl.state_entry("PS abc") == (None, None)
+    assert ctrl.state_entry("FNX") == (None, None)
+
+def test_same_value_written_differently_is_skipped(ctrl, conn):
+    ctrl.command("PS 2")
+    ctrl.command("PS 2.0")
+    ctrl.command("FN2")
+    ctrl.command("FN2")
+    assert conn.sent() == ["PS 2", "FN2"]
+    assert ctrl.state == {"PS": 2.0, "FN": "2"}
+
+def test_actions_are_always_sent(ctrl, conn):
+    ctrl.command("SW1")
+    ctrl.command("SW1")
+    assert conn.sent() == ["SW1", "SW1"]
+
+def test_failed_write_is_sent_again(ctrl, conn, monkeypatch):
+    pyvisa = pytest.importorskip("pyvisa")
+    ctrl.command("PS 1.0")
+    write = conn.write
+    def fail(command):
+        raise pyvisa.errors.VisaIOError(pyvisa.constants.StatusCode.error_timeout)
+    monkeypatch.setattr(conn, "write", fail)
+    ctrl.command("PS 2.0")
+    assert "PS" not in ctrl.state
+    monkeypatch.setattr(conn, "write", write)
+    ctrl.command("PS 1.0")
+    assert conn.sent() == ["PS 1.0", "PS 1.0"]
+
+@pytest.mark.parametrize("reset", ["clear", "reconnect"])
+def test_cache_is_dropped_when_the_instrument_may_have_been_reset(ctrl, conn, reset):
+    ctrl.command("FN2")
+    ctrl.command("PS 1.0")
+    getattr(ctrl, reset)()
+    assert ctrl.state == {}
+    ctrl.command("FN2")
+    assert conn.sent()[-1] == "FN2"
+
+def test_setters_only_send_what_changed(ctrl, conn):
+    ctrl.single_config()
+    first = conn.sent()[-1]
+    ctrl.single_config()
+    ctrl.set_StopV(2.0)
+    assert conn.sent()[-2:] == [first, "PP 2.0"]
+    assert ctrl.measurement_speed() is None
+    ctrl.command("MS1")
+    assert ctrl.measurement_speed() == "fast"
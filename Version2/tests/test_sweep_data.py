@@ -0,0 +1,91 @@
+import os
+import numpy as np
+import pytest
+from data_save import load_measurement, data_folder
+from sweep_data import (split_field, parse_row, parse_block, to_columns, format_fields, normalize_block,
+                        decode_binary_block, points_from_values, format_rows)
+
+CV_BLOCK = "NCM+6.8859E-11,NGM+8.6886E-07,V-1.000E+00\r\nNCM+1.0281E-11,NGM+1.6657E-07,V+0.000E+00\r\nNCM+1.0080E-11,NGM+1.2697E-07,V+1.000E+00\r\n"
+CT_BLOCK = "NCM+1.2000E-11,T+0.000E+00\nNCM+1.1000E-11,T+1.500E-01\n"
+
+def test_split_field():
+    assert split_field("NCM+6.8859E-11") == ("NCM", 6.8859e-11)
+    assert split_field('"V-1.000E+00"') == ("V", -1.0)
+    assert split_field(" 12.5 ") == ("", 12.5)
+    assert split_field("OVERFLOW") == (None, None)
+
+def test_to_columns_strips_the_prefixes_in_one_pass():
+    prefixes, values = to_columns(CV_BLOCK)
+    assert prefixes == ["NCM", "NGM", "V"]
+    assert values.shape == (3, 3)
+    np.testing.assert_allclose(values[:, 0], [6.8859e-11, 1.0281e-11, 1.0080e-11])
+    assert values[:, 2].tolist() == [-1.0, 0.0, 1.0]
+
+def test_to_columns_ignores_quotes_and_blank_lines():
+    prefixes, values = to_columns('\n"NCM+1.0E-11","V+1.0E+00"\n\n"NCM+2.0E-11","V+2.0E+00"\n')
+    assert prefixes == ["NCM", "V"]
+    assert values.tolist() == [[1e-11, 1.0], [2e-11, 2.0]]
+
+def test_to_columns_falls_back_for_other_status_codes():
+    # An over range reading (O instead of N) keeps its prefix after the fast replace
+    prefixes, values = to_columns("NCM+1.0E-11,V+1.0E+00\nOCM+9.9999E+09,V+2.0E+00\n")
+    assert prefixes == ["NCM", "V"]
+    assert values.tolist() == [[1e-11, 1.0], [9.9999e9, 2.0]]
+
+def test_to_columns_falls_back_for_text_and_ragged_rows():
+    prefixes, values = to_columns("NCM+1.0E-11,V+1.0E+00\nERROR\nNCM+2.0E-11,NGM+1.0E-07,V+2.0E+00\n")
+    assert prefixes == ["NCM", "V", ""]
+    assert values.shape == (3, 3)
+    assert np.isnan(values[1]).all()
+    assert values[2].tolist() == [2e-11, 1e-07, 2.0]
+    assert np.isnan(values[0, 2])
+
+def test_to_columns_of_nothing():
+    prefixes, values = to_columns(" \r\n")
+    assert prefixes == [] and values.shape == (0, 0)
+
+def test_format_fields_round_trips():
+    prefixes, values = to_columns(CV_BLOCK)
+    assert format_fields(prefixes, values)[0] == ["NCM+6.8859E-11", "NGM+8.6886E-07", "V-1.0000E+00"]
+    again_prefixes, again = to_columns("\n".join(",".join(row) for row in format_fields(prefixes, values)))
+    assert again_prefixes == prefixes
+    np.testing.assert_allclose(again, values)
+
+def test_format_fields_leaves_missing_values_empty():
+    assert format_fields(["NCM", "V"], [[1e-11, np.nan]]) == [["NCM+1.0000E-11", ""]]
+
+def test_normalize_block():
+    assert normalize_block("A,B\n\r\n C,D \n") == "A,B\r\nC,D\r\n"
+
+def test_parse_row():
+    assert parse_row("NCM+1.0E-11,NGM+1.0E-07,V-2.0E+00") == {"axis": "V", "x": -2.0, "c": 1e-11}
+    assert parse_row("NCM+1.0E-11,T+1.5E-01") == {"axis": "T", "x": 0.15, "c": 1e-11}
+    assert parse_row("NCM+0.0E+00,V-2.0E+00") is None  # No reading
+    assert parse_row("garbage") is None
+
+def test_parse_block():
+    points = parse_block(CT_BLOCK)
+    assert [point["x"] for point in points] == [0.0, 0.15]
+    assert all(point["axis"] == "T" for point in points)
+    assert len(parse_block(CV_BLOCK)) == 3
+
+def test_decode_binary_block_drops_the_terminator():
+    raw = np.array([1.5, -2.0], dtype='>f4').tobytes() + b"\r\n"
+    assert decode_binary_block(raw).tolist() == [1.5, -2.0]
+
+def test_points_from_values_skips_unusable_readings():
+    values = np.array([[1e-11, 1e-7, -1.0], [0.0, 1e-7, 0.0], [np.nan, 1e-7, 0.5], [2e-11, 1e-7, 1.0]])
+    assert [point["x"] for point in points_from_values(values, "V")] == [-1.0, 1.0]
+
+def test_binary_readings_are_written_like_ascii_ones():
+    rows = format_rows(np.array([[1e-11, 1e-7, -1.0]]), "V")
+    assert rows == [["NCM+1.0000E-11", "NGM+1.0000E-07", "V-1.0000E+00"]]
+
+@pytest.mark.parametrize("transfer", ["ascii", "binary"])
+def test_both_transfer_modes_save_the_same_columns(ctrl, conn, transfer):
+    ctrl.apply_settings({"Start_V": -1.0, "Stop_V": 1.0, "Step_V": 0.5, "Hold_T": 0.0, "Step_T": 0.0})
+    filename = ctrl.sweep_measure(transfer=transfer, storage="npz")
+    prefixes, values, metadata = load_measurement(os.path.join(data_folder(), filename))
+    assert prefixes == ["NCM", "NGM", "V"]
+    assert values[:, 2].tolist() == [-1.0, -0.5, 0.0, 0.5, 1.0]
+    assert metadata["transfer"] == transfer
@@ -0,0 +1,132 @@
+import os
+import pytest
+from data_save import data_folder
+from sweep_data import to_columns
+from sweep_planner import plan_sweep, plan_cv, plan_ct, plan_pulse, round_to, MAX_READINGS
+
+CV = {"DC_V": 0.0, "Start_V": -1.0, "Stop_V": 1.0, "Step_V": 0.5, "Hold_T": 0.1, "Step_T": 0.2}
+CT = {"Pulse": -5.0, "Meas": 2.0, "Nofread": 20, "Pulse_Width": 1.0, "Meas_Interval": 0.5}
+
+def test_round_to_resolution():
+    assert round_to(0.123, 0.01) == 0.12
+    assert round_to(-0.125001, 0.01) == -0.13
+    assert round_to(1.0004, 0.001) == 1.0
+
+def test_cv_plan_counts_readings_and_time():
+    plan = plan_cv(CV)
+    assert plan.ok and not plan.warnings
+    assert (plan.steps, plan.readings) == (4, 5)
+    assert plan.duration == pytest.approx(5 * 0.3 + 1.0)
+    assert plan.to_dict()["ascii_bytes"] == 5 * 45
+    assert plan.to_dict()["binary_bytes"] == 5 * 3 * 4
+
+def test_cv_plan_matches_the_controllers_estimate(ctrl):
+    plan = plan_cv(CV)
+    ctrl.Start_V, ctrl.Stop_V, ctrl.Step_V, ctrl.Hold_T, ctrl.Step_T = (CV[name] for name in ("Start_V", "Stop_V", "Step_V", "Hold_T", "Step_T"))
+    assert ctrl.sweep_time_calc() == pytest.approx(plan.duration)
+
+def test_values_are_rounded_with_a_warning():
+    plan = plan_cv(dict(CV, Start_V=-1.004))
+    assert plan.ok
+    assert plan.settings["Start_V"] == -1.0
+    assert plan.warnings == ["Start_V rounded from -1.004 to -1 V."]
+
+@pytest.mark.parametrize("change, error", [
+    ({"Stop_V": 150}, "Stop_V must be between -100 and 100 V."),
+    ({"Step_V": 0}, "Step_V must be between 0.01 and 200 V."),
+    ({"Hold_T": -1}, "Hold_T must be between 0 and 650 s."),
+    ({"Start_V": "abc"}, "Start_V is not a number."),
+    ({"Stop_V": -1.0}, "Start and stop voltage are the same."),
+    ({"Step_V": 5.0}, "Step voltage (5 V) is larger than the sweep (2 V)."),
+])
+def test_cv_plan_rejects(change, error):
+    plan = plan_cv(dict(CV, **change))
+    assert not plan.ok
+    assert plan.errors == [error]
+
+def test_cv_plan_rejects_more_readings_than_the_buffer_holds():
+    plan = plan_cv(dict(CV, Start_V=-10, Stop_V=10, Step_V=0.01))
+    assert plan.readings == 2001 > MAX_READINGS
+    assert not plan.ok
+
+def test_cv_plan_warns_when_the_last_step_falls_short():
+    plan = plan_cv(dict(CV, Start_V=0.0, Stop_V=1.0, Step_V=0.3))
+    assert plan.ok and plan.readings == 4
+    assert plan.warnings == ["The sweep ends at 0.9 V, the last whole step before 1 V."]
+
+def test_cv_plan_sweeps_down_as_well():
+    plan = plan_cv(dict(CV, Start_V=1.0, Stop_V=-1.0))
+    assert plan.ok and plan.readings == 5
+    assert plan.duration == plan_cv(CV).duration
+
+def test_downward_sweep_matches_the_controllers_estimate(ctrl):
+    plan = plan_cv(dict(CV, Start_V=5.0, Stop_V=-5.0, Step_V=0.1))
+    ctrl.Start_V, ctrl.Stop_V, ctrl.Step_V, ctrl.Hold_T, ctrl.Step_T = 5.0, -5.0, 0.1, CV["Hold_T"], CV["Step_T"]
+    assert plan.readings == ctrl.step_calc() == 101
+    assert ctrl.sweep_estimate() == pytest.approx(plan.duration) == pytest.approx(101 * 0.3 + 1.0)
+
+def test_double_sweep_reads_on_the_way_back(ctrl, conn):
+    plan = plan_cv(CV, double=True)
+    assert (plan.steps, plan.readings) == (8, 9)
+    assert plan.duration == pytest.approx(9 * 0.3 + 1.0)
+
+    # The controller knows the bias mode from the last IB it sent, and the simulated
+    # instrument returns as many readings as planned
+    ctrl.Start_V, ctrl.Stop_V, ctrl.Step_V, ctrl.Hold_T, ctrl.Step_T = (CV[name] for name in ("Start_V", "Stop_V", "Step_V", "Hold_T", "Step_T"))
+    ctrl.single_config()
+    ctrl.set_double()
+    assert ctrl.double_sweep()
+    assert ctrl.sweep_estimate() == pytest.approx(plan.duration)
+    response = ctrl.sweep_measure(storage="csv")
+    with open(os.path.join(data_folder(), response), newline='') as file:
+        assert len(to_columns(file.read())[1]) == plan.readings
+
+def test_double_sweep_counts_against_the_buffer():
+    settings = dict(CV, Start_V=-5.0, Stop_V=5.0, Step_V=0.02)
+    assert plan_cv(settings).ok
+    plan = plan_cv(settings, double=True)
+    assert plan.readings == 1001
+    assert not plan.ok and "exceed the 680" in plan.errors[0]
+
+def test_ct_plan():
+    plan = plan_ct(CT)
+    assert plan.ok
+    assert (plan.readings, plan.columns) == (20, 2)
+    assert plan.duration == pytest.approx(20 * 0.5 + 1.0 + 1.0)
+
+@pytest.mark.parametrize("speed, interval, ok", [
+    ("fast", 0.1, False),
+    ("fast", 0.15, True),
+    ("medium", 0.2, False),
+    ("slow", 0.01, True),
+    (None, 0.01, True),
+])
+def test_ct_plan_minimum_interval_depends_on_speed(speed, interval, ok):
+    assert plan_ct(dict(CT, Meas_Interval=interval), speed).ok == ok
+
+def test_ct_plan_rejects_too_many_readings():
+    assert not plan_ct(dict(CT, Nofread=MAX_READINGS + 1)).ok
+
+def test_pulse_plan():
+    plan = plan_pulse(dict(CV, Stop_V=2.0))
+    assert plan.ok
+    assert (plan.pulses, plan.readings) == (4, 8)
+    assert plan.duration == pytest.approx(4 * (2 * 0.3 + 1.0 + 0.5))
+
+def test_pulse_plan_needs_at_least_one_step():
+    plan = plan_pulse(dict(CV, Stop_V=0.2))
+    assert plan.errors == ["A pulse sweep needs a stop voltage of at least one step (0.5 V)."]
+
+def test_pulse_plan_matches_the_controllers_schedule(ctrl):
+    plan = plan_pulse(dict(CV, Stop_V=2.0))
+    ctrl.Step_V, ctrl.Stop_V = plan.settings["Step_V"], plan.settings["Stop_V"]
+    assert len(ctrl.pulse_schedule()) == plan.pulses
+
+def test_plan_sweep_picks_the_planner():
+    assert plan_sweep(CV).sweep_type == "voltage"
+    assert plan_sweep(CT, "time").sweep_type == "time"
+    assert plan_sweep(CV, "pulse").sweep_type == "pulse"
+
+def test_plan_settings_can_be_sent_as_they_are(ctrl, conn):
+    ctrl.apply_settings(plan_cv(dict(CV, Start_V=-1.004)).settings)
+    assert conn.sent() == ["PV 0.0;PS -1.0;PP 1.0;PE 0.5;PL 0.1;PD 0.2"]
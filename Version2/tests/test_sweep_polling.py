@@ -0,0 +1,52 @@
+import threading
+import time
+from conftest import LoggingSimulator
+from controller import controller
+from jobs import Job
+
+# Controller on a simulator running at the instrument's real speed
+def real_time(**settings):
+    conn = LoggingSimulator(time_scale=1.0, seed=0, verbose=False)
+    conn.connect()
+    ctrl = controller(conn, **dict(dict(DC_V=0.0, Start_V=1.0, Stop_V=-1.0, Step_V=0.05, Hold_T=0.0, Step_T=0.05,
+                                        Pulse=0.0, Meas=0.0, Nofread=10.0, Pulse_Width=1.0, Meas_Interval=0.15), **settings))
+    with ctrl.batched(settle=0):
+        ctrl.single_config()
+        ctrl.command("MS1")
+    return ctrl, conn
+
+def test_downward_sweep_has_the_same_estimate(ctrl):
+    ctrl.Start_V, ctrl.Stop_V, ctrl.Step_V, ctrl.Step_T = 5.0, -5.0, 0.1, 0.2
+    downward = ctrl.sweep_estimate()
+    ctrl.Start_V, ctrl.Stop_V = -5.0, 5.0
+    assert downward == ctrl.sweep_estimate() > 0
+
+def test_downward_sweep_finishes_at_real_speed(user_profile):
+    # 41 readings 70 ms apart, about 3 s on the instrument. A small margin makes a deadline
+    # computed from a negative estimate fall before the sweep starts
+    ctrl, conn = real_time()
+    ctrl.SWEEP_TIMEOUT_MARGIN = 0.5
+    started = time.monotonic()
+    filename = ctrl.sweep_measure()
+    assert filename is not None
+    assert time.monotonic() - started < 5
+    assert "SW0" in conn.sent()
+
+def test_sweep_is_aborted_after_the_deadline():
+    ctrl, conn = real_time()
+    ctrl.SWEEP_TIMEOUT_MARGIN = 0.2
+    started = time.monotonic()
+    conn.write("SW1;BL1;BD")
+    assert ctrl.wait_for_sweep(estimate=0) is None
+    assert time.monotonic() - started < 1
+    assert conn.sent()[-1].startswith("SW0")
+
+def test_cancelled_job_stops_waiting():
+    ctrl, conn = real_time(Step_T=1.0)
+    job = Job(1, "GPIB0::17::INSTR", "demo", "C-V", None)
+    conn.write("SW1;BL1;BD")
+    threading.Timer(0.2, job.cancel).start()
+    started = time.monotonic()
+    assert ctrl.wait_for_sweep(job) is None
+    assert time.monotonic() - started < 2
+    assert 0 < job.progress < 0.99
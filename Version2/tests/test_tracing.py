@@ -0,0 +1,112 @@
+import pytest
+import controller
+from tracing import Tracer, command_name, percentile, prometheus_labels, LATENCY_BUCKETS
+
+INSTRUMENT = "GPIB0::17::INSTR"
+REMOTE = {"REMOTE_ADDR": "10.0.0.5"}
+
+class VisaError(Exception):
+    abbreviation = "VI_ERROR_TMO"
+    error_code = -1073807339
+
+def test_commands_are_grouped_without_their_values():
+    assert command_name("PS -1.0;PP 2;SW1") == "PS;PP;SW"
+    assert command_name("READ?") == "READ?"
+    assert command_name("block (ASCII)") == "block (ASCII)"
+
+def test_percentile():
+    assert percentile([], 0.95) is None
+    assert percentile([3, 1, 2], 0.5) == 2
+    assert percentile(list(range(100)), 0.95) == 95
+
+def test_calls_are_recorded_with_their_errors():
+    tracer = Tracer()
+    with tracer.call("write", "PS 1.0", INSTRUMENT) as call:
+        call.bytes = 6
+    with pytest.raises(VisaError):
+        with tracer.call("query", "ID?", INSTRUMENT):
+            raise VisaError()
+    with tracer.call("read", "block (ASCII)", INSTRUMENT) as call:
+        call.fail(ValueError("handled by the caller"))
+
+    newest, failed, written = tracer.recent_calls()
+    assert written["bytes"] == 6 and written["error"] is None and written["latency_ms"] >= 0
+    assert failed["error"] == "VI_ERROR_TMO" and failed["code"] == VisaError.error_code
+    assert newest["error"] == "ValueError" and newest["code"] is None
+    summary = {row["kind"]: row for row in tracer.summary()}
+    assert summary["write"]["count"] == 1 and summary["write"]["bytes"] == 6
+    assert summary["query"]["errors"] == 1 and summary["read"]["errors"] == 1
+
+def test_buffer_keeps_the_newest_calls_but_totals_keep_counting():
+    tracer = Tracer(size=3)
+    for n in range(5):
+        with tracer.call("write", f"PS {n}", INSTRUMENT):
+            pass
+    assert [call["command"] for call in tracer.recent_calls()] == ["PS 4", "PS 3", "PS 2"]
+    assert tracer.summary()[0]["count"] == 5
+    (group,) = tracer.command_summary()
+    assert (group["kind"], group["command"], group["count"], group["errors"]) == ("write", "PS", 3, 0)
+
+def test_sweep_phases_and_outcome():
+    tracer = Tracer()
+    with tracer.sweep(INSTRUMENT, "C-V") as timing:
+        with timing.phase("setup"):
+            pass
+        assert tracer.recent_sweeps()[0]["outcome"] == "running"
+        timing.readings = 5
+    with pytest.raises(RuntimeError):
+        with tracer.sweep(INSTRUMENT, "C-V"):
+            raise RuntimeError("lost the instrument")
+    failed, done = tracer.recent_sweeps()
+    assert done["outcome"] == "done" and done["readings"] == 5
+    assert set(done["phases_s"]) == {"setup", "acquisition", "transfer", "save", "other"}
+    assert failed["outcome"] == "failed"
+    assert tracer.sweep_totals == {(INSTRUMENT, "C-V", "done"): 1, (INSTRUMENT, "C-V", "failed"): 1}
+
+def test_prometheus_text_format():
+    tracer = Tracer()
+    for _ in range(2):
+        with tracer.call("write", "SW1", INSTRUMENT):
+            pass
+    with pytest.raises(VisaError):
+        with tracer.call("read", "block (ASCII)", INSTRUMENT):
+            raise VisaError()
+    text = tracer.prometheus()
+    lines = text.splitlines()
+    assert text.endswith("\n")
+    assert "# TYPE hp4280a_gpib_operations_total counter" in lines
+    assert f'hp4280a_gpib_operations_total{{instrument="{INSTRUMENT}",kind="write"}} 2' in lines
+    assert f'hp4280a_gpib_errors_total{{instrument="{INSTRUMENT}",kind="read",error="VI_ERROR_TMO"}} 1' in lines
+    # Histogram buckets are cumulative and end with +Inf, which equals the count
+    buckets = [line for line in lines if line.startswith("hp4280a_gpib_latency_seconds_bucket") and 'kind="write"' in line]
+    counts = [int(line.rsplit(" ", 1)[1]) for line in buckets]
+    assert len(buckets) == len(LATENCY_BUCKETS) + 1 and buckets[-1].endswith('le="+Inf"} 2')
+    assert counts == sorted(counts)
+    assert f'hp4280a_gpib_latency_seconds_count{{instrument="{INSTRUMENT}",kind="write"}} 2' in lines
+
+def test_label_values_are_escaped():
+    assert prometheus_labels({}) == ""
+    assert prometheus_labels({"a": 'say "hi"\\\n'}) == '{a="say \\"hi\\"\\\\\\n"}'
+
+def test_sweep_is_traced_by_the_controller(ctrl, monkeypatch):
+    tracer = Tracer()
+    monkeypatch.setattr(controller, "tracer", tracer)
+    ctrl.apply_settings({"Start_V": -1.0, "Stop_V": 1.0, "Step_V": 0.5})
+    ctrl.sweep_measure()
+    sweep = tracer.recent_sweeps()[0]
+    assert sweep["outcome"] == "done" and sweep["type"] == "C-V" and sweep["readings"] == 5
+    assert sweep["instrument"] == ctrl.conn.get_MAC()
+    commands = [call["command"] for call in tracer.recent_calls()]
+    assert "SW1" in commands and "READ?" in commands
+
+def test_metrics_need_an_admin_unless_scraped_locally(main, client, admin_client):
+    assert main.app.test_client().get('/metrics').status_code == 200
+    assert main.app.test_client().get('/metrics', environ_base=REMOTE).status_code == 403
+    assert client.get('/metrics', environ_base=REMOTE).status_code == 403
+    response = admin_client.get('/metrics', environ_base=REMOTE)
+    assert response.status_code == 200 and response.mimetype == "text/plain"
+    assert b"# TYPE hp4280a_sweeps_total counter" in response.data
+
+def test_metrics_page_is_for_admins(client, admin_client):
+    assert client.get('/admin_metrics').status_code == 302
+    assert admin_client.get('/admin_metrics').status_code == 200
@@ -0,0 +1,143 @@
+import gzip
+import json
+import os
+import numpy as np
+import pytest
+from controller import controller
+from data_save import data_folder, load_measurement
+from instruments import InstrumentRegistry
+from simulated_visacon import SimulatedVisaCon
+from transport import (RecordingVisaCon, ReplayMismatch, ReplayVisaCon, READY_STB, describe, load_session, pack,
+                       replay, session_path, unpack)
+
+SETTINGS = {"Start_V": -1.0, "Stop_V": 1.0, "Step_V": 0.5, "Hold_T": 0.0, "Step_T": 0.05}
+
+def new_controller(conn):
+    ctrl = controller(conn, 5.0, -1.0, 1.0, 0.5, 0.0, 0.05, 0.0, 0.0, 10, 1.0, 1.0)
+    ctrl.apply_settings(SETTINGS)
+    return ctrl
+
+# Runs an ASCII and a binary sweep and returns their readings
+def sweeps(ctrl):
+    values = []
+    for transfer in ("ascii", "binary"):
+        path = os.path.join(data_folder(), ctrl.sweep_measure(transfer=transfer))
+        values.append(load_measurement(path)[1])
+        os.remove(path)  # Sweeps in the same second share a name
+    return values
+
+@pytest.fixture
+def recording(tmp_path):
+    path = str(tmp_path / "session.jsonl.gz")
+    conn = RecordingVisaCon(SimulatedVisaCon(time_scale=0, seed=0, verbose=False), path)
+    conn.connect()
+    recorded = sweeps(new_controller(conn))
+    conn.close_recording()
+    return path, recorded
+
+def write_session(path, events):
+    with gzip.open(path, "wt", encoding="utf-8") as file:
+        file.write(json.dumps({"version": 1, "address": "GPIB0::17::INSTR", "started": 0}) + "\n")
+        for n, event in enumerate(events):
+            file.write(json.dumps(dict({"t": n * 0.01, "d": 0.0}, **event)) + "\n")
+    return path
+
+def test_responses_are_packed_for_json():
+    assert unpack(pack("NCM+1.0E-11")) == "NCM+1.0E-11"
+    assert unpack(pack(b"\x00\x01\r\n")) == b"\x00\x01\r\n"
+    assert np.allclose(unpack(pack([1.5, -2.0])), [1.5, -2.0])
+    assert json.dumps(pack(np.arange(3.0)))
+
+def test_session_file_is_named_after_the_station(tmp_path):
+    path = session_path(str(tmp_path), "GPIB0::17::INSTR")
+    assert os.path.dirname(path) == str(tmp_path)
+    assert os.path.basename(path).startswith("session_") and path.endswith("_GPIB0-17.jsonl.gz")
+
+def test_every_call_of_a_sweep_is_recorded(recording):
+    path, _ = recording
+    header, events = load_session(path)
+    assert header["address"] == "GPIB0::17::INSTR"
+    ops = [event["op"] for event in events]
+    assert ops.count("stb") >= 2 and "read" in ops and "read_binary" in ops
+    assert [event["cmd"] for event in events if event["op"] == "write"][:3] == ["PS -1.0;PP 1.0;PE 0.5;PL 0.0;PD 0.05", "V01", "SW1"]
+    assert all(event["t"] >= 0 and event["d"] >= 0 for event in events)
+
+def test_replayed_session_gives_the_recorded_readings(recording):
+    path, recorded = recording
+    conn = ReplayVisaCon(path, speed=0, strict=True)
+    conn.connect()
+    replayed = sweeps(new_controller(conn))
+    assert conn.finished() and conn.skipped == 0
+    assert [len(values) for values in replayed] == [5, 5]
+    for before, after in zip(recorded, replayed):
+        assert np.array_equal(before, after)
+
+def test_replay_speed_scales_the_sweep_waits(recording):
+    path, _ = recording
+    assert ReplayVisaCon(path, speed=10).time_scale == pytest.approx(0.1)
+    assert ReplayVisaCon(path, speed=0).time_scale == 0.0
+
+def test_strict_replay_stops_at_the_first_different_call(tmp_path):
+    path = write_session(str(tmp_path / "s.jsonl.gz"), [{"op": "write", "cmd": "FN2"}, {"op": "write", "cmd": "SW1"}])
+    conn = ReplayVisaCon(path, speed=0, strict=True)
+    with pytest.raises(ReplayMismatch, match="recording has write FN2"):
+        conn.write("SW1")
+    # A lenient replay skips ahead to the call the controller makes
+    conn = ReplayVisaCon(path, speed=0)
+    conn.write("SW1")
+    assert conn.skipped == 1 and conn.finished()
+    with pytest.raises(ReplayMismatch, match="the end of the recording"):
+        conn.write("SW0")
+
+def test_status_polls_are_matched_loosely(tmp_path):
+    path = write_session(str(tmp_path / "s.jsonl.gz"), [{"op": "stb", "data": 0}, {"op": "stb", "data": 0},
+                                                        {"op": "stb", "data": 1}, {"op": "write", "cmd": "READ?"},
+                                                        {"op": "read", "data": "NCM+1.0E-11,NGM+0.0E+00,V+0.0E+00"}])
+    conn = ReplayVisaCon(path, speed=0, strict=True)
+    assert conn.read_stb() == 0
+    # Fewer polls than recorded: the rest are passed over
+    conn.write("READ?")
+    assert conn.read().startswith("NCM") and conn.skipped == 2
+    # More polls than recorded: the data is ready by now
+    assert conn.read_stb() == 0
+    assert ReplayVisaCon(write_session(str(tmp_path / "e.jsonl.gz"), []), speed=0).read_stb() == READY_STB
+
+def test_recorded_errors_are_raised_again(tmp_path):
+    pyvisa = pytest.importorskip("pyvisa")
+    timeout = int(pyvisa.constants.StatusCode.error_timeout)
+    path = write_session(str(tmp_path / "s.jsonl.gz"), [
+        {"op": "read", "error": {"code": timeout, "name": "VI_ERROR_TMO", "message": "Timeout"}},
+        {"op": "read", "error": {"code": None, "name": "OSError", "message": "bus error"}}])
+    conn = ReplayVisaCon(path, speed=0)
+    with pytest.raises(pyvisa.errors.VisaIOError) as error:
+        conn.read()
+    assert error.value.error_code == timeout
+    with pytest.raises(ReplayMismatch, match="Recorded OSError: bus error"):
+        conn.read()
+
+def test_streamed_read_is_replayed_chunk_by_chunk(tmp_path):
+    path = str(tmp_path / "stream.jsonl.gz")
+    conn = RecordingVisaCon(SimulatedVisaCon(time_scale=0, seed=0, verbose=False), path)
+    conn.connect()
+    conn.write("PS -1;PP 1;PE 0.5;SW1")
+    recorded = list(conn.read_stream(chunk_size=16))
+    conn.close_recording()
+    replayed = ReplayVisaCon(path, speed=0, strict=False)
+    assert list(replayed.read_stream()) == recorded and len(recorded) > 1
+
+def test_session_summary_and_timed_replay(recording):
+    path, _ = recording
+    info = describe(path)
+    assert info["address"] == "GPIB0::17::INSTR" and info["calls"] == sum(kind["calls"] for kind in info["kinds"].values())
+    result = replay(path, speed=0)
+    assert result["calls"] == info["calls"] and result["errors"] == 0
+
+def test_registry_records_the_sessions_it_opens(tmp_path):
+    folder = str(tmp_path / "sessions")
+    simulator = lambda addr: SimulatedVisaCon(addr, time_scale=0, seed=0, verbose=False)
+    instrument = InstrumentRegistry(None, simulator, record_folder=folder).get("GPIB0::17::INSTR", simulated=True)
+    assert isinstance(instrument.conn, RecordingVisaCon) and instrument.conn.io_lock is instrument.bus
+    instrument.conn.inst.write("FN2")
+    instrument.conn.close_recording()
+    (name,) = os.listdir(folder)
+    assert [event["cmd"] for event in load_session(os.path.join(folder, name))[1]] == ["FN2"]
@@ -0,0 +1,65 @@
+import database
+from conftest import login
+
+def counting_lookups(monkeypatch):
+    lookups = []
+    lookup = database.get_user_by_email
+    def counted(email):
+        lookups.append(email)
+        return lookup(email)
+    monkeypatch.setattr(database, "get_user_by_email", counted)
+    return lookups
+
+def test_user_is_looked_up_once_within_the_ttl(db, monkeypatch):
+    lookups = counting_lookups(monkeypatch)
+    first = db.get_cached_user("demo@hp4280a.com")
+    assert db.get_cached_user("demo@hp4280a.com") is first
+    assert lookups == ["demo@hp4280a.com"]
+
+    monkeypatch.setattr(db, "USER_CACHE_TTL", 0.0)
+    db.get_cached_user("demo@hp4280a.com")
+    assert len(lookups) == 2
+
+def test_unknown_users_are_not_cached(db, monkeypatch):
+    lookups = counting_lookups(monkeypatch)
+    assert db.get_cached_user("nobody@hp4280a.com") is None
+    assert db.get_cached_user("nobody@hp4280a.com") is None
+    assert len(lookups) == 2
+
+def test_invalidation_of_one_or_every_user(db, monkeypatch):
+    lookups = counting_lookups(monkeypatch)
+    for email in ("demo@hp4280a.com", "admin@hp4280a.com"):
+        db.get_cached_user(email)
+    db.invalidate_user_cache("demo@hp4280a.com")
+    db.get_cached_user("demo@hp4280a.com")
+    db.get_cached_user("admin@hp4280a.com")
+    assert lookups == ["demo@hp4280a.com", "admin@hp4280a.com", "demo@hp4280a.com"]
+    db.invalidate_user_cache()
+    db.get_cached_user("admin@hp4280a.com")
+    assert lookups[-1] == "admin@hp4280a.com" and len(lookups) == 4
+
+def test_deleting_a_user_drops_the_cache(db):
+    db.add_user("Gone", "User", "gone@hp4280a.com", "gone")
+    user = db.get_cached_user("gone@hp4280a.com")
+    db.delete_user_by_id(user[0])
+    assert db.get_cached_user("gone@hp4280a.com") is None
+
+def test_one_lookup_per_request(main, monkeypatch):
+    lookups = []
+    monkeypatch.setattr(main, "get_cached_user", lambda email: lookups.append(email) or ("row",))
+    with main.app.test_request_context('/'):
+        main.session["email"] = "demo@hp4280a.com"
+        assert main.current_user() is main.current_user()
+    assert lookups == ["demo@hp4280a.com"]
+
+def test_granting_admin_rights_takes_effect_at_once(main, admin_client):
+    if main.get_user_by_email("granted@hp4280a.com") is None:
+        main.add_user("Granted", "User", "granted@hp4280a.com", "granted")
+    client = login(main, "granted@hp4280a.com", "granted")
+    assert client.get('/admin_measure').status_code == 302  # Not an admin yet, and now cached
+
+    user_id = main.get_user_by_email("granted@hp4280a.com")[0]
+    admin_client.post('/documentation', data={"action": "grant_admin", "user_id": user_id})
+    assert client.get('/admin_measure').status_code == 200
+    admin_client.post('/documentation', data={"action": "revoke_admin", "user_id": user_id})
+    assert client.get('/admin_measure').status_code == 302
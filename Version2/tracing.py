@@ -0,0 +1,268 @@
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Timing of every exchange with the instruments.
+# The controller records each write, query, block read and status poll (command, bytes,
+# latency and VISA error) in a ring buffer for the admin metrics page, and adds it to
+# running totals per instrument that never roll over, for the Prometheus /metrics endpoint.
+# Sweeps also record how long they spent in each phase:
+#   setup        program codes that start the sweep
+#   acquisition  waiting for the instrument to take the readings
+#   transfer     READ? and reading the block back
+#   save         writing the result file
+
+TRACE_SIZE = 2000  # Calls kept for the metrics page
+SWEEP_HISTORY = 50  # Sweeps kept for the metrics page
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)  # Seconds
+PHASES = ("setup", "acquisition", "transfer", "save")
+COMMAND_NAME = re.compile(r'([A-Za-z*?]+)[\s\d.+\-Ee]*')  # Program code and its value
+
+# Name of a command for grouping: its program codes without values ("PS 1.0;SW1" -> "PS;SW")
+def command_name(command):
+    names = []
+    for code in command.split(';'):
+        match = COMMAND_NAME.fullmatch(code.strip())
+        if match is None:
+            return command  # Not a program string, e.g. "block (ASCII)"
+        names.append(match.group(1))
+    return ";".join(names)
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+class Call:
+    def __init__(self, kind, command, instrument):
+        self.kind = kind  # write, query, read or status
+        self.command = command
+        self.instrument = instrument
+        self.time = time.time()
+        self.start = time.perf_counter()
+        self.latency = None
+        self.bytes = 0
+        self.error = None  # VISA error name (e.g. VI_ERROR_TMO) or exception type
+        self.code = None  # VISA status code
+
+    # Records the error of a call the controller handles itself
+    def fail(self, error):
+        self.error = getattr(error, "abbreviation", None) or type(error).__name__
+        self.code = int(error.error_code) if getattr(error, "error_code", None) is not None else None
+
+    def as_dict(self):
+        return {
+            "time": self.time,
+            "instrument": self.instrument,
+            "kind": self.kind,
+            "command": self.command,
+            "bytes": self.bytes,
+            "latency_ms": round(self.latency * 1000, 3) if self.latency is not None else None,
+            "error": self.error,
+            "code": self.code,
+        }
+
+class Totals:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)  # Calls at or below each bucket bound
+
+    def add(self, call):
+        self.count += 1
+        self.errors += call.error is not None
+        self.bytes += call.bytes
+        self.seconds += call.latency
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if call.latency <= bound:
+                self.buckets[i] += 1
+
+class SweepTiming:
+    def __init__(self, instrument, sweep_type):
+        self.instrument = instrument
+        self.type = sweep_type
+        self.time = time.time()
+        self.start = time.perf_counter()
+        self.total = None
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.readings = 0
+        self.outcome = None  # done, aborted, cancelled or failed; done if nothing else was set
+
+    # Adds the time spent in the block to a phase; a phase may be entered many times
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+    def as_dict(self):
+        total = self.total if self.total is not None else time.perf_counter() - self.start
+        phases = {name: round(seconds, 3) for name, seconds in self.phases.items()}
+        phases["other"] = round(max(total - sum(self.phases.values()), 0.0), 3)
+        return {
+            "time": self.time,
+            "instrument": self.instrument,
+            "type": self.type,
+            "outcome": self.outcome or "running",
+            "readings": self.readings,
+            "total_s": round(total, 3),
+            "phases_s": phases,
+        }
+
+class Tracer:
+    def __init__(self, size=TRACE_SIZE, sweeps=SWEEP_HISTORY):
+        self.lock = threading.Lock()
+        self.calls = deque(maxlen=size)
+        self.sweeps = deque(maxlen=sweeps)
+        self.totals = {}  # (instrument, kind) -> Totals
+        self.errors = {}  # (instrument, kind, error) -> count
+        self.sweep_totals = {}  # (instrument, type, outcome) -> count
+        self.phase_totals = {}  # (instrument, type, phase) -> seconds
+
+    # Times the I/O in the block; an exception that escapes is recorded as the call's error
+    @contextmanager
+    def call(self, kind, command, instrument):
+        call = Call(kind, command, instrument)
+        try:
+            yield call
+        except BaseException as e:
+            if call.error is None:
+                call.fail(e)
+            raise
+        finally:
+            call.latency = time.perf_counter() - call.start
+            self.record(call)
+
+    def record(self, call):
+        with self.lock:
+            self.calls.append(call)
+            self.totals.setdefault((call.instrument, call.kind), Totals()).add(call)
+            if call.error is not None:
+                key = (call.instrument, call.kind, call.error)
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    # Times the phases of one sweep; the sweep is listed as running until the block ends
+    @contextmanager
+    def sweep(self, instrument, sweep_type):
+        timing = SweepTiming(instrument, sweep_type)
+        with self.lock:
+            self.sweeps.append(timing)
+        try:
+            yield timing
+        except BaseException:
+            timing.outcome = "failed"
+            raise
+        finally:
+            timing.total = time.perf_counter() - timing.start
+            timing.outcome = timing.outcome or "done"
+            with self.lock:
+                key = (instrument, sweep_type, timing.outcome)
+                self.sweep_totals[key] = self.sweep_totals.get(key, 0) + 1
+                for name, seconds in timing.phases.items():
+                    key = (instrument, sweep_type, name)
+                    self.phase_totals[key] = self.phase_totals.get(key, 0.0) + seconds
+
+    def recent_calls(self, limit=100):
+        with self.lock:
+            calls = list(self.calls)[-limit:]
+        return [call.as_dict() for call in reversed(calls)]
+
+    def recent_sweeps(self):
+        with self.lock:
+            sweeps = list(self.sweeps)
+        return [sweep.as_dict() for sweep in reversed(sweeps)]
+
+    # Totals per instrument and kind, with latency percentiles of the calls still in the buffer
+    def summary(self):
+        with self.lock:
+            totals = {key: (value.count, value.errors, value.bytes, value.seconds) for key, value in self.totals.items()}
+            latencies = {}
+            for call in self.calls:
+                latencies.setdefault((call.instrument, call.kind), []).append(call.latency)
+        rows = []
+        for (instrument, kind), (count, errors, size, seconds) in sorted(totals.items()):
+            recent = latencies.get((instrument, kind), [])
+            rows.append({
+                "instrument": instrument,
+                "kind": kind,
+                "count": count,
+                "errors": errors,
+                "bytes": size,
+                "total_s": round(seconds, 3),
+                "mean_ms": round(seconds / count * 1000, 3) if count else None,
+                "p95_ms": round(percentile(recent, 0.95) * 1000, 3) if recent else None,
+                "max_ms": round(max(recent) * 1000, 3) if recent else None,
+            })
+        return rows
+
+    # Calls in the buffer grouped by command name, most total time first
+    def command_summary(self, limit=20):
+        with self.lock:
+            calls = list(self.calls)
+        groups = {}
+        for call in calls:
+            group = groups.setdefault((call.kind, command_name(call.command)), [0, 0.0, 0, 0.0])
+            group[0] += 1
+            group[1] += call.latency
+            group[2] += call.error is not None
+            group[3] = max(group[3], call.latency)
+        rows = [{"kind": kind, "command": name, "count": count, "total_ms": round(seconds * 1000, 3),
+                 "mean_ms": round(seconds / count * 1000, 3), "max_ms": round(longest * 1000, 3), "errors": errors}
+                for (kind, name), (count, seconds, errors, longest) in groups.items()]
+        rows.sort(key=lambda row: row["total_ms"], reverse=True)
+        return rows[:limit]
+
+    # Totals in the Prometheus text exposition format
+    def prometheus(self):
+        with self.lock:
+            totals = {key: (value.count, value.errors, value.bytes, value.seconds, list(value.buckets))
+                      for key, value in self.totals.items()}
+            errors = dict(self.errors)
+            sweeps = dict(self.sweep_totals)
+            phases = dict(self.phase_totals)
+
+        lines = []
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{prometheus_labels(labels)} {value:g}" if isinstance(value, float)
+                             else f"{name}{suffix}{prometheus_labels(labels)} {value}")
+
+        items = sorted(totals.items())
+        metric("hp4280a_gpib_operations_total", "counter", "Instrument I/O operations.",
+               [("", {"instrument": i, "kind": k}, t[0]) for (i, k), t in items])
+        metric("hp4280a_gpib_bytes_total", "counter", "Bytes written to or read from the instruments.",
+               [("", {"instrument": i, "kind": k}, t[2]) for (i, k), t in items])
+        metric("hp4280a_gpib_errors_total", "counter", "Instrument I/O operations that failed, by error.",
+               [("", {"instrument": i, "kind": k, "error": e}, n) for (i, k, e), n in sorted(errors.items())])
+        histogram = []
+        for (instrument, kind), (count, _, _, seconds, buckets) in items:
+            labels = {"instrument": instrument, "kind": kind}
+            for bound, calls in zip(LATENCY_BUCKETS, buckets):
+                histogram.append(("_bucket", dict(labels, le=f"{bound:g}"), calls))
+            histogram.append(("_bucket", dict(labels, le="+Inf"), count))
+            histogram.append(("_sum", labels, seconds))
+            histogram.append(("_count", labels, count))
+        metric("hp4280a_gpib_latency_seconds", "histogram", "Latency of instrument I/O operations.", histogram)
+        metric("hp4280a_sweeps_total", "counter", "Sweeps run, by outcome.",
+               [("", {"instrument": i, "type": t, "outcome": o}, n) for (i, t, o), n in sorted(sweeps.items())])
+        metric("hp4280a_sweep_phase_seconds_total", "counter", "Time sweeps spent in each phase.",
+               [("", {"instrument": i, "type": t, "phase": p}, s) for (i, t, p), s in sorted(phases.items())])
+        return "\n".join(lines) + "\n"
+
+def prometheus_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+# Shared by every controller in the app
+tracer = Tracer()
@@ -0,0 +1,397 @@
+import argparse
+import atexit
+import base64
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+import numpy as np
+
+# Recording and replay of instrument sessions.
+# RecordingVisaCon wraps a connection (VisaCon or SimulatedVisaCon) and writes every call
+# the controller and the health monitor make on its VISA resource to a gzip file of JSON
+# lines: when it started, how long it took, what was sent and what came back (or the VISA
+# error). ReplayVisaCon takes the place of the connection and answers the same calls from
+# such a file, taking the recorded time divided by `speed`, so a session captured on the
+# bench can be run again without the instrument:
+#   conn = ReplayVisaCon("session.jsonl.gz", speed=10)
+#   ctrl = controller(conn, ...)
+#   ctrl.sweep_measure()
+# The app records every session it opens when HP4280A_RECORD names a folder.
+#   python transport.py info session.jsonl.gz
+#   python transport.py replay session.jsonl.gz --speed 10
+
+FORMAT_VERSION = 1
+EXTENSION = ".jsonl.gz"
+FLUSH_EVENTS = 50  # Events written between flushes, so a crash loses at most this many
+LOOKAHEAD = 50  # Recorded calls a lenient replay may skip to find the one the controller makes
+READY_STB = 0x01  # Status byte answered once the recorded polls have run out
+
+class ReplayMismatch(Exception):
+    """The controller made a call the recording does not have at this point."""
+
+# JSON form of a response: text as is, bytes and binary values base64 encoded
+def pack(value):
+    if isinstance(value, bytes):
+        return {"b64": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, (np.ndarray, list, tuple)):
+        return {"f4": base64.b64encode(np.asarray(value, dtype='>f4').tobytes()).decode("ascii")}
+    return value
+
+def unpack(value):
+    if isinstance(value, dict):
+        if "b64" in value:
+            return base64.b64decode(value["b64"])
+        if "f4" in value:
+            return np.frombuffer(base64.b64decode(value["f4"]), dtype='>f4').astype(float)
+    return value
+
+# File name for a new recording of the instrument at addr
+def session_path(folder, addr):
+    station = re.sub(r'[^A-Za-z0-9]+', '-', addr.replace("::INSTR", "")).strip('-')
+    return os.path.join(folder, f"session_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{station}{EXTENSION}")
+
+class Recorder:
+    def __init__(self, path, addr):
+        self.path = path
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.events = 0
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+        self.write_line({"version": FORMAT_VERSION, "address": addr, "started": time.time()})
+        atexit.register(self.close)
+        print(f"Recording instrument session to {path}")
+
+    def write_line(self, entry):
+        self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    # Records one call; started is its time.perf_counter() at the start
+    def event(self, op, started, command=None, data=None, error=None, **extra):
+        entry = {"t": round(started - self.start, 6), "d": round(time.perf_counter() - started, 6), "op": op}
+        if command is not None:
+            entry["cmd"] = command
+        if data is not None:
+            entry["data"] = pack(data)
+        if error is not None:
+            entry["error"] = {"code": int(error.error_code) if getattr(error, "error_code", None) is not None else None,
+                              "name": getattr(error, "abbreviation", None) or type(error).__name__,
+                              "message": str(error)}
+        entry.update(extra)
+        with self.lock:
+            if self.file is None:
+                return
+            self.write_line(entry)
+            self.events += 1
+            if self.events % FLUSH_EVENTS == 0:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+class RecordingInstrument:
+    """VISA resource wrapper that records every call made on it."""
+    def __init__(self, inner, recorder):
+        object.__setattr__(self, "inner", inner)
+        object.__setattr__(self, "recorder", recorder)
+
+    # Runs the call and records it with its response or error
+    def call(self, op, function, command=None, record_data=True):
+        started = time.perf_counter()
+        try:
+            result = function()
+        except Exception as e:
+            self.recorder.event(op, started, command, error=e)
+            raise
+        self.recorder.event(op, started, command, result if record_data else None)
+        return result
+
+    def write(self, command, *args, **kwargs):
+        return self.call("write", lambda: self.inner.write(command, *args, **kwargs), command, record_data=False)
+
+    def read(self, *args, **kwargs):
+        return self.call("read", lambda: self.inner.read(*args, **kwargs))
+
+    def query(self, command, *args, **kwargs):
+        return self.call("query", lambda: self.inner.query(command, *args, **kwargs), command)
+
+    def read_raw(self, *args, **kwargs):
+        return self.call("read_raw", lambda: self.inner.read_raw(*args, **kwargs))
+
+    def read_binary_values(self, *args, **kwargs):
+        return self.call("read_binary", lambda: self.inner.read_binary_values(*args, **kwargs))
+
+    def read_stb(self):
+        return self.call("stb", self.inner.read_stb)
+
+    def clear(self):
+        return self.call("clear", self.inner.clear, record_data=False)
+
+    # Everything else (timeout, encoding, close, ...) goes straight to the resource
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.inner, name, value)
+
+class RecordingVisaCon:
+    """Connection wrapper that records the session of a VisaCon or SimulatedVisaCon."""
+    def __init__(self, conn, path):
+        self.conn = conn
+        self.recorder = Recorder(path, conn.get_MAC())
+        self.wrapped = None
+
+    # Connection state and the bus lock stay on the wrapped connection, where its own methods use them
+    @property
+    def connected(self):
+        return self.conn.connected
+
+    @connected.setter
+    def connected(self, value):
+        self.conn.connected = value
+
+    @property
+    def io_lock(self):
+        return self.conn.io_lock
+
+    @io_lock.setter
+    def io_lock(self, lock):
+        self.conn.io_lock = lock
+
+    # The resource is wrapped again whenever the connection opens a new one
+    @property
+    def inst(self):
+        inner = self.conn.inst
+        if inner is None:
+            return None
+        if self.wrapped is None or self.wrapped.inner is not inner:
+            self.wrapped = RecordingInstrument(inner, self.recorder)
+        return self.wrapped
+
+    # Records a streamed response as one call with the arrival time of every chunk
+    def read_stream(self, chunk_size=256):
+        started = time.perf_counter()
+        chunks, arrived = [], []
+        try:
+            for chunk in self.conn.read_stream(chunk_size):
+                chunks.append(chunk)
+                arrived.append(round(time.perf_counter() - started, 6))
+                yield chunk
+        except Exception as e:
+            self.recorder.event("stream", started, error=e, chunks=[pack(chunk) for chunk in chunks], arrived=arrived)
+            raise
+        self.recorder.event("stream", started, chunks=[pack(chunk) for chunk in chunks], arrived=arrived)
+
+    def close_recording(self):
+        self.recorder.close()
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+# Header and calls of a recorded session
+def load_session(path):
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        header = json.loads(file.readline())
+        if header.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{path} has session format {header.get('version')}, expected {FORMAT_VERSION}")
+        events = [json.loads(line) for line in file if line.strip()]
+    return header, events
+
+# VISA error of a recorded call; pyvisa is only needed when a recording has errors
+def recorded_error(error):
+    if error.get("code") is not None:
+        from pyvisa.errors import VisaIOError
+        return VisaIOError(error["code"])
+    return ReplayMismatch(f"Recorded {error.get('name')}: {error.get('message')}")
+
+class ReplayVisaCon:
+    """Connection that answers from a recorded session instead of an instrument.
+    speed divides the recorded time of every call (0 answers at once), and the controller
+    scales its sweep waits by time_scale to match. A strict replay
+    fails on the first call that differs from the recording; otherwise up to LOOKAHEAD
+    recorded calls are skipped to find it, and status polls are matched loosely because
+    their number depends on timing."""
+    def __init__(self, path, speed=1.0, strict=False, timeout=10000):
+        self.path = path
+        self.header, self.events = load_session(path)
+        self.addr = self.header.get("address")
+        self.speed = speed
+        self.time_scale = 1.0 / speed if speed > 0 else 0.0  # See controller.time_scale()
+        self.strict = strict
+        self.timeout = timeout
+        self.write_delay = 0.0
+        self.query_delay = 0.0
+        self.encoding = "ascii"
+        self.connected = False
+        self.inst = self  # The controller uses the connection as its VISA resource too
+        self.io_lock = threading.RLock()
+        self.position = 0
+        self.skipped = 0  # Recorded calls passed over to stay in step with the controller
+        self.last_stb = READY_STB
+
+    def connect(self):
+        self.connected = True
+        print(f"Replaying {len(self.events)} recorded calls of {self.addr} from {self.path}")
+
+    def disconnect(self):
+        self.connected = False
+
+    def close(self):
+        self.connected = False
+
+    def check_connection(self, force_check=False):
+        return self.connected
+
+    def get_MAC(self):
+        return self.addr
+
+    def set_MAC(self, addr):
+        self.addr = addr
+
+    def get_timeout(self):
+        return self.timeout
+
+    def set_timeout(self, timeout):
+        self.timeout = timeout
+
+    def get_device_id(self):
+        return self.query("ID?")
+
+    def finished(self):
+        return self.position >= len(self.events)
+
+    def matches(self, event, op, command):
+        return event["op"] == op and (command is None or event.get("cmd") == command)
+
+    # The recorded call that answers this one
+    def next_event(self, op, command=None):
+        events = self.events
+        # Polls the recording made but this run does not
+        while op != "stb" and self.position < len(events) and events[self.position]["op"] == "stb":
+            self.position += 1
+            self.skipped += 1
+        if self.position < len(events) and self.matches(events[self.position], op, command):
+            self.position += 1
+            return events[self.position - 1]
+        if op == "stb":
+            return None  # More polls than recorded: the sweep is done by now
+        if not self.strict:
+            for index in range(self.position + 1, min(self.position + 1 + LOOKAHEAD, len(events))):
+                if self.matches(events[index], op, command):
+                    self.skipped += index - self.position
+                    self.position = index + 1
+                    return events[index]
+        found = events[self.position] if self.position < len(events) else None
+        expected = f"{found['op']} {found.get('cmd', '')}".strip() if found else "the end of the recording"
+        raise ReplayMismatch(f"Call {self.position}: controller made {op} {command or ''}, recording has {expected}")
+
+    # Takes the recorded time of the call, then returns its response or raises its error
+    def answer(self, event):
+        if self.speed > 0 and event["d"] > 0:
+            time.sleep(event["d"] / self.speed)
+        if "error" in event:
+            raise recorded_error(event["error"])
+        return unpack(event.get("data"))
+
+    def write(self, command):
+        self.answer(self.next_event("write", command))
+
+    def read(self):
+        return self.answer(self.next_event("read"))
+
+    def query(self, command):
+        return self.answer(self.next_event("query", command))
+
+    def read_raw(self):
+        return self.answer(self.next_event("read_raw"))
+
+    def read_binary_values(self, datatype='f', is_big_endian=True, container=list, header_fmt='empty', expect_termination=True):
+        return container(self.answer(self.next_event("read_binary")))
+
+    def read_stb(self):
+        event = self.next_event("stb")
+        if event is None:
+            return self.last_stb
+        self.last_stb = self.answer(event)
+        return self.last_stb
+
+    def clear(self):
+        self.answer(self.next_event("clear"))
+
+    def read_stream(self, chunk_size=256):
+        event = self.next_event("stream")
+        previous = 0.0
+        for chunk, arrived in zip(event.get("chunks", []), event.get("arrived", [])):
+            if self.speed > 0:
+                time.sleep(max(arrived - previous, 0.0) / self.speed)
+            previous = arrived
+            yield unpack(chunk)
+        if "error" in event:
+            raise recorded_error(event["error"])
+
+# Plays the recorded calls in their original order and spacing (divided by speed)
+def replay(path, speed=1.0):
+    conn = ReplayVisaCon(path, speed, strict=True)
+    conn.connect()
+    start = time.perf_counter()
+    errors = 0
+    for event in list(conn.events):
+        if speed > 0:
+            time.sleep(max(event["t"] / speed - (time.perf_counter() - start), 0.0))
+        handler = {
+            "write": lambda: conn.write(event["cmd"]),
+            "query": lambda: conn.query(event["cmd"]),
+            "read": conn.read,
+            "read_raw": conn.read_raw,
+            "read_binary": conn.read_binary_values,
+            "stb": conn.read_stb,
+            "clear": conn.clear,
+            "stream": lambda: list(conn.read_stream()),
+        }.get(event["op"])
+        try:
+            handler()
+        except ReplayMismatch:
+            raise
+        except Exception:
+            errors += 1  # Errors the recording has
+    return {
+        "calls": len(conn.events),
+        "errors": errors,
+        "recorded_s": round(conn.events[-1]["t"] + conn.events[-1]["d"], 3) if conn.events else 0.0,
+        "replayed_s": round(time.perf_counter() - start, 3),
+    }
+
+# Number, time and traffic of the calls in a recording, by kind
+def describe(path):
+    header, events = load_session(path)
+    kinds = {}
+    for event in events:
+        kind = kinds.setdefault(event["op"], {"calls": 0, "errors": 0, "seconds": 0.0})
+        kind["calls"] += 1
+        kind["errors"] += "error" in event
+        kind["seconds"] += event["d"]
+    for kind in kinds.values():
+        kind["seconds"] = round(kind["seconds"], 3)
+    return {
+        "address": header.get("address"),
+        "started": datetime.fromtimestamp(header["started"]).isoformat(timespec="seconds") if "started" in header else None,
+        "calls": len(events),
+        "duration_s": round(events[-1]["t"] + events[-1]["d"], 3) if events else 0.0,
+        "kinds": kinds,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or replay a recorded instrument session.")
+    parser.add_argument("action", choices=["info", "replay"])
+    parser.add_argument("path")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay this many times faster (0 = no waiting)")
+    args = parser.parse_args()
+    if args.action == "info":
+        print(json.dumps(describe(args.path), indent=2))
+    else:
+        print(json.dumps(replay(args.path, args.speed), indent=2))
@@ -1,19 +1,39 @@
-import pyvisa
 import sys
+import threading
 
-# VisaCon class to connect and disconnect from GPIB instruments
+DEFAULT_ADDRESS = "GPIB1::17::INSTR"
+
+# pyvisa takes a noticeable time to import, so it is only loaded once an instrument is opened
+class NoVisaError(Exception):
+    """Stands in for pyvisa's VisaIOError when pyvisa is not installed; never raised."""
+
+# pyvisa's VisaIOError, for except clauses (they only evaluate it when an exception is raised)
+def visa_error():
+    try:
+        from pyvisa.errors import VisaIOError
+    except ImportError:
+        return NoVisaError
+    return VisaIOError
+
+# VisaCon class to connect and disconnect from GPIB instruments.
+# Connects when created; pass connect=False to call connect() later (the instrument registry does)
 class VisaCon:
-    def __init__(self, addr="GPIB1::17::INSTR", timeout=10000):
+    def __init__(self, addr=DEFAULT_ADDRESS, timeout=10000, rm=None, connect=True):
         self.addr = addr
         self.timeout = timeout
+        self.rm = rm  # Shared ResourceManager, created on first connect if not given
         self.inst = None
         self.connected = False  # NEW: Track connection status explicitly
-        self.connect()
+        self.io_lock = threading.RLock()  # Held for every exchange with the instrument
+        if connect:
+            self.connect()
 
     # Connects to the instrument
     def connect(self):
+        import pyvisa
         try:
-            self.rm = pyvisa.ResourceManager()
+            if self.rm is None:
+                self.rm = pyvisa.ResourceManager()
             self.inst = self.rm.open_resource(self.addr)
             if self.inst is not None:
                 self.inst.timeout = self.timeout
@@ -42,7 +62,7 @@ class VisaCon:
                 self.inst.close()
                 print("Disconnected from", self.addr)
                 self.connected = False  # NEW: Ensure connected status is updated
-        except pyvisa.errors.VisaIOError as e:
+        except visa_error() as e:
             error_code = e.error_code
             print(f"GPIB Communication Error [{error_code}]: {e.description}")
 
@@ -64,6 +84,16 @@ class VisaCon:
             return self.inst.query('ID?')
         return None
 
+    # Yields the next response in chunks as the instrument sends it
+    def read_stream(self, chunk_size=256):
+        import pyvisa
+        while True:
+            chunk, status = self.inst.visalib.read(self.inst.session, chunk_size)
+            yield chunk
+            # success_max_count_read means the instrument has more data for this response
+            if status != pyvisa.constants.StatusCode.success_max_count_read:
+                break
+
     def check_connection(self, force_check=False):
         if force_check:
             try: